@@ -0,0 +1,308 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import zipfile
+
+import requests
+
+try:
+    import fcntl
+except ImportError:  # Windows, where only threads of the same process are kept from downloading twice
+    fcntl = None
+
+CHUNK_SIZE = 1024 * 1024
+
+# Expected artifacts when no manifest file is present; a sha256 of None is trusted on first download
+DEFAULT_MANIFEST = {
+    "archive": {
+        "url": "https://link.storjshare.io/s/jwrsgkkankl7zkpqjpwv3ahspoyq/moroccoai/model_and_network.zip?download=1",
+        "filename": "model_and_network.zip",
+        "sha256": None,
+    },
+    "files": {
+        "rf_depth_to_water.pkl": {"sha256": None},
+        "well_network.gpickle": {"sha256": None},
+    },
+}
+
+
+def sha256_of(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ArtifactManager:
+    """
+    Fetches the model and well network artifacts listed in a manifest, doing only the work that is missing.
+
+    The manifest names the archive the artifacts ship in (URL, file name and optional sha256) and the
+    expected sha256 of each artifact. `ensure` returns at once when the artifact on disk matches it.
+    New versions are published with `publish`, which replaces the artifact and its hash in the manifest
+    together, so any other mismatch is corruption and the artifact is restored from the archive.
+    To restore it `ensure` downloads the archive as a stream into a `.part` file, resuming an interrupted
+    download with an HTTP Range request, verifies it and extracts only the member that is needed.
+    The size, modification time and hash of every verified file are kept in a state file, so matching
+    artifacts are not re-hashed on each start. A lock file keeps concurrent processes from downloading
+    the same archive twice.
+
+    Attributes:
+        directory: Directory the archive and artifacts are stored in.
+        manifest: Expected archive and artifacts.
+    """
+
+    def __init__(self, directory='bins', manifest_filepath=None, max_retries=5, base_delay_s=1.0, timeout_s=60):
+        """
+        Args:
+            directory (str): Directory the archive and artifacts are stored in.
+            manifest_filepath (str): JSON manifest, defaults to `artifacts.json` in `directory` if it exists,
+                else DEFAULT_MANIFEST.
+            max_retries (int): Number of times an interrupted download is resumed before giving up.
+            base_delay_s (float): Wait before the first resume, doubled on each following one.
+            timeout_s (float): Connect and read timeout of the download requests.
+        """
+        self.directory = directory
+        self.manifest_filepath = manifest_filepath or os.path.join(directory, 'artifacts.json')
+        self.manifest = self.load_manifest()
+        self.max_retries = max_retries
+        self.base_delay_s = base_delay_s
+        self.timeout_s = timeout_s
+        self.state_filepath = os.path.join(directory, '.artifacts_state.json')
+        self.lock_filepath = os.path.join(directory, '.artifacts.lock')
+        self._lock = threading.Lock()
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_filepath):
+            return DEFAULT_MANIFEST
+        with open(self.manifest_filepath) as f:
+            return json.load(f)
+
+    def ensure(self, filepath, repair=True):
+        """
+        Make sure the artifact at `filepath` is present and matches the manifest, fetching it from the archive if not.
+
+        Args:
+            filepath (str): Path of the artifact.
+            repair (bool): Replace an artifact that differs from the manifest with the one from the archive,
+                instead of only refusing it.
+
+        Returns:
+            bool: Whether the artifact is usable.
+        """
+        name = os.path.basename(filepath)
+        if name not in self.manifest["files"]:
+            return os.path.exists(filepath)
+        if self.verify(filepath, self.manifest["files"][name].get("sha256")):
+            return True
+
+        with self.locked():
+            # Another thread or process may have fetched or published it while we waited for the lock
+            self.manifest = self.load_manifest()
+            expected = self.manifest["files"][name].get("sha256")
+            if self.verify(filepath, expected):
+                return True
+            if os.path.exists(filepath) and not repair:
+                logging.error(f"Refusing {filepath}, which differs from the manifest without having been published")
+                return False
+            if os.path.exists(filepath):
+                logging.warning(f"{filepath} differs from the manifest without having been published, restoring it from the archive")
+            archive_filepath = self.ensure_archive()
+            self.extract_member(archive_filepath, name, filepath, expected)
+            return True
+
+    def publish(self, source_filepath, name=None):
+        """
+        Replace the artifact `name` with `source_filepath` and pin its hash in the manifest.
+
+        Both are written under the lock, so `ensure` never takes the published file for a corrupt one.
+
+        Args:
+            source_filepath (str): New version of the artifact, moved into the artifact directory.
+            name (str): File name of the artifact, defaults to the name of `source_filepath`.
+
+        Returns:
+            str: Path of the published artifact.
+        """
+        name = name or os.path.basename(source_filepath)
+        filepath = os.path.join(self.directory, name)
+        digest = sha256_of(source_filepath)
+        with self.locked():
+            manifest = json.loads(json.dumps(self.load_manifest()))
+            manifest["files"].setdefault(name, {})["sha256"] = digest
+            tmp_filepath = f"{self.manifest_filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_filepath, 'w') as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(tmp_filepath, self.manifest_filepath)
+            self.manifest = manifest
+            os.replace(source_filepath, filepath)
+            self.record(filepath, digest)
+        logging.info(f"Published {filepath} (sha256 {digest})")
+        return filepath
+
+    @contextlib.contextmanager
+    def locked(self):
+        """
+        Hold the lock of the artifact directory, shared by every thread and process using it.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, open(self.lock_filepath, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def verify(self, filepath, expected_sha256=None):
+        if not os.path.exists(filepath):
+            return False
+        stat = os.stat(filepath)
+        state = self.load_state().get(os.path.abspath(filepath))
+        if state and state["size"] == stat.st_size and state["mtime_ns"] == stat.st_mtime_ns:
+            digest = state["sha256"]
+        else:
+            digest = sha256_of(filepath)
+            self.record(filepath, digest)
+        if expected_sha256 and digest != expected_sha256:
+            logging.warning(f"{filepath} does not match the manifest (sha256 {digest}, expected {expected_sha256})")
+            return False
+        return True
+
+    def ensure_archive(self):
+        archive = self.manifest["archive"]
+        archive_filepath = os.path.join(self.directory, archive["filename"])
+        if self.verify(archive_filepath, archive.get("sha256")) and zipfile.is_zipfile(archive_filepath):
+            logging.info(f"Archive already downloaded at: {archive_filepath}")
+            return archive_filepath
+
+        part_filepath = archive_filepath + '.part'
+        self.download(archive["url"], part_filepath)
+        digest = sha256_of(part_filepath)
+        if archive.get("sha256") and digest != archive["sha256"]:
+            os.remove(part_filepath)
+            raise ValueError(f"Downloaded archive has sha256 {digest}, expected {archive['sha256']}")
+        if not zipfile.is_zipfile(part_filepath):
+            os.remove(part_filepath)
+            raise ValueError(f"Downloaded archive from {archive['url']} is not a ZIP file")
+        os.replace(part_filepath, archive_filepath)
+        self.record(archive_filepath, digest)
+        return archive_filepath
+
+    def download(self, url, part_filepath):
+        """
+        Stream `url` into `part_filepath`, resuming from the bytes already there.
+        """
+        for attempt in range(self.max_retries + 1):
+            offset = os.path.getsize(part_filepath) if os.path.exists(part_filepath) else 0
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            try:
+                with requests.get(url, headers=headers, stream=True, timeout=self.timeout_s) as response:
+                    if response.status_code == 416:
+                        # The part file already holds the whole archive
+                        return
+                    response.raise_for_status()
+                    resumed = response.status_code == 206
+                    if offset and not resumed:
+                        logging.info(f"Server ignored the range request, restarting download of {url}")
+                    logging.info(f"Downloading {url} to {part_filepath}" + (f" from byte {offset}" if resumed else ""))
+                    with open(part_filepath, 'ab' if resumed else 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                            f.write(chunk)
+                    expected_size = response.headers.get("Content-Length")
+                    written = os.path.getsize(part_filepath) - (offset if resumed else 0)
+                    if expected_size is not None and written < int(expected_size):
+                        raise requests.exceptions.ChunkedEncodingError(f"Download ended after {written} of {expected_size} bytes")
+                logging.info(f"Downloaded {os.path.getsize(part_filepath)} bytes from {url}")
+                return
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay_s = min(self.base_delay_s * 2 ** attempt, 30)
+                logging.warning(f"Download of {url} interrupted ({e}), resuming in {delay_s:.1f} s")
+                time.sleep(delay_s)
+
+    def extract_member(self, archive_filepath, name, filepath, expected_sha256=None):
+        with zipfile.ZipFile(archive_filepath) as archive:
+            members = [member for member in archive.namelist() if os.path.basename(member) == name]
+            if not members:
+                raise FileNotFoundError(f"{name} is not in {archive_filepath}")
+            logging.info(f"Extracting {members[0]} from {archive_filepath} to {filepath}")
+            directory = os.path.dirname(filepath)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_filepath = f"{filepath}.tmp"
+            # Reading the member to the end checks its CRC
+            with archive.open(members[0]) as source, open(tmp_filepath, 'wb') as target:
+                shutil.copyfileobj(source, target, CHUNK_SIZE)
+        digest = sha256_of(tmp_filepath)
+        if expected_sha256 and digest != expected_sha256:
+            os.remove(tmp_filepath)
+            raise ValueError(f"{name} extracted from {archive_filepath} has sha256 {digest}, expected {expected_sha256}")
+        os.replace(tmp_filepath, filepath)
+        self.record(filepath, digest)
+
+    def load_state(self):
+        try:
+            with open(self.state_filepath) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def record(self, filepath, digest):
+        stat = os.stat(filepath)
+        state = self.load_state()
+        state[os.path.abspath(filepath)] = {"sha256": digest, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        tmp_filepath = f"{self.state_filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_filepath, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_filepath, self.state_filepath)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fetch the model and well network artifacts listed in the manifest')
+    parser.add_argument("--directory", default='bins', help="Directory the artifacts are stored in")
+    parser.add_argument("--manifest", help="JSON manifest of the expected artifacts")
+    parser.add_argument("--check", action='store_true',
+                        help="Only report artifacts that differ from the manifest instead of restoring them from the archive")
+    parser.add_argument("--publish", nargs='+', default=[],
+                        help="New versions of artifacts to move into the directory, pinning their hashes in the manifest")
+    parser.add_argument("--write-manifest", action='store_true',
+                        help="Write the hashes of the verified artifacts to the manifest, pinning the current versions")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    manager = ArtifactManager(args.directory, args.manifest)
+    for source_filepath in args.publish:
+        manager.publish(source_filepath)
+    for name in manager.manifest["files"]:
+        filepath = os.path.join(args.directory, name)
+        if manager.ensure(filepath, repair=not args.check):
+            print(f"{filepath}: {sha256_of(filepath)}")
+        else:
+            print(f"{filepath}: differs from the manifest")
+
+    if args.write_manifest:
+        manifest = json.loads(json.dumps(manager.manifest))
+        for name in manifest["files"]:
+            manifest["files"][name]["sha256"] = sha256_of(os.path.join(args.directory, name))
+        archive_filepath = os.path.join(args.directory, manifest["archive"]["filename"])
+        if os.path.exists(archive_filepath):
+            manifest["archive"]["sha256"] = sha256_of(archive_filepath)
+        with open(manager.manifest_filepath, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        print(f"Manifest written to {manager.manifest_filepath}")
+
+
+if __name__ == '__main__':
+    main()
+
+# python artifact_manager.py --write-manifest
@@ -0,0 +1,165 @@
+import logging
+import threading
+import time
+
+from predictor import WellNetworkPredictor
+from prediction_memo import artifact_fingerprint
+
+# Time the predictions still running on a swapped-out version get to finish before it is closed
+RETIRED_PREDICTOR_GRACE_S = 300
+
+
+class ReloadingPredictor:
+    """
+    WellNetworkPredictor that picks up new model and well network artifacts without a restart.
+
+    A new version of the artifacts is loaded into a fresh WellNetworkPredictor on a background thread
+    and validated, then swapped in with a single reference assignment while the current one keeps
+    serving. Predictions started before the swap finish on the version they started with. The version
+    is the fingerprint of the artifact files, so publishing a file with `ArtifactManager.publish` (or
+    replacing it with an atomic rename when the manifest pins no hash for it) makes a new one; `watch` polls for that. It also applies the well changes other
+    processes append to the delta log, and reloads the well store when another process compacts it.
+
+    Attributes of the current WellNetworkPredictor are forwarded, so this class can be used in its place.
+    Code that makes several calls which must see the same version should call them on `snapshot()`.
+
+    Attributes:
+        current: The WellNetworkPredictor serving predictions.
+        loaded_at: Time the current version was swapped in.
+        last_error: Why the last reload was rejected, or None.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        Load the current artifacts.
+
+        Args:
+            *args, **kwargs: Arguments of WellNetworkPredictor, used for every version.
+        """
+        self._args = args
+        self._kwargs = kwargs
+        self._reload_lock = threading.Lock()
+        # Held while well changes are applied and while versions are swapped, so no change is lost in between
+        self._swap_lock = threading.Lock()
+        self._watch_thread = None
+        self.current = WellNetworkPredictor(*args, **kwargs)
+        self.loaded_at = time.time()
+        self.last_error = None
+
+    def __getattr__(self, name):
+        if name == 'current':
+            raise AttributeError(name)
+        return getattr(self.current, name)
+
+    def snapshot(self):
+        return self.current
+
+    def update_wells(self, wells=(), retired_node_ids=()):
+        with self._swap_lock:
+            return self.current.update_wells(wells, retired_node_ids)
+
+    def compact_well_network(self):
+        with self._swap_lock:
+            return self.current.compact_well_network()
+
+    def status(self):
+        current = self.current
+        return {
+            "artifact_version": current.artifact_version,
+            "loaded_at": self.loaded_at,
+            "reloading": self._reload_lock.locked(),
+            "last_error": self.last_error,
+        }
+
+    def reload(self, wait=False):
+        """
+        Load, validate and swap in the artifacts currently on disk, on a background thread unless `wait`.
+
+        Returns:
+            bool: Whether a reload was started, False if one is already running. With `wait`, whether
+                the new version was swapped in.
+        """
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        if wait:
+            return self._reload()
+        threading.Thread(target=self._reload, name='artifact-reload', daemon=True).start()
+        return True
+
+    def _reload(self):
+        try:
+            start = time.perf_counter()
+            logging.info("Loading new model and well network artifacts")
+            candidate = WellNetworkPredictor(*self._args, **self._kwargs)
+            problems = candidate.validate()
+            if problems:
+                self.last_error = "; ".join(problems)
+                logging.error(f"Rejected artifact version {candidate.artifact_version}: {self.last_error}")
+                candidate.close(wait=False)
+                return False
+
+            current = self.current
+            # Well changes logged while the candidate loaded are replayed on it before it takes over
+            with self._swap_lock:
+                n_logged = len(candidate.well_delta_log.read())
+                if n_logged < candidate.n_delta_ops:
+                    self.last_error = "Well network was compacted while loading"
+                    logging.warning(f"Rejected artifact version {candidate.artifact_version}: {self.last_error}, retrying on the next reload")
+                    candidate.close(wait=False)
+                    return False
+                if n_logged > candidate.n_delta_ops:
+                    candidate.well_index = candidate.replay_well_updates(candidate.well_index)
+                self.current = candidate
+                self.loaded_at = time.time()
+                self.last_error = None
+            logging.info(f"Swapped artifact version {current.artifact_version} for {candidate.artifact_version} "
+                         f"after loading for {time.perf_counter() - start:.1f} s")
+            if candidate.prediction_memo is not None:
+                candidate.prediction_memo.purge(candidate.artifact_fingerprint)
+            retire = threading.Timer(RETIRED_PREDICTOR_GRACE_S, current.close)
+            retire.daemon = True
+            retire.start()
+            return True
+        except Exception as e:
+            self.last_error = str(e)
+            logging.error(f"Error reloading artifacts: {e}")
+            return False
+        finally:
+            self._reload_lock.release()
+
+    def watch(self, interval_s=60):
+        """
+        Poll the artifact files every `interval_s` seconds and reload when their fingerprint changes.
+        """
+        if self._watch_thread is not None:
+            return
+        self._watch_thread = threading.Thread(target=self._watch, args=(interval_s,), name='artifact-watch', daemon=True)
+        self._watch_thread.start()
+
+    def _watch(self, interval_s):
+        rejected = None
+        while True:
+            time.sleep(interval_s)
+            if self._reload_lock.locked():
+                continue
+            try:
+                current = self.current
+                fingerprint = artifact_fingerprint(current.artifact_filepaths())
+                # A rejected version is not retried until its files change again
+                if fingerprint not in (current.artifact_fingerprint, rejected):
+                    logging.info(f"Artifact files changed (version {fingerprint[:12]}), reloading")
+                    if not self.reload(wait=True):
+                        rejected = fingerprint
+                    continue
+                # The store of a compaction of our own is only fingerprinted once it is done
+                if current.is_compacting():
+                    continue
+                # Reloading while a rejected version is on disk would load and reject it again
+                if fingerprint != rejected and artifact_fingerprint(current.store_filepaths()) != current.store_fingerprint:
+                    logging.info("Well store was compacted by another process, reloading")
+                    self.reload(wait=True)
+                    continue
+                with self._swap_lock:
+                    self.current.catch_up_well_updates()
+            except Exception as e:
+                logging.error(f"Error watching artifact files: {e}")
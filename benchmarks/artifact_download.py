@@ -0,0 +1,144 @@
+"""
+Exercise ArtifactManager against a local HTTP server standing in for the artifact host.
+
+The server serves a generated model_and_network.zip, honours Range requests and cuts the first
+responses short to force resumed downloads. The script checks that a cold start downloads the
+archive once even with two loaders racing, extracts only the requested member, verifies hashes, and
+that a warm start does no download or extraction.
+
+Usage:
+    python benchmarks/artifact_download.py [--size-mb 50] [--drops 2]
+"""
+import argparse
+import hashlib
+import http.server
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from artifact_manager import ArtifactManager  # noqa: E402
+
+
+def make_archive(size_mb):
+    members = {
+        "model_and_network/rf_depth_to_water.pkl": os.urandom(size_mb * 1024 * 1024),
+        "model_and_network/well_network.gpickle": os.urandom(size_mb * 1024 * 1024 // 4),
+    }
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buffer.getvalue(), {os.path.basename(name): hashlib.sha256(data).hexdigest() for name, data in members.items()}
+
+
+def make_handler(payload, drops, stats):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            start = 0
+            if "Range" in self.headers:
+                start = int(self.headers["Range"].split("=")[1].split("-")[0])
+                if start >= len(payload):
+                    self.send_response(416)
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{len(payload) - 1}/{len(payload)}")
+            else:
+                self.send_response(200)
+            body = payload[start:]
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            with stats["lock"]:
+                stats["requests"] += 1
+                drop = stats["drops"] < drops
+                stats["drops"] += drop
+            if drop:
+                # Send part of the body and hang up, like a flaky connection
+                self.wfile.write(body[:len(body) // 3])
+                self.wfile.flush()
+                self.connection.close()
+                return
+            self.wfile.write(body)
+            stats["bytes"] += len(body)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Exercise the artifact manager against a local HTTP server')
+    parser.add_argument("--size-mb", type=int, default=50, help="Size of the model in the generated archive")
+    parser.add_argument("--drops", type=int, default=2, help="Number of responses cut short by the server")
+    args = parser.parse_args()
+
+    payload, hashes = make_archive(args.size_mb)
+    stats = {"lock": threading.Lock(), "requests": 0, "drops": 0, "bytes": 0}
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), make_handler(payload, args.drops, stats))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as directory:
+        manifest = {
+            "archive": {"url": f"http://127.0.0.1:{server.server_port}/model_and_network.zip",
+                        "filename": "model_and_network.zip", "sha256": hashlib.sha256(payload).hexdigest()},
+            "files": {name: {"sha256": digest} for name, digest in hashes.items()},
+        }
+        with open(os.path.join(directory, "artifacts.json"), 'w') as f:
+            json.dump(manifest, f)
+        rf_filepath = os.path.join(directory, "rf_depth_to_water.pkl")
+        network_filepath = os.path.join(directory, "well_network.gpickle")
+
+        # Two loaders racing on a cold start, like load_rf_model in two processes
+        start = time.perf_counter()
+        managers = [ArtifactManager(directory, base_delay_s=0) for _ in range(2)]
+        threads = [threading.Thread(target=manager.ensure, args=(rf_filepath,)) for manager in managers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        cold_s = time.perf_counter() - start
+        print(f"cold start: {cold_s * 1000:.0f} ms, {stats['requests']} requests ({stats['drops']} cut short), "
+              f"{len(payload) / 1e6:.1f} MB archive")
+        assert stats["requests"] == args.drops + 1, "archive was downloaded more than once"
+        assert os.path.exists(rf_filepath) and not os.path.exists(network_filepath), "extracted more than the requested member"
+
+        requests_before = stats["requests"]
+        start = time.perf_counter()
+        assert ArtifactManager(directory).ensure(network_filepath)
+        print(f"second member from the downloaded archive: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        start = time.perf_counter()
+        assert ArtifactManager(directory).ensure(rf_filepath)
+        assert ArtifactManager(directory).ensure(network_filepath)
+        print(f"warm start: {(time.perf_counter() - start) * 1000:.1f} ms")
+        assert stats["requests"] == requests_before, "warm start hit the network"
+
+        # A model overwritten in place is corrupt: refused when only checking, restored from the archive otherwise
+        with open(rf_filepath, 'r+b') as f:
+            f.write(b'corrupted')
+        assert not ArtifactManager(directory).ensure(rf_filepath, repair=False)
+        assert ArtifactManager(directory).ensure(rf_filepath)
+        assert hashlib.sha256(open(rf_filepath, 'rb').read()).hexdigest() == hashes["rf_depth_to_water.pkl"]
+        print("model differing from the manifest was refused, and restored from the archive on repair")
+
+        # A published model is kept and pinned in the manifest
+        published_filepath = os.path.join(directory, "rf_depth_to_water.pkl.new")
+        with open(published_filepath, 'wb') as f:
+            f.write(b'published model')
+        ArtifactManager(directory).publish(published_filepath, "rf_depth_to_water.pkl")
+        assert ArtifactManager(directory).ensure(rf_filepath)
+        assert open(rf_filepath, 'rb').read() == b'published model'
+        print("published model was kept")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
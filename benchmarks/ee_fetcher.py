@@ -0,0 +1,118 @@
+"""
+Exercise EEFetcher against a local fake Earth Engine backend with injected latency and failures.
+
+The fake backend answers each request after a random latency, fails a share of the attempts with
+quota or transient errors, fails the requests for invalid locations with permanent errors, and counts
+how many requests it serves concurrently. The same workload is run one request after another and
+through the fetcher, and the failures, retries, deduplicated requests and peak concurrency are reported.
+
+Usage:
+    python benchmarks/ee_fetcher.py [--requests 200] [--failure-rate 0.2] [--rate 50]
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from ee_fetcher import EEFetcher  # noqa: E402
+
+TRANSIENT_ERRORS = [
+    "Too many concurrent aggregations.",
+    "Earth Engine capacity exceeded.",
+    "<HttpError 503 when requesting https://earthengine.googleapis.com returned \"Service Unavailable\">",
+    "Deadline exceeded.",
+]
+
+
+class FakeEEBackend:
+    def __init__(self, latency_s, failure_rate, seed=0):
+        self.latency_s = latency_s
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak_active = 0
+        self.calls = 0
+
+    def request(self, location):
+        def get_info():
+            with self.lock:
+                self.calls += 1
+                self.active += 1
+                self.peak_active = max(self.peak_active, self.active)
+                latency_s = self.rng.uniform(0.5, 1.5) * self.latency_s
+                draw = self.rng.random()
+            try:
+                time.sleep(latency_s)
+                if location < 0:
+                    raise ValueError(f"Invalid geometry for location {location}")
+                if draw < self.failure_rate:
+                    raise RuntimeError(self.rng.choice(TRANSIENT_ERRORS))
+                return {"location": location, "ppt": location * 0.5}
+            finally:
+                with self.lock:
+                    self.active -= 1
+        return get_info
+
+
+def run_sequential(backend, locations):
+    results = []
+    for location in locations:
+        try:
+            results.append(backend.request(location)())
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Exercise the Earth Engine fetcher against a fake backend')
+    parser.add_argument("--requests", type=int, default=200, help="Number of requests in the workload")
+    parser.add_argument("--duplicates", type=float, default=0.2, help="Share of requests repeating an earlier location")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean latency of the fake backend in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.2, help="Share of attempts failing with a transient error")
+    parser.add_argument("--invalid", type=int, default=3, help="Number of requests failing with a permanent error")
+    parser.add_argument("--workers", type=int, default=8, help="Maximum concurrent requests of the fetcher")
+    parser.add_argument("--rate", type=float, default=50, help="Requests per second allowed by the fetcher")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    locations = []
+    for i in range(args.requests - args.invalid):
+        locations.append(rng.choice(locations) if locations and rng.random() < args.duplicates else i)
+    locations += [-(i + 1) for i in range(args.invalid)]
+    rng.shuffle(locations)
+
+    backend = FakeEEBackend(args.latency, args.failure_rate)
+    start = time.perf_counter()
+    sequential = run_sequential(backend, locations)
+    sequential_s = time.perf_counter() - start
+    sequential_failed = sum(isinstance(result, Exception) for result in sequential)
+    print(f"sequential: {sequential_s:.2f} s, {sequential_failed} failed, peak concurrency {backend.peak_active}")
+
+    backend = FakeEEBackend(args.latency, args.failure_rate)
+    fetcher = EEFetcher(max_workers=args.workers, rate_per_second=args.rate, base_delay_s=args.latency, max_delay_s=1.0)
+    start = time.perf_counter()
+    fetched = fetcher.fetch_many([(location, backend.request(location)) for location in locations])
+    fetcher_s = time.perf_counter() - start
+    fetcher.shutdown()
+
+    failed = [location for location, result in zip(locations, fetched) if isinstance(result, Exception)]
+    wrong = [location for location, result in zip(locations, fetched)
+             if not isinstance(result, Exception) and result["location"] != location]
+    stats = fetcher.stats()
+    print(f"fetcher:    {fetcher_s:.2f} s, {len(failed)} failed, peak concurrency {backend.peak_active}, "
+          f"{backend.calls} backend calls for {len(locations)} requests")
+    print(f"            {stats['deduplicated']} deduplicated, {stats['retries']} retries, "
+          f"{stats['attempts'] / fetcher_s:.1f} attempts/s (limit {args.rate}, bursts of {int(args.rate)})")
+    assert not wrong, f"results for the wrong location: {wrong}"
+    assert all(location < 0 for location in failed), f"transient failures were not retried: {failed}"
+    assert backend.peak_active <= args.workers
+
+
+if __name__ == '__main__':
+    main()
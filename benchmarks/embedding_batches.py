@@ -0,0 +1,140 @@
+"""
+Compare one embedding request per article with batched, pooled requests, against a local stub of the
+Hugging Face feature-extraction endpoint.
+
+The stub answers a string input with one vector and a list input with one vector per text, after a
+fixed delay standing in for the network round-trip and model time. It counts requests and TCP
+connections, so the script checks that batches reuse keep-alive connections, and that batched
+embeddings match the per-text ones.
+
+Usage:
+    python benchmarks/embedding_batches.py [--latency-ms 80] [--batch-size 16]
+"""
+import argparse
+import contextlib
+import hashlib
+import http.server
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DIMENSION = 384
+
+
+def fake_embedding(text):
+    seed = int.from_bytes(hashlib.sha1(text.encode()).digest()[:8], 'little')
+    return np.random.default_rng(seed).normal(size=DIMENSION).tolist()
+
+
+def make_handler(latency_s, stats):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def setup(self):
+            super().setup()
+            with stats["lock"]:
+                stats["connections"] += 1
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            with stats["lock"]:
+                stats["requests"] += 1
+            time.sleep(latency_s)
+            inputs = payload["inputs"]
+            body = json.dumps([fake_embedding(text) for text in inputs] if isinstance(inputs, list) else fake_embedding(inputs)).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+def start_stub_server(latency_s):
+    """
+    Serve the stub endpoint on a free local port from a background thread.
+
+    Returns:
+        tuple: The server, the feature-extraction URL it answers on and its request and connection counts.
+    """
+    stats = {"lock": threading.Lock(), "requests": 0, "connections": 0}
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), make_handler(latency_s, stats))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/pipeline/feature-extraction/stub", stats
+
+
+@contextlib.contextmanager
+def rag_working_directory():
+    # rag reads its API keys and writes its log relative to the working directory
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        with open('apis_keys.json', 'w') as f:
+            json.dump({"pinecone": {"api_key": "stub"}, "huggingface": {"api_key": "stub"}}, f)
+        try:
+            yield directory
+        finally:
+            os.chdir(ROOT)
+
+
+def read_articles():
+    articles = []
+    laws_folder = os.path.join(ROOT, 'laws')
+    for filename in sorted(os.listdir(laws_folder)):
+        if filename.endswith('.txt'):
+            with open(os.path.join(laws_folder, filename), encoding='utf-8') as f:
+                articles.append(f.read())
+    return articles
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark batched embedding requests against a local stub server')
+    parser.add_argument("--latency-ms", type=float, default=80, help="Delay of each stub response")
+    parser.add_argument("--batch-size", type=int, default=16, help="Texts per batched request")
+    parser.add_argument("--workers", type=int, default=4, help="Batched requests in flight at once")
+    args = parser.parse_args()
+
+    server, api_url, stats = start_stub_server(args.latency_ms / 1000)
+    articles = read_articles()
+
+    with rag_working_directory():
+        from rag import HuggingFaceEmbedding
+
+        embedding_model = HuggingFaceEmbedding(api_url=api_url, max_workers=args.workers)
+        start = time.perf_counter()
+        sequential = [embedding_model.generate_embedding(article) for article in articles]
+        sequential_s = time.perf_counter() - start
+        sequential_stats = dict(requests=stats["requests"], connections=stats["connections"])
+
+        embedding_model = HuggingFaceEmbedding(api_url=api_url, max_workers=args.workers)
+        start = time.perf_counter()
+        batched = embedding_model.generate_embeddings(articles, batch_size=args.batch_size)
+        batched_s = time.perf_counter() - start
+    server.shutdown()
+
+    assert all(embedding is not None for embedding in batched)
+    assert np.allclose(np.asarray(sequential), np.asarray(batched))
+    assert np.allclose(np.linalg.norm(np.asarray(batched), axis=1), 1)
+    batched_requests = stats["requests"] - sequential_stats["requests"]
+    batched_connections = stats["connections"] - sequential_stats["connections"]
+    assert batched_connections <= args.workers, "batched requests did not reuse pooled connections"
+
+    print(f"{len(articles)} articles, {args.latency_ms:.0f} ms per response")
+    print(f"{'mode':>10} {'time (s)':>9} {'requests':>9} {'connections':>12}")
+    print(f"{'per text':>10} {sequential_s:>9.2f} {sequential_stats['requests']:>9} {sequential_stats['connections']:>12}")
+    print(f"{'batched':>10} {batched_s:>9.2f} {batched_requests:>9} {batched_connections:>12}")
+
+
+if __name__ == '__main__':
+    main()
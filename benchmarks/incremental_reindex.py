@@ -0,0 +1,88 @@
+"""
+Re-index the law corpus after editing, adding and removing articles, and count the embedding calls
+and index writes each sync makes.
+
+Embeddings come from the local stub endpoint of embedding_batches.py and the index is an in-memory
+stand-in recording upserts and deletes, so the script needs neither API keys nor network access.
+
+Usage:
+    python benchmarks/incremental_reindex.py
+"""
+import os
+import sys
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from embedding_batches import rag_working_directory, start_stub_server  # noqa: E402
+
+
+class MemoryIndex:
+    # Pod-based Pinecone indexes have no list(), which is what the legacy id fallback is for
+    def __init__(self):
+        self.name = 'water-laws'
+        self.vectors = {}
+        self.upserted = 0
+        self.deleted = 0
+        self.lock = threading.Lock()
+
+    def upsert(self, vectors):
+        with self.lock:
+            for vector_id, values, metadata in vectors:
+                self.vectors[vector_id] = (values, metadata)
+            self.upserted += len(vectors)
+
+    def delete(self, ids):
+        with self.lock:
+            for vector_id in ids:
+                self.deleted += self.vectors.pop(vector_id, None) is not None
+
+
+def main():
+    server, api_url, stats = start_stub_server(0.02)
+
+    with rag_working_directory() as directory:
+        import rag
+
+        articles = rag.load_articles(os.path.join(ROOT, 'laws'))
+        # ArabicRAG without connecting to Pinecone
+        store = rag.ArabicRAG.__new__(rag.ArabicRAG)
+        store.index_name = 'water-laws'
+        store.backend = 'pinecone'
+        store.index = MemoryIndex()
+        store.embedding_cache = rag.EmbeddingCache(os.path.join(directory, 'embedding_cache.db'))
+        store.embedding_model = rag.HuggingFaceEmbedding(api_url=api_url, cache=store.embedding_cache)
+        # Vectors left behind by the doc_{i} ids of earlier versions
+        store.index.upsert([(f"doc_{i}", [0.0], {"text": text}) for i, text in enumerate(articles.values())])
+
+        def sync(label, documents, **kwargs):
+            requests_before, upserted_before, deleted_before = stats["requests"], store.index.upserted, store.index.deleted
+            misses_before = store.embedding_cache.misses
+            summary = store.sync_documents(documents, batch_size=16, **kwargs)
+            print(f"{label:>26} {store.embedding_cache.misses - misses_before:>9} {stats['requests'] - requests_before:>9} "
+                  f"{store.index.upserted - upserted_before:>9} {store.index.deleted - deleted_before:>8} {len(store.index.vectors):>8}")
+            return summary
+
+        print(f"{'sync':>26} {'embedded':>9} {'requests':>9} {'upserted':>9} {'deleted':>8} {'vectors':>8}")
+        sync("first (legacy doc_i ids)", articles)
+        assert not any(vector_id.startswith("doc_") for vector_id in store.index.vectors)
+        assert sync("unchanged", articles) == {"upserted": 0, "deleted": 0, "unchanged": len(articles), "failed": 0}
+
+        edited = dict(articles)
+        edited["article_12"] += " (معدلة)"
+        assert sync("one article edited", edited) == {"upserted": 1, "deleted": 1, "unchanged": len(articles) - 1, "failed": 0}
+
+        edited["article_164"] = "المادة 164 مادة جديدة"
+        del edited["article_163"]
+        assert sync("one added, one removed", edited) == {"upserted": 1, "deleted": 1, "unchanged": len(articles) - 1, "failed": 0}
+
+        # Reverting the edit is answered from the embedding cache
+        edited["article_12"] = articles["article_12"]
+        sync("edit reverted", edited)
+        sync("full re-upsert", edited, full=True)
+        assert len(store.index.vectors) == len(edited)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Exercise the BM25 lexical index over laws/ on its own and through ArabicRAG in each retrieval mode.
+
+Queries are phrases taken from the middle of each article, so the article they come from is the
+expected answer. Embeddings come from the local stub endpoint of embedding_batches.py, whose vectors
+are random, so the dense and hybrid rows only show latency and embedding requests, not quality.
+Article references ("المادة N") are checked to resolve without any embedding request.
+
+Usage:
+    python benchmarks/lexical_retrieval.py [--top-k 6] [--phrase-words 8]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from embedding_batches import rag_working_directory, start_stub_server  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark lexical, dense and hybrid retrieval over the law articles')
+    parser.add_argument("--top-k", type=int, default=6, help="Articles retrieved per query")
+    parser.add_argument("--phrase-words", type=int, default=8, help="Words of each article used as its query")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Delay of each stub embedding response")
+    args = parser.parse_args()
+
+    server, api_url, stats = start_stub_server(args.latency_ms / 1000)
+
+    with rag_working_directory():
+        import rag
+        from lexical_index import LexicalIndex
+
+        articles = rag.load_articles(os.path.join(ROOT, 'laws'))
+        start = time.perf_counter()
+        index = LexicalIndex(articles)
+        print(f"lexical index over {len(index)} articles and {len(index.postings)} terms built in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        queries = []
+        for name, text in articles.items():
+            words = text.split()
+            middle = max(0, len(words) // 2 - args.phrase_words // 2)
+            queries.append((name, ' '.join(words[middle:middle + args.phrase_words])))
+
+        store = rag.ArabicRAG(backend='local', local_index_directory='vector_index', embedding_cache_filepath='embedding_cache.db',
+                              query_cache_filepath=None, laws_folder=os.path.join(ROOT, 'laws'))
+        store.embedding_model.api_url = api_url
+        store.sync_documents(articles)
+
+        print(f"{'retrieval':>10} {'recall@' + str(args.top_k):>10} {'p50 (ms)':>9} {'requests':>9}")
+        for retrieval in ('lexical', 'dense', 'hybrid'):
+            # Without the query cache, every dense lookup costs an embedding request
+            store.embedding_model.query_cache = None
+            requests_before = stats["requests"]
+            latencies = []
+            found = 0
+            for name, query in queries:
+                start = time.perf_counter()
+                contexts = store.retrieve_relevant_context(query, top_k=args.top_k, retrieval=retrieval)
+                latencies.append((time.perf_counter() - start) * 1000)
+                found += articles[name] in contexts
+            print(f"{retrieval:>10} {found / len(queries):>10.1%} {np.percentile(latencies, 50):>9.2f} {stats['requests'] - requests_before:>9}")
+            if retrieval == 'lexical':
+                assert stats["requests"] == requests_before
+
+        requests_before = stats["requests"]
+        for number in range(1, len(articles) + 1):
+            for retrieval in ('lexical', 'dense', 'hybrid'):
+                contexts = store.retrieve_relevant_context(f"المادة {number}", retrieval=retrieval)
+                assert contexts and contexts[0].startswith(f"المادة {number} "), (number, retrieval)
+        assert stats["requests"] == requests_before
+        contexts = store.retrieve_relevant_context("ما هي شروط المادة 45", retrieval='hybrid')
+        assert contexts[0].startswith("المادة 45 ")
+        print(f"'المادة N' resolved for all {len(articles)} articles in every mode without an embedding request")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
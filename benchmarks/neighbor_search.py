@@ -0,0 +1,76 @@
+"""
+Compare the linear geodesic scan over the well network with the spatial index query.
+
+Usage:
+    python benchmarks/neighbor_search.py --sizes 1000 100000 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import networkx as nx
+import numpy as np
+from geopy.distance import geodesic
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from well_index import WellIndex  # noqa: E402
+
+# Bounding box of the (shifted) service region the predictor queries
+LAT_RANGE = (30.0, 38.0)
+LON_RANGE = (-90.0, -80.0)
+
+
+def make_well_network(n_wells, rng):
+    well_net = nx.Graph()
+    lats = rng.uniform(*LAT_RANGE, n_wells)
+    lons = rng.uniform(*LON_RANGE, n_wells)
+    depths = rng.uniform(1, 100, n_wells)
+    for i in range(n_wells):
+        well_net.add_node(i, Lat=lats[i], Lon=lons[i], DepthToWater_m=depths[i])
+    return well_net
+
+
+def linear_scan(well_net, coords, threshold_km):
+    neighbors = []
+    for i in well_net.nodes:
+        distance = geodesic(coords, (well_net.nodes[i]['Lat'], well_net.nodes[i]['Lon'])).kilometers
+        if distance < threshold_km:
+            neighbors.append(i)
+    return neighbors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark neighbor search over the well network')
+    parser.add_argument("--sizes", type=int, nargs='+', default=[1000, 100000, 1000000], help="Number of wells")
+    parser.add_argument("--queries", type=int, default=20, help="Number of indexed queries to average over")
+    parser.add_argument("--threshold-km", type=float, default=5, help="Neighbor radius in km")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'wells':>10} {'scan (ms)':>12} {'build (ms)':>12} {'query (ms)':>12} {'speedup':>10}")
+    for n_wells in args.sizes:
+        well_net = make_well_network(n_wells, rng)
+        queries = np.column_stack([rng.uniform(*LAT_RANGE, args.queries), rng.uniform(*LON_RANGE, args.queries)])
+
+        start = time.perf_counter()
+        expected = linear_scan(well_net, tuple(queries[0]), args.threshold_km)
+        scan_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        well_index = WellIndex.from_graph(well_net)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        positions, _ = well_index.query_radius(tuple(queries[0]), args.threshold_km)
+        assert sorted(well_index.node_ids[positions].tolist()) == sorted(expected)
+
+        start = time.perf_counter()
+        for coords in queries:
+            well_index.query_radius(tuple(coords), args.threshold_km)
+        query_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+        print(f"{n_wells:>10} {scan_ms:>12.2f} {build_ms:>12.2f} {query_ms:>12.3f} {scan_ms / query_ms:>9.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Replay a stream of repeated citizen questions through ArabicRAG.retrieve_relevant_context and count
+the embedding requests made with and without the query-embedding cache.
+
+Embeddings come from the local stub endpoint of embedding_batches.py and the vectors from a local
+vector index, so the script needs neither API keys nor network access. The cache is then reopened
+from its file to check that persisted embeddings are served after a restart.
+
+Usage:
+    python benchmarks/query_cache.py [--questions 500] [--latency-ms 80]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from embedding_batches import rag_working_directory, start_stub_server  # noqa: E402
+
+QUESTIONS = [
+    "ما هي شروط الحصول على رخصة حفر بئر؟",
+    "هل يجوز حفر بئر دون ترخيص؟",
+    "ما هي العقوبات على استعمال الماء دون رخصة؟",
+    "من يملك الملك العام المائي؟",
+    "ما هي مدة رخصة جلب الماء؟",
+    "كيف يتم إعداد المخطط التوجيهي للتهيئة المندمجة للموارد المائية؟",
+]
+# The same questions as typed by other citizens, differing only in spacing, punctuation and formatting
+VARIANTS = [lambda q: q, lambda q: f"  {q}  ", lambda q: q.replace("؟", " ؟"), lambda q: f"**{q}**"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the query-embedding cache against a local stub server')
+    parser.add_argument("--questions", type=int, default=500, help="Number of questions replayed")
+    parser.add_argument("--latency-ms", type=float, default=80, help="Delay of each stub response")
+    args = parser.parse_args()
+
+    server, api_url, stats = start_stub_server(args.latency_ms / 1000)
+    rng = np.random.default_rng(0)
+    # A few questions account for most of the traffic
+    weights = 1 / np.arange(1, len(QUESTIONS) + 1)
+    stream = [VARIANTS[rng.integers(len(VARIANTS))](QUESTIONS[i])
+              for i in rng.choice(len(QUESTIONS), args.questions, p=weights / weights.sum())]
+
+    with rag_working_directory():
+        import rag
+
+        def open_rag():
+            store = rag.ArabicRAG(backend='local', local_index_directory='vector_index', embedding_cache_filepath='embedding_cache.db',
+                                  query_cache_filepath='query_cache.db')
+            store.embedding_model.api_url = api_url
+            return store
+
+        store = open_rag()
+        store.sync_documents(rag.load_articles(os.path.join(ROOT, 'laws')))
+
+        print(f"{len(stream)} questions ({len(QUESTIONS)} distinct), {args.latency_ms:.0f} ms per embedding")
+        print(f"{'query cache':>12} {'time (s)':>9} {'requests':>9} {'hit rate':>9}")
+        results = {}
+        for label in ('off', 'on'):
+            store.embedding_model.query_cache = None if label == 'off' else store.query_cache
+            requests_before = stats["requests"]
+            start = time.perf_counter()
+            results[label] = [store.retrieve_relevant_context(question) for question in stream]
+            elapsed = time.perf_counter() - start
+            hit_rate = store.query_cache.stats()["hit_rate"] if label == 'on' else 0.0
+            print(f"{label:>12} {elapsed:>9.2f} {stats['requests'] - requests_before:>9} {hit_rate:>9.1%}")
+        assert results['off'] == results['on']
+        assert stats["requests"] - requests_before == len(set(rag.normalize_query(q) for q in stream))
+
+        # A restarted process reads the embeddings back from the cache file
+        requests_before = stats["requests"]
+        restarted = open_rag()
+        for question in QUESTIONS:
+            restarted.retrieve_relevant_context(question)
+        assert stats["requests"] == requests_before
+        print(f"after a restart: {restarted.query_cache.stats()}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Compare sklearn RandomForestRegressor.predict with the compiled NumPy forest.
+
+A forest with the shape of the depth model (34 features) is trained on synthetic data unless a
+pickled model is given.
+
+Usage:
+    python benchmarks/rf_inference.py [--model bins/rf_depth_to_water.pkl]
+"""
+import argparse
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from rf_compiled import compile_rf_model  # noqa: E402
+
+N_FEATURES = 34
+
+
+def timed(predict, X, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        predictions = predict(X)
+    return (time.perf_counter() - start) * 1000 / repeats, predictions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark random forest inference')
+    parser.add_argument("--model", help="Pickled sklearn random forest to benchmark")
+    parser.add_argument("--trees", type=int, default=100, help="Number of trees of the synthetic forest")
+    parser.add_argument("--batches", type=int, nargs='+', default=[1, 100, 10000], help="Batch sizes")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.model:
+        with open(args.model, 'rb') as f:
+            rf_model = pickle.load(f)
+        feature_names = list(rf_model.feature_names_in_)
+    else:
+        feature_names = [f"feature_{i}" for i in range(N_FEATURES)]
+        X_train = pd.DataFrame(rng.normal(size=(20000, N_FEATURES)), columns=feature_names)
+        y_train = X_train.iloc[:, :4].sum(axis=1) * 10 + rng.normal(size=len(X_train))
+        rf_model = RandomForestRegressor(n_estimators=args.trees, random_state=0).fit(X_train, y_train)
+    compiled = compile_rf_model(rf_model)
+
+    print(f"{'rows':>8} {'sklearn (ms)':>14} {'compiled (ms)':>14} {'speedup':>8}")
+    for n_rows in args.batches:
+        X = rng.normal(size=(n_rows, len(feature_names)))
+        repeats = max(1, 1000 // n_rows)
+        sklearn_ms, expected = timed(lambda X: rf_model.predict(pd.DataFrame(X, columns=feature_names)), X, repeats)
+        compiled_ms, predictions = timed(compiled.predict, X, repeats)
+        assert np.array_equal(predictions, expected)
+        # Masked Earth Engine and raster values reach the model as NaN
+        X_missing = X.copy()
+        X_missing[0, rng.choice(len(feature_names), 3, replace=False)] = np.nan
+        assert np.array_equal(compiled.predict(X_missing), rf_model.predict(pd.DataFrame(X_missing, columns=feature_names)))
+        print(f"{n_rows:>8} {sklearn_ms:>14.3f} {compiled_ms:>14.3f} {sklearn_ms / compiled_ms:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
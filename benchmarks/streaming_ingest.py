@@ -0,0 +1,120 @@
+"""
+Ingest a corpus larger than the law articles through ArabicRAG.sync_documents into an in-memory
+stand-in for Pinecone, and check that an interrupted or partly failed ingestion resumes where it stopped.
+
+The stand-in rejects requests over a size limit, like Pinecone's 2 MB upsert limit, and waits a
+fixed delay per upsert standing in for the network round-trip. Embeddings come from the local stub
+endpoint of embedding_batches.py, so the script needs neither API keys nor network access.
+
+Usage:
+    python benchmarks/streaming_ingest.py [--copies 12] [--upsert-batch-size 100]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from embedding_batches import rag_working_directory, start_stub_server  # noqa: E402
+from incremental_reindex import MemoryIndex  # noqa: E402
+
+
+class Interrupted(BaseException):
+    # Not an Exception, so it aborts the run like a killed process instead of failing one batch
+    pass
+
+
+class LimitedIndex(MemoryIndex):
+    def __init__(self, name, latency_s, max_request_bytes=2 * 1024 * 1024):
+        super().__init__()
+        self.name = name
+        self.latency_s = latency_s
+        self.max_request_bytes = max_request_bytes
+        self.requests = 0
+        self.fail_after = None
+        self.failure = None
+
+    def upsert(self, vectors):
+        request_bytes = len(json.dumps([{"id": i, "values": v, "metadata": m} for i, v, m in vectors]).encode())
+        if request_bytes > self.max_request_bytes:
+            raise ValueError(f"request of {request_bytes / 2 ** 20:.1f} MB is over the {self.max_request_bytes / 2 ** 20:.0f} MB limit")
+        with self.lock:
+            self.requests += 1
+            if self.fail_after is not None and self.requests > self.fail_after:
+                raise self.failure
+        time.sleep(self.latency_s)
+        super().upsert(vectors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark streaming, resumable ingestion into an in-memory index')
+    parser.add_argument("--copies", type=int, default=12, help="Copies of the law articles in the corpus")
+    parser.add_argument("--upsert-batch-size", type=int, default=100, help="Vectors per upsert request")
+    parser.add_argument("--upserts-in-flight", type=int, default=4, help="Upsert requests sent concurrently")
+    parser.add_argument("--embedding-latency-ms", type=float, default=20, help="Delay of each stub embedding response")
+    parser.add_argument("--upsert-latency-ms", type=float, default=150, help="Delay of each upsert")
+    args = parser.parse_args()
+
+    server, api_url, stats = start_stub_server(args.embedding_latency_ms / 1000)
+
+    with rag_working_directory() as directory:
+        import rag
+
+        articles = rag.load_articles(os.path.join(ROOT, 'laws'))
+        documents = {f"{name}_{copy}": f"{text} ({copy})" for copy in range(args.copies) for name, text in articles.items()}
+
+        def open_store(index, cache_filename):
+            # ArabicRAG without connecting to Pinecone
+            store = rag.ArabicRAG.__new__(rag.ArabicRAG)
+            store.index_name = 'water-laws'
+            store.backend = 'pinecone'
+            store.index = index
+            store.embedding_cache = rag.EmbeddingCache(os.path.join(directory, cache_filename))
+            store.embedding_model = rag.HuggingFaceEmbedding(api_url=api_url, cache=store.embedding_cache)
+            return store
+
+        def sync(store, label, **kwargs):
+            kwargs = {"upsert_batch_size": args.upsert_batch_size, "max_upserts_in_flight": args.upserts_in_flight, **kwargs}
+            embedded_before = store.embedding_cache.misses
+            start = time.perf_counter()
+            try:
+                summary = store.sync_documents(documents, **kwargs)
+            except Interrupted:
+                summary = {"interrupted": True}
+            elapsed = time.perf_counter() - start
+            summary.setdefault("upserted", 0)
+            print(f"{label:>30} {elapsed:>9.2f} {summary['upserted'] / elapsed:>7.0f} "
+                  f"{store.embedding_cache.misses - embedded_before:>9} {len(store.index.vectors):>8}  {summary}")
+            return summary
+
+        print(f"{len(documents)} documents, {args.upsert_latency_ms:.0f} ms per upsert, {args.embedding_latency_ms:.0f} ms per embedding request")
+        print(f"{'run':>30} {'time (s)':>9} {'docs/s':>7} {'embedded':>9} {'vectors':>8}")
+        # One request with every vector, as upsert_documents used to send; the later runs reuse its embeddings
+        single = open_store(LimitedIndex('single', args.upsert_latency_ms / 1000), 'embedding_cache.db')
+        summary = sync(single, "one upsert request", upsert_batch_size=len(documents), max_upserts_in_flight=1)
+        assert summary["failed"] == len(documents)
+        for label, upserts_in_flight in (("batches, one at a time", 1), ("batches, concurrent", args.upserts_in_flight)):
+            batched = open_store(LimitedIndex(label, args.upsert_latency_ms / 1000), 'embedding_cache.db')
+            sync(batched, label, max_upserts_in_flight=upserts_in_flight)
+            assert len(batched.index.vectors) == len(documents)
+
+        # Embedding from scratch, so the resumed runs show which embeddings are not recomputed
+        index = LimitedIndex('resumed', args.upsert_latency_ms / 1000)
+        store = open_store(index, 'resume_cache.db')
+        index.fail_after, index.failure = 3, Interrupted()
+        sync(store, "interrupted after 3 batches")
+        index.fail_after, index.failure = index.requests + 2, ConnectionError("connection reset")
+        summary = sync(store, "resumed, connection drops")
+        assert summary["failed"] > 0
+        index.fail_after = None
+        summary = sync(store, "resumed")
+        assert summary["failed"] == 0 and summary["upserted"] < len(documents)
+        assert len(index.vectors) == len(documents) == len(store.embedding_cache.indexed_vectors(index.name))
+        assert sync(store, "nothing left")["upserted"] == 0
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Measure top-k query latency of the local vector index and check its results against a brute-force
+ranking, on the size of the law corpus and on larger synthetic ones.
+
+Usage:
+    python benchmarks/vector_index.py [--sizes 163 10000 100000] [--queries 200]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from vector_index import LocalVectorIndex  # noqa: E402
+
+DIMENSION = 384
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark queries on the local vector index')
+    parser.add_argument("--sizes", type=int, nargs='+', default=[163, 10000, 100000], help="Number of vectors in each index")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries per index")
+    parser.add_argument("--top-k", type=int, default=6, help="Matches per query")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'vectors':>8} {'upsert (s)':>11} {'open (ms)':>10} {'p50 (ms)':>9} {'p99 (ms)':>9}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            vectors = rng.normal(size=(size, DIMENSION)).astype(np.float32)
+            ids = [f"article_{i}" for i in range(size)]
+            start = time.perf_counter()
+            LocalVectorIndex(directory, DIMENSION).upsert(
+                [(vector_id, values, {"text": vector_id}) for vector_id, values in zip(ids, vectors)])
+            upsert_s = time.perf_counter() - start
+
+            start = time.perf_counter()
+            index = LocalVectorIndex(directory, DIMENSION)
+            open_ms = (time.perf_counter() - start) * 1000
+
+            normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+            latencies = []
+            for query in rng.normal(size=(args.queries, DIMENSION)):
+                start = time.perf_counter()
+                results = index.query(query.tolist(), top_k=args.top_k, include_metadata=True)
+                latencies.append((time.perf_counter() - start) * 1000)
+                expected = np.argsort(-(normalized @ (query / np.linalg.norm(query))))[:args.top_k]
+                assert [match["id"] for match in results["matches"]] == [ids[i] for i in expected]
+                assert all(match["metadata"]["text"] == match["id"] for match in results["matches"])
+
+            # Replacing and deleting vectors keeps the index consistent with what was written
+            index.upsert([(ids[0], -vectors[0], {"text": "replaced"})])
+            index.delete(ids[1:3])
+            assert len(index) == size - 2
+            assert index.query((-vectors[0]).tolist(), top_k=1)["matches"][0]["metadata"]["text"] == "replaced"
+            assert len(LocalVectorIndex(directory, DIMENSION)) == size - 2
+            print(f"{size:>8} {upsert_s:>11.2f} {open_ms:>10.2f} {np.percentile(latencies, 50):>9.3f} {np.percentile(latencies, 99):>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
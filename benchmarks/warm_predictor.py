@@ -0,0 +1,143 @@
+"""
+Time the dig-a-well prediction with a predictor spawned per click, as main.run_predictor used to,
+against the warm in-process predictor main.py now keeps for the lifetime of the server process.
+
+A Random Forest with the feature columns of the depth model and a networkx well network are
+generated, and Earth Engine is stubbed: authentication and each soil and climate fetch wait a fixed
+delay standing in for their round-trips. The locations lie outside the well network, so every
+prediction goes through the Random Forest and the Earth Engine fetch.
+
+Usage:
+    python benchmarks/warm_predictor.py [--clicks 5] [--wells 10000] [--trees 100]
+"""
+import argparse
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import time
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def make_artifacts(directory, n_wells, n_trees):
+    from sklearn.ensemble import RandomForestRegressor
+    import predictor
+
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.uniform(0, 10, (5000, len(predictor.FEATURES))), columns=predictor.FEATURES)
+    rf_model = RandomForestRegressor(n_estimators=n_trees, random_state=0).fit(X, X.iloc[:, :4].sum(axis=1) + rng.normal(size=len(X)))
+    with open(os.path.join(directory, 'rf_depth_to_water.pkl'), 'wb') as f:
+        pickle.dump(rf_model, f)
+
+    well_net = nx.Graph()
+    lats = rng.uniform(30, 35, n_wells)
+    lons = rng.uniform(-9, -2, n_wells)
+    for i in range(n_wells):
+        well_net.add_node(i, pos=(lats[i], lons[i]), Lat=lats[i], Lon=lons[i], DepthToWater_m=float(rng.uniform(1, 100)))
+    with open(os.path.join(directory, 'well_network.gpickle'), 'wb') as f:
+        pickle.dump(well_net, f)
+
+
+def stub_earth_engine(ee_init_ms, ee_latency_ms):
+    import predictor
+
+    def initialize_earth_engine(project):
+        time.sleep(ee_init_ms / 1000)
+
+    def get_soil_climate_data(self, well_coordinates, start_date='2023-01-01', end_date='2023-12-31'):
+        time.sleep(ee_latency_ms / 1000)
+        data = {f"soil_{soil_type}": {band: 5.0 for band in predictor.SOIL_BANDS} for soil_type in predictor.SOIL_IMAGES}
+        data["climate_conditions"] = {band: 5.0 for band in predictor.CLIMATE_BANDS}
+        return data
+
+    predictor.initialize_earth_engine = initialize_earth_engine
+    predictor.WellNetworkPredictor.get_soil_climate_data = get_soil_climate_data
+
+
+def predictor_kwargs(directory, memo_filename):
+    return dict(rf_model_filepath=os.path.join(directory, 'rf_depth_to_water.pkl'),
+                well_network_filepath=os.path.join(directory, 'well_network.gpickle'),
+                feature_cache_filepath=os.path.join(directory, 'feature_cache.db'),
+                raster_store_directory=os.path.join(directory, 'feature_rasters'),
+                prediction_memo_filepath=os.path.join(directory, memo_filename),
+                well_shards_directory=os.path.join(directory, 'well_shards'))
+
+
+def spawned_prediction(args, lat, lon):
+    # What each click cost before: a fresh interpreter importing, authenticating and unpickling
+    # everything for one prediction, its result scraped from stdout
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', str(lat), str(lon),
+                             '--directory', args.directory, '--ee-init-ms', str(args.ee_init_ms), '--ee-latency-ms', str(args.ee_latency_ms)],
+                            capture_output=True, text=True, check=True)
+    return time.perf_counter() - start, float(result.stdout.strip().splitlines()[-1])
+
+
+def child(args):
+    stub_earth_engine(args.ee_init_ms, args.ee_latency_ms)
+    from predictor import WellNetworkPredictor
+
+    predictor = WellNetworkPredictor(**predictor_kwargs(args.directory, 'spawned_wells.db'))
+    print(predictor.compute_and_predict_depth_of_water((args.child[0], args.child[1])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark a predictor spawned per click against a warm in-process predictor')
+    parser.add_argument("--clicks", type=int, default=5, help="Predictions timed with each approach")
+    parser.add_argument("--wells", type=int, default=10000, help="Wells of the generated well network")
+    parser.add_argument("--trees", type=int, default=100, help="Trees of the generated Random Forest")
+    parser.add_argument("--ee-init-ms", type=float, default=1500, help="Delay of the stubbed Earth Engine authentication")
+    parser.add_argument("--ee-latency-ms", type=float, default=300, help="Delay of each stubbed soil and climate fetch")
+    parser.add_argument("--directory", help=argparse.SUPPRESS)
+    parser.add_argument("--child", type=float, nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The predictor writes its log under the working directory
+        os.chdir(directory)
+        args.directory = directory
+        make_artifacts(directory, args.wells, args.trees)
+        # South of the well network, each click a degree from the previous one. Each approach has its own
+        # prediction memo, so neither reuses the predictions of the other
+        clicks = [(27.0 - i, -10.0) for i in range(args.clicks)]
+
+        spawned = [spawned_prediction(args, lat, lon) for lat, lon in clicks]
+
+        stub_earth_engine(args.ee_init_ms, args.ee_latency_ms)
+        from artifact_reloader import ReloadingPredictor
+        from tiered_predictor import TieredPredictor
+
+        tiered_predictor = None
+        warm = []
+        for lat, lon in clicks:
+            # As main.run_predictor: the first click of the server process loads the predictor, later ones reuse it
+            start = time.perf_counter()
+            if tiered_predictor is None:
+                tiered_predictor = TieredPredictor(ReloadingPredictor(**predictor_kwargs(directory, 'wells.db')))
+            job = tiered_predictor.submit((lat, lon))
+            job = tiered_predictor.wait(job["job_id"])
+            warm.append((time.perf_counter() - start, job["predicted_depth"]))
+        tiered_predictor.shutdown()
+
+        print(f"{args.wells} wells, {args.trees} trees, {args.ee_init_ms:.0f} ms Earth Engine authentication, {args.ee_latency_ms:.0f} ms per fetch")
+        print(f"{'click':>6} {'spawned (s)':>12} {'in-process (s)':>15}")
+        for i, ((spawned_s, spawned_depth), (warm_s, warm_depth)) in enumerate(zip(spawned, warm), start=1):
+            assert abs(spawned_depth - warm_depth) < 1e-6, (spawned_depth, warm_depth)
+            print(f"{i:>6} {spawned_s:>12.3f} {warm_s:>15.3f}")
+        if len(warm) > 1:
+            print(f"warm clicks are {np.mean([s for s, _ in spawned[1:]]) / np.mean([s for s, _ in warm[1:]]):.1f}x faster than spawned ones")
+        os.chdir(ROOT)
+
+
+if __name__ == '__main__':
+    main()
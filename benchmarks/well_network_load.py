@@ -0,0 +1,92 @@
+"""
+Compare startup time and memory of loading the networkx well network pickle with the .npy well store.
+
+Every load runs in a fresh interpreter so the RSS it adds is measured in isolation (Linux only).
+
+Usage:
+    python benchmarks/well_network_load.py --wells 100000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import networkx as nx
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from well_store import convert_gpickle  # noqa: E402
+
+# The notebook stores every training column as a node attribute
+N_EXTRA_ATTRIBUTES = 32
+
+
+def make_well_network(n_wells, filepath):
+    import pickle
+
+    rng = np.random.default_rng(0)
+    well_net = nx.Graph()
+    lats = rng.uniform(30, 38, n_wells)
+    lons = rng.uniform(-90, -80, n_wells)
+    for i in range(n_wells):
+        attributes = {f"feature_{j}": float(rng.random()) for j in range(N_EXTRA_ATTRIBUTES)}
+        well_net.add_node(i, pos=(lats[i], lons[i]), Lat=lats[i], Lon=lons[i], DepthToWater_m=float(rng.uniform(1, 100)), **attributes)
+    with open(filepath, 'wb') as f:
+        pickle.dump(well_net, f)
+
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+def load(filepath):
+    import pickle
+
+    from well_store import WellStore
+
+    baseline = rss_mb()
+    start = time.perf_counter()
+    if filepath.endswith('.npy'):
+        well_network = WellStore.load(filepath)
+        # Touch the columns the predictor reads so their pages are actually mapped in
+        float(well_network.lats.sum() + well_network.lons.sum() + well_network.depths.sum())
+    else:
+        with open(filepath, 'rb') as f:
+            well_network = pickle.load(f)
+    elapsed = time.perf_counter() - start
+    print(elapsed, rss_mb() - baseline)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark well network loading')
+    parser.add_argument("--wells", type=int, default=100000, help="Number of wells")
+    parser.add_argument("--load", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.load:
+        load(args.load)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        gpickle_filepath = os.path.join(directory, 'well_network.gpickle')
+        store_filepath = os.path.join(directory, 'well_network.npy')
+        make_well_network(args.wells, gpickle_filepath)
+        convert_gpickle(gpickle_filepath, store_filepath)
+
+        print(f"{'format':>10} {'size (MB)':>10} {'load (ms)':>10} {'RSS (MB)':>10}")
+        for name, filepath in (('gpickle', gpickle_filepath), ('npy', store_filepath)):
+            output = subprocess.run([sys.executable, __file__, '--load', filepath], capture_output=True, text=True, check=True)
+            elapsed, rss_mb = map(float, output.stdout.split())
+            size_mb = os.path.getsize(filepath) / 2 ** 20
+            print(f"{name:>10} {size_mb:>10.1f} {elapsed * 1000:>10.1f} {rss_mb:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Compare the full well index with the grid-sharded one on a national-scale synthetic well network.
+
+Startup (opening the network and answering one query near a city) runs in a fresh interpreter so
+the RSS it adds is measured in isolation (Linux only). The sharded index is then checked against
+the full one on queries across the country, with well updates applied to both, and with a memory
+budget smaller than the network.
+
+Usage:
+    python benchmarks/well_shards.py --wells 2000000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from well_index import WellIndex  # noqa: E402
+from well_shards import ShardedWellIndex, write_shards  # noqa: E402
+from well_store import WELL_DTYPE, WellStore  # noqa: E402
+
+# Contiguous USA, where the (shifted) queries land
+LAT_RANGE = (25.0, 49.0)
+LON_RANGE = (-124.0, -67.0)
+CITY = (33.0, -87.0)
+
+
+def make_records(n_wells, rng):
+    records = np.empty(n_wells, dtype=WELL_DTYPE)
+    records['node_id'] = np.arange(n_wells)
+    records['Lat'] = rng.uniform(*LAT_RANGE, n_wells)
+    records['Lon'] = rng.uniform(*LON_RANGE, n_wells)
+    records['DepthToWater_m'] = rng.uniform(1, 100, n_wells)
+    return records
+
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+def startup(kind, path, threshold_km):
+    baseline = rss_mb()
+    start = time.perf_counter()
+    if kind == 'full':
+        well_index = WellIndex.from_store(WellStore.load(path))
+    else:
+        well_index = ShardedWellIndex.open(path, prefetch=False)
+    positions, _ = well_index.query_radius(CITY, threshold_km)
+    well_index.depths_at(positions)
+    print(time.perf_counter() - start, rss_mb() - baseline)
+
+
+def same_neighbors(full, sharded, coords, threshold_km):
+    full_positions, full_distances = full.query_radius(coords, threshold_km)
+    positions, distances = sharded.query_radius(coords, threshold_km)
+    expected = dict(zip(full.node_ids[full_positions].tolist(), full.depths_at(full_positions).tolist()))
+    found = dict(zip(node_ids_at(sharded, positions), sharded.depths_at(positions).tolist()))
+    return expected == found and np.allclose(np.sort(full_distances), np.sort(distances))
+
+
+def node_ids_at(sharded, positions):
+    n_store = len(sharded.store)
+    return [int(sharded.store.records['node_id'][p]) if p < n_store else int(sharded.pending.node_ids[p - n_store]) for p in positions]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the sharded well index')
+    parser.add_argument("--wells", type=int, default=2000000, help="Number of wells")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries checked against the full index")
+    parser.add_argument("--threshold-km", type=float, default=5, help="Query radius")
+    parser.add_argument("--cell-deg", type=float, default=0.5, help="Size of the grid cells in degrees")
+    parser.add_argument("--startup", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.startup:
+        startup(args.startup[0], args.startup[1], args.threshold_km)
+        return
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as directory:
+        records = make_records(args.wells, rng)
+        store_filepath = os.path.join(directory, 'well_network.npy')
+        shards_directory = os.path.join(directory, 'well_shards')
+        WellStore(records).save(store_filepath)
+        start = time.perf_counter()
+        manifest = write_shards(records, shards_directory, args.cell_deg)
+        print(f"{args.wells} wells written in {len(manifest['shards'])} shards in {time.perf_counter() - start:.1f} s")
+
+        print(f"{'index':>8} {'startup (ms)':>13} {'RSS (MB)':>10}")
+        for kind, path in (('full', store_filepath), ('sharded', shards_directory)):
+            output = subprocess.run([sys.executable, __file__, '--startup', kind, path, '--threshold-km', str(args.threshold_km)],
+                                    capture_output=True, text=True, check=True)
+            elapsed, rss = map(float, output.stdout.split())
+            print(f"{kind:>8} {elapsed * 1000:>13.1f} {rss:>10.1f}")
+
+        full = WellIndex.from_store(WellStore.load(store_filepath))
+        sharded = ShardedWellIndex.open(shards_directory)
+        queries = np.column_stack([rng.uniform(*LAT_RANGE, args.queries), rng.uniform(*LON_RANGE, args.queries)])
+
+        # Re-measure, add and retire wells on both indexes
+        moved = [(int(node_id), CITY[0] + 0.01 * i, CITY[1], 42.0) for i, node_id in enumerate(rng.choice(args.wells, 50, replace=False))]
+        added = [(args.wells + i, CITY[0], CITY[1] + 0.01 * i, 7.0) for i in range(50)]
+        retired = [int(node_id) for node_id in rng.choice(args.wells, 200, replace=False)]
+        full = full.with_updates(moved + added, retired)
+        sharded = sharded.with_updates(moved + added, retired)
+        assert len(full) == len(sharded), (len(full), len(sharded))
+        assert sharded.next_node_id() == full.next_node_id()
+
+        for coords in [CITY] + [tuple(q) for q in queries]:
+            assert same_neighbors(full, sharded, coords, args.threshold_km), f"neighbors differ at {coords}"
+        positions, distances, radius_km = full.query_nearest(CITY, 8, args.threshold_km, 160)
+        sharded_positions, sharded_distances, sharded_radius_km = sharded.query_nearest(CITY, 8, args.threshold_km, 160)
+        assert radius_km == sharded_radius_km and np.allclose(distances, sharded_distances)
+        print(f"{args.queries + 1} radius queries and a nearest-wells query match the full index after updates")
+
+        start = time.perf_counter()
+        for coords in queries:
+            full.query_radius(tuple(coords), args.threshold_km)
+        full_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        start = time.perf_counter()
+        for coords in queries:
+            sharded.query_radius(tuple(coords), args.threshold_km)
+        sharded_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        print(f"query with shards loaded: full {full_ms:.2f} ms, sharded {sharded_ms:.2f} ms")
+
+        budget_bytes = 4 * 1024 * 1024
+        bounded = ShardedWellIndex.open(shards_directory, memory_budget_bytes=budget_bytes)
+        largest_bytes = 0
+        for coords in queries:
+            bounded.query_radius(tuple(coords), args.threshold_km)
+            largest_bytes = max(largest_bytes, bounded.store.loaded_bytes)
+        stats = bounded.store.stats()
+        # Only the shard just loaded may push the cache over its budget
+        largest_shard_bytes = max(shard.memory_bytes() for shard in bounded.store.loaded.values())
+        assert largest_bytes <= budget_bytes + largest_shard_bytes
+        print(f"with a {budget_bytes / 2 ** 20:.0f} MB budget: at most {largest_bytes / 2 ** 20:.1f} MB loaded, "
+              f"{stats['misses']} shard loads, {stats['hits']} hits, {stats['prefetched']} prefetched, {stats['evictions']} evictions")
+
+
+if __name__ == '__main__':
+    main()
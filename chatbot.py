@@ -51,8 +51,8 @@ class AnzarAssistant:
         
 
 class RAGPipeline:
-    def __init__(self, index_name='water-laws', dimension=384, model_url="https://api-inference.huggingface.co/models/meta-llama/Meta-Llama-3-8B-Instruct"):
-        self.rag = ArabicRAG(index_name=index_name, dimension=dimension)
+    def __init__(self, index_name='water-laws', dimension=384, model_url="https://api-inference.huggingface.co/models/meta-llama/Meta-Llama-3-8B-Instruct", backend='pinecone', retrieval='dense'):
+        self.rag = ArabicRAG(index_name=index_name, dimension=dimension, backend=backend, retrieval=retrieval)
         logging.info("RAGPipeline initialized with index name: %s and dimension: %d", index_name, dimension)
         
         with open('apis_keys.json') as f:
@@ -0,0 +1,165 @@
+import argparse
+import contextlib
+import functools
+import json
+import logging
+import math
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from geo import KM_PER_DEGREE
+from raster_store import create_grid, publish_grid
+
+TILE_SIZE = 256
+
+# Heatmap colours from shallow (blue) to deep (red) water
+COLOR_STOPS = np.array([
+    [43, 131, 186],
+    [171, 221, 164],
+    [255, 255, 191],
+    [253, 174, 97],
+    [215, 25, 28],
+], dtype=np.float64)
+TILE_ALPHA = 170
+# Rendered tiles kept by each surface
+TILE_CACHE_SIZE = 4096
+
+
+class DepthSurface:
+    """
+    Precomputed depth to water over a regular grid covering the service region.
+
+    The grid is stored as a memory-mapped `depth.<version>.npy` float32 array (NaN where no estimate exists)
+    next to a `manifest.json` holding the affine transform (north-west corner and pixel size in degrees)
+    and the depth range used to colour the heatmap tiles.
+
+    Attributes:
+        bbox: (min_lon, min_lat, max_lon, max_lat) covered by the grid.
+        depth_range: (min, max) depth in meters mapped to the ends of the heatmap colour scale.
+    """
+
+    def __init__(self, directory='bins/depth_surface'):
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            manifest = json.load(f)
+        self.directory = directory
+        self.west, self.north, self.pixel_size = manifest['transform']
+        self.depth_range = tuple(manifest['depth_range'])
+        # Directories written before grids were versioned hold a plain depth.npy
+        self.depths = np.load(os.path.join(directory, manifest.get('grid_file', 'depth.npy')), mmap_mode='r')
+        rows, cols = self.depths.shape
+        self.bbox = (self.west, self.north - rows * self.pixel_size, self.west + cols * self.pixel_size, self.north)
+        # Cached per surface, so the tiles of a replaced surface go with it
+        self.render_tile = functools.lru_cache(maxsize=TILE_CACHE_SIZE)(self._render_tile)
+
+    def lookup_many(self, lats, lons):
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        rows = np.floor((self.north - lats) / self.pixel_size).astype(np.int64)
+        cols = np.floor((lons - self.west) / self.pixel_size).astype(np.int64)
+        inside = (rows >= 0) & (rows < self.depths.shape[0]) & (cols >= 0) & (cols < self.depths.shape[1])
+        depths = np.full(lats.shape, np.nan)
+        depths[inside] = self.depths[rows[inside], cols[inside]]
+        return depths
+
+    def lookup(self, lat, lon):
+        depth = self.lookup_many([lat], [lon])[0]
+        return None if np.isnan(depth) else float(depth)
+
+    def _render_tile(self, z, x, y):
+        """
+        Render the XYZ (Web Mercator) tile `z/x/y` of the depth heatmap as a PNG.
+        """
+        n = 2 ** z
+        pixels = (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE
+        lons = (x + pixels) / n * 360.0 - 180.0
+        lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + pixels) / n))))
+        depths = self.lookup_many(*np.meshgrid(lats, lons, indexing='ij'))
+
+        low, high = self.depth_range
+        scaled = np.clip((depths - low) / max(high - low, 1e-9), 0, 1) * (len(COLOR_STOPS) - 1)
+        scaled = np.nan_to_num(scaled)
+        lower = np.floor(scaled).astype(np.int64).clip(max=len(COLOR_STOPS) - 2)
+        fraction = (scaled - lower)[..., None]
+        rgb = COLOR_STOPS[lower] * (1 - fraction) + COLOR_STOPS[lower + 1] * fraction
+        alpha = np.where(np.isnan(depths), 0, TILE_ALPHA)[..., None]
+        return encode_png(np.concatenate([rgb, alpha], axis=-1).astype(np.uint8))
+
+
+def encode_png(rgba):
+    height, width, _ = rgba.shape
+    # Each scanline is prefixed with filter type 0 (none)
+    raw = np.concatenate([np.zeros((height, 1), dtype=np.uint8), rgba.reshape(height, -1)], axis=1).tobytes()
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(raw, 6)) + chunk(b'IEND', b'')
+
+
+def build_depth_surface(predictor, bbox, directory, resolution_km=1.0, threshold_km=5, batch_size=10000, workers=1):
+    """
+    Predict depth to water at the centre of every cell of a grid over `bbox` and save it as a DepthSurface.
+
+    Cells with wells within `threshold_km` use the inverse-distance weighting of their neighbors and the
+    others the Random Forest model, exactly as `WellNetworkPredictor.predict_many` does.
+
+    Args:
+        predictor (WellNetworkPredictor): Predictor used to fill the grid.
+        bbox (tuple): (min_lon, min_lat, max_lon, max_lat) of the service region.
+        directory (str): Directory the grid and manifest are written to.
+        resolution_km (float): Cell size in kilometers.
+        threshold_km (float): Radius within which wells are used as neighbors.
+        batch_size (int): Number of cells predicted per `predict_many` call.
+        workers (int): Number of processes each batch is split across, started once for the whole build.
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    pixel_size = resolution_km / KM_PER_DEGREE
+    rows = math.ceil((max_lat - min_lat) / pixel_size)
+    cols = math.ceil((max_lon - min_lon) / pixel_size)
+    # Written to a new file, so a server with the current surface memory-mapped keeps serving it until the build is done
+    depths, grid_file = create_grid(directory, 'depth', np.float32, (rows, cols))
+
+    logging.info(f"Building {rows}x{cols} depth surface over {bbox} in {directory}")
+    cell_lats = max_lat - (np.arange(rows) + 0.5) * pixel_size
+    cell_lons = min_lon + (np.arange(cols) + 0.5) * pixel_size
+    flat_depths = depths.reshape(-1)
+    # One pool for the whole build, so the workers authenticate and load the artifacts once
+    with predictor.process_pool(workers) if workers > 1 else contextlib.nullcontext() as executor:
+        for start in range(0, rows * cols, batch_size):
+            cells = np.arange(start, min(start + batch_size, rows * cols))
+            coords = np.column_stack([cell_lats[cells // cols], cell_lons[cells % cols]])
+            predicted = predictor.predict_many(coords, threshold_km, workers, executor)
+            flat_depths[cells] = [np.nan if depth is None else depth for depth in predicted]
+            logging.info(f"Predicted {cells[-1] + 1}/{rows * cols} cells")
+
+    valid = np.asarray(depths)[~np.isnan(depths)]
+    depth_range = [float(np.percentile(valid, 2)), float(np.percentile(valid, 98))] if len(valid) else [0.0, 1.0]
+    publish_grid(depths, directory, grid_file, {'transform': [min_lon, max_lat, pixel_size], 'depth_range': depth_range})
+    logging.info(f"Depth surface saved to {directory}")
+
+
+def main():
+    from predictor import WellNetworkPredictor
+
+    parser = argparse.ArgumentParser(description='Precompute the depth to water surface of the service region')
+    parser.add_argument("--bbox", type=float, nargs=4, required=True, metavar=('MIN_LON', 'MIN_LAT', 'MAX_LON', 'MAX_LAT'),
+                        help="Service region, in map coordinates")
+    parser.add_argument("--output", default='bins/depth_surface', help="Directory the surface is written to")
+    parser.add_argument("--resolution-km", type=float, default=1.0, help="Cell size in kilometers")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes used for prediction")
+    args = parser.parse_args()
+
+    predictor = WellNetworkPredictor()
+    build_depth_surface(predictor, args.bbox, args.output, args.resolution_km, workers=args.workers)
+    print(f"Depth surface written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
+
+# # Morocco
+# python depth_surface.py --bbox -17.1 21.0 -1.0 35.9 --resolution-km 2
@@ -0,0 +1,188 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from timing import TIMINGS, span
+
+# Substrings of the Earth Engine and HTTP errors that are worth retrying, matched case-insensitively
+TRANSIENT_ERROR_MARKERS = (
+    "too many concurrent",
+    "too many requests",
+    "capacity exceeded",
+    "quota",
+    "rate limit",
+    "httperror 429",
+    "httperror 500",
+    "httperror 502",
+    "httperror 503",
+    "httperror 504",
+    "internal error",
+    "bad gateway",
+    "service unavailable",
+    "deadline exceeded",
+    "read timed out",
+    "connect timeout",
+    "connection reset",
+    "connection aborted",
+    "connection refused",
+    "remote end closed connection",
+    "max retries exceeded",
+)
+
+# Errors of the computation itself, which fail the same way when sent again
+PERMANENT_ERROR_MARKERS = (
+    "computation timed out",
+    "user memory limit exceeded",
+)
+
+
+def is_transient_error(error):
+    message = str(error).lower()
+    if any(marker in message for marker in PERMANENT_ERROR_MARKERS):
+        return False
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return any(marker in message for marker in TRANSIENT_ERROR_MARKERS)
+
+
+class RateLimiter:
+    """
+    Token bucket allowing `rate_per_second` acquisitions per second on average, in bursts of up to `burst`.
+    """
+
+    def __init__(self, rate_per_second, burst=None):
+        self.rate_per_second = rate_per_second
+        self.burst = burst or max(1, int(rate_per_second))
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate_per_second)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_s = (1 - self.tokens) / self.rate_per_second
+            time.sleep(wait_s)
+
+
+class EEFetcher:
+    """
+    Executor for Earth Engine requests shared by interactive predictions, batch scoring and cache warm-up.
+
+    Requests are zero-argument callables (typically the `getInfo` of a computed object) run on a bounded
+    thread pool. Every attempt first takes a token from a per-second rate limiter, and attempts failing
+    with quota or transient errors are retried with full-jitter exponential backoff, for as long as a
+    caller still waits for the result. Requests submitted under the same key while one is in flight
+    share its result instead of being sent again.
+
+    Attributes:
+        max_workers: Maximum number of requests in flight at once.
+        rate_limiter: Limits how many attempts start per second across all workers.
+        max_retries: Number of retries after the first attempt of a request.
+        base_delay_s: Backoff ceiling of the first retry, doubled on each following one.
+        max_delay_s: Upper bound of the backoff ceiling.
+        timeout_s: Longest `fetch` waits for a request before raising TimeoutError, and retries go on for by default.
+    """
+
+    def __init__(self, max_workers=8, rate_per_second=10, max_retries=5, base_delay_s=1.0, max_delay_s=30.0, timeout_s=120.0):
+        self.max_workers = max_workers
+        self.rate_limiter = RateLimiter(rate_per_second)
+        self.max_retries = max_retries
+        self.base_delay_s = base_delay_s
+        self.max_delay_s = max_delay_s
+        self.timeout_s = timeout_s
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ee-fetch')
+        self.in_flight = {}
+        # Time after which no caller waits for the in-flight request of each key
+        self.deadlines = {}
+        self.lock = threading.Lock()
+        self.counters = {"requests": 0, "deduplicated": 0, "attempts": 0, "retries": 0, "failures": 0}
+
+    def submit(self, key, request, timeout=None):
+        """
+        Schedule `request` and return its future, or the future of the in-flight request with the same key.
+
+        The request is not retried after `timeout` seconds (`timeout_s` by default), unless another caller
+        of the same key waits longer.
+        """
+        deadline = time.monotonic() + (timeout or self.timeout_s)
+        with self.lock:
+            self.counters["requests"] += 1
+            future = self.in_flight.get(key)
+            if future is not None:
+                self.counters["deduplicated"] += 1
+                self.deadlines[key] = max(self.deadlines[key], deadline)
+                return future
+            self.deadlines[key] = deadline
+            # Attempts are timed into the trace of the submitting thread, if it has one open
+            future = self.executor.submit(self._run, key, request, TIMINGS.current_trace())
+            self.in_flight[key] = future
+        future.add_done_callback(lambda _: self._forget(key, future))
+        return future
+
+    def fetch(self, key, request, timeout=None):
+        return self.submit(key, request, timeout).result(timeout=timeout or self.timeout_s)
+
+    def fetch_many(self, requests, timeout=None):
+        """
+        Run (key, request) pairs concurrently.
+
+        Returns:
+            list: Result of each request, or the exception it failed with, in input order.
+        """
+        timeout = timeout or self.timeout_s
+        deadline = time.monotonic() + timeout
+        futures = [self.submit(key, request, timeout) for key, request in requests]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result(timeout=max(0, deadline - time.monotonic())))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, in_flight=len(self.in_flight))
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+    def _forget(self, key, future):
+        with self.lock:
+            if self.in_flight.get(key) is future:
+                del self.in_flight[key]
+                del self.deadlines[key]
+
+    def _count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def _run(self, key, request, trace=None):
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            self._count("attempts")
+            try:
+                with span("ee_fetch", trace):
+                    return request()
+            except Exception as e:
+                if attempt == self.max_retries or not is_transient_error(e):
+                    self._count("failures")
+                    raise
+                delay_s = random.uniform(0, min(self.max_delay_s, self.base_delay_s * 2 ** attempt))
+                with self.lock:
+                    deadline = self.deadlines.get(key)
+                if deadline is not None and time.monotonic() + delay_s >= deadline:
+                    self._count("failures")
+                    logging.warning(f"Earth Engine request {key} failed ({e}), not retrying as no caller waits past {delay_s:.2f} s")
+                    raise
+                self._count("retries")
+                logging.warning(f"Earth Engine request {key} failed ({e}), retrying in {delay_s:.2f} s ({attempt + 1}/{self.max_retries})")
+                time.sleep(delay_s)
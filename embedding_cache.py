@@ -0,0 +1,112 @@
+import hashlib
+import time
+
+import numpy as np
+
+from sqlite_cache import MAX_QUERY_PARAMETERS, SQLiteCache
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache(SQLiteCache):
+    """
+    On-disk cache of document embeddings keyed by the embedding model and a hash of the text.
+
+    An edited document hashes differently, so only new or changed texts miss the cache, whatever
+    order or ids they come in. The same file tracks which vector ids each index holds, so a
+    re-index can tell which documents it has to upsert and which vectors it has to delete.
+    Vectors are stored as float64 bytes so a cached embedding is identical to the one returned by the API.
+
+    Attributes:
+        hits: Number of texts answered from the cache.
+        misses: Number of texts that had to be embedded.
+    """
+
+    table = 'embeddings'
+
+    def __init__(self, filepath='bins/embedding_cache.db'):
+        """
+        Open (or create) the cache file.
+
+        Args:
+            filepath (str): Path to the SQLite file backing the cache.
+        """
+        super().__init__(filepath)
+
+    def _create_tables(self):
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, content_hash TEXT NOT NULL, vector BLOB NOT NULL, created_at REAL NOT NULL, "
+            "PRIMARY KEY (model, content_hash))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS indexed_vectors ("
+            "index_name TEXT NOT NULL, vector_id TEXT NOT NULL, name TEXT NOT NULL, indexed_at REAL NOT NULL, "
+            "PRIMARY KEY (index_name, vector_id))"
+        )
+        # Pending maintenance of each index, e.g. vectors of an earlier id scheme left to delete
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS index_flags (index_name TEXT NOT NULL, flag TEXT NOT NULL, PRIMARY KEY (index_name, flag))"
+        )
+
+    def get_many(self, model, hashes):
+        """
+        Cached embeddings of the texts with the given content hashes.
+
+        Returns:
+            dict: Embedding (list of floats) by content hash, for the hashes found.
+        """
+        found = {}
+        with self._lock:
+            for start in range(0, len(hashes), MAX_QUERY_PARAMETERS):
+                chunk = hashes[start:start + MAX_QUERY_PARAMETERS]
+                rows = self._conn.execute(
+                    f"SELECT content_hash, vector FROM embeddings WHERE model = ? AND content_hash IN ({','.join('?' * len(chunk))})",
+                    (model, *chunk),
+                ).fetchall()
+                found.update((digest, np.frombuffer(vector, dtype=np.float64).tolist()) for digest, vector in rows)
+            self.hits += len(found)
+            self.misses += len(set(hashes) - set(found))
+        return found
+
+    def set_many(self, model, embeddings):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, content_hash, vector, created_at) VALUES (?, ?, ?, ?)",
+                [(model, digest, np.asarray(embedding, dtype=np.float64).tobytes(), now) for digest, embedding in embeddings.items()],
+            )
+
+    def indexed_vectors(self, index_name):
+        with self._lock:
+            rows = self._conn.execute("SELECT vector_id, name FROM indexed_vectors WHERE index_name = ?", (index_name,)).fetchall()
+        return dict(rows)
+
+    def record_indexed(self, index_name, vectors):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO indexed_vectors (index_name, vector_id, name, indexed_at) VALUES (?, ?, ?, ?)",
+                [(index_name, vector_id, name, now) for vector_id, name in vectors.items()],
+            )
+
+    def forget_indexed(self, index_name, vector_ids):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM indexed_vectors WHERE index_name = ? AND vector_id = ?",
+                [(index_name, vector_id) for vector_id in vector_ids],
+            )
+
+    def has_flag(self, index_name, flag):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM index_flags WHERE index_name = ? AND flag = ?", (index_name, flag)).fetchone() is not None
+
+    def set_flag(self, index_name, flag, value=True):
+        with self._lock, self._conn:
+            if value:
+                self._conn.execute("INSERT OR IGNORE INTO index_flags (index_name, flag) VALUES (?, ?)", (index_name, flag))
+            else:
+                self._conn.execute("DELETE FROM index_flags WHERE index_name = ? AND flag = ?", (index_name, flag))
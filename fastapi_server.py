@@ -1,13 +1,24 @@
-from fastapi import FastAPI, HTTPException, Depends, Security
+from fastapi import FastAPI, HTTPException, Depends, Security, Response, BackgroundTasks
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from sqlalchemy import Column, Integer, String, Float, Boolean, create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import jwt
 import hashlib
 import datetime
+import logging
+import os
+import threading
+from typing import Annotated
+from depth_surface import DepthSurface
+from predictor import shift_coordinates
+from well_store import NODE_ID_RANGE
+from artifact_reloader import ReloadingPredictor
+from tiered_predictor import TieredPredictor
+from timing import TIMINGS
 
 app = FastAPI()
 
@@ -24,6 +35,8 @@ security = HTTPBearer()
 
 DATABASE_URL_USERS = "sqlite:///./users.db"
 DATABASE_URL_WELLS = "sqlite:///./wells.db"
+DEPTH_SURFACE_DIRECTORY = "bins/depth_surface"
+ARTIFACT_WATCH_INTERVAL_S = 60
 
 engine_users = create_engine(DATABASE_URL_USERS, connect_args={"check_same_thread": False})
 engine_wells = create_engine(DATABASE_URL_WELLS, connect_args={"check_same_thread": False})
@@ -127,12 +140,59 @@ class CoordinatesModel(BaseModel):
     lat: float
     lon: float
 
+class PredictRequest(BaseModel):
+    lat: float
+    lon: float
+    threshold_km: float = 5
+
+# Node ids are stored as 64-bit integers; strings and floats are refused rather than coerced
+NodeId = Annotated[int, Field(strict=True, ge=NODE_ID_RANGE[0], le=NODE_ID_RANGE[1])]
+
+class WellMeasurement(BaseModel):
+    node_id: NodeId | None = None  # Well being re-measured, a new well is added when missing
+    lat: float
+    lon: float
+    depth_to_water_m: float
+
+class WellNetworkUpdate(BaseModel):
+    wells: list[WellMeasurement] = []
+    retired_node_ids: list[NodeId] = []
+
 class LicenseWellRequest(BaseModel):
     lat: float
     lon: float
     predicted_depth: float
 
 current_coordinates = {"lat": None, "lon": None}
+# The loaded depth surface and the modification time of the manifest it was loaded from
+depth_surface = (None, None)
+depth_surface_lock = threading.Lock()
+tiered_predictor = None
+# Requests arriving before the predictor is loaded wait for it instead of each loading their own
+tiered_predictor_lock = threading.Lock()
+
+def get_depth_surface() -> DepthSurface:
+    global depth_surface
+    try:
+        mtime_ns = os.stat(os.path.join(DEPTH_SURFACE_DIRECTORY, "manifest.json")).st_mtime_ns
+    except FileNotFoundError:
+        raise HTTPException(status_code=503, detail="Depth surface has not been built")
+    # A rebuilt surface replaces the manifest, and is loaded by the first request after it
+    if depth_surface[1] != mtime_ns:
+        with depth_surface_lock:
+            if depth_surface[1] != mtime_ns:
+                depth_surface = (DepthSurface(DEPTH_SURFACE_DIRECTORY), mtime_ns)
+    return depth_surface[0]
+
+def get_tiered_predictor() -> TieredPredictor:
+    global tiered_predictor
+    if tiered_predictor is None:
+        with tiered_predictor_lock:
+            if tiered_predictor is None:
+                predictor = ReloadingPredictor()
+                predictor.watch(ARTIFACT_WATCH_INTERVAL_S)
+                tiered_predictor = TieredPredictor(predictor)
+    return tiered_predictor
 
 @app.post("/signup")
 def signup(user: UserCreate, db: SessionLocalUsers = Depends(get_db_users)):
@@ -163,16 +223,110 @@ def login(user: UserLogin, db: SessionLocalUsers = Depends(get_db_users)):
     token = create_jwt_token(user.username)
     return {"success": True, "token": token}
 
+def speculate(lat: float, lon: float):
+    # The user may have clicked elsewhere while this waited to run
+    if (current_coordinates["lat"], current_coordinates["lon"]) != (lat, lon):
+        return
+    try:
+        get_tiered_predictor().speculate((lat, lon))
+    except Exception as e:
+        logging.error(f"Error starting speculative prediction for ({lat}, {lon}): {e}")
+
 @app.post("/set_coordinates")
-async def set_coordinates(coords: CoordinatesModel):
+async def set_coordinates(coords: CoordinatesModel, background_tasks: BackgroundTasks):
     current_coordinates["lat"] = coords.lat
     current_coordinates["lon"] = coords.lon
+    # Starts the prediction while the user confirms the location, superseding the one of the previous click
+    background_tasks.add_task(speculate, coords.lat, coords.lon)
     return {"status": "success"}
 
+@app.get("/speculative_result")
+def get_speculative_result(lat: float, lon: float, threshold_km: float = 5, wait: float = 0):
+    predictor = get_tiered_predictor()
+    job = predictor.speculative_job((lat, lon), threshold_km)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No speculative prediction for this location")
+    if wait > 0 and job["status"] == "pending":
+        job = predictor.wait(job["job_id"], timeout=min(wait, 30))
+    return job
+
 @app.get("/get_coordinates")
 async def get_coordinates():
     return current_coordinates
 
+@app.get("/depth")
+def get_depth(lat: float, lon: float):
+    depth = get_depth_surface().lookup(lat, lon)
+    if depth is None:
+        raise HTTPException(status_code=404, detail="No depth estimate at this location")
+    return {"lat": lat, "lon": lon, "predicted_depth": depth}
+
+@app.get("/tiles/depth/{z}/{x}/{y}.png")
+def get_depth_tile(z: int, x: int, y: int):
+    if z < 0 or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=404, detail="Tile out of range")
+    tile = get_depth_surface().render_tile(z, x, y)
+    return Response(content=tile, media_type="image/png", headers={"Cache-Control": "public, max-age=3600"})
+
+@app.post("/predict")
+def predict(request: PredictRequest):
+    # Answers with the well network estimate; poll /predict/{job_id} for the Random Forest refinement
+    return get_tiered_predictor().submit((request.lat, request.lon), request.threshold_km)
+
+@app.get("/predict/memo_stats")
+def get_prediction_memo_stats():
+    prediction_memo = get_tiered_predictor().predictor.prediction_memo
+    if prediction_memo is None:
+        raise HTTPException(status_code=503, detail="Prediction memo is not available")
+    return prediction_memo.stats()
+
+@app.get("/predict/{job_id}")
+def get_prediction_job(job_id: str, wait: float = 0):
+    predictor = get_tiered_predictor()
+    job = predictor.wait(job_id, timeout=min(wait, 30)) if wait > 0 else predictor.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Prediction job not found")
+    return job
+
+@app.post("/well_network/updates")
+def update_well_network(update: WellNetworkUpdate, credentials: HTTPAuthorizationCredentials = Security(security)):
+    decode_jwt_token(credentials.credentials)
+    wells = []
+    for well in update.wells:
+        lat, lon = shift_coordinates((well.lat, well.lon))
+        wells.append({"node_id": well.node_id, "Lat": lat, "Lon": lon, "DepthToWater_m": well.depth_to_water_m})
+    predictor = get_tiered_predictor().predictor
+    node_ids = predictor.update_wells(wells, update.retired_node_ids)
+    if node_ids is None:
+        raise HTTPException(status_code=500, detail="Could not update the well network")
+    return {"success": True, "node_ids": node_ids, "wells": len(predictor.well_index)}
+
+@app.post("/well_network/compact")
+def compact_well_network(credentials: HTTPAuthorizationCredentials = Security(security)):
+    decode_jwt_token(credentials.credentials)
+    predictor = get_tiered_predictor().predictor
+    if not predictor.compact_well_network():
+        raise HTTPException(status_code=500, detail="Could not compact the well network")
+    return {"success": True, "wells": len(predictor.well_index)}
+
+@app.get("/artifacts")
+def get_artifacts():
+    return get_tiered_predictor().predictor.status()
+
+@app.post("/artifacts/reload")
+def reload_artifacts(credentials: HTTPAuthorizationCredentials = Security(security)):
+    decode_jwt_token(credentials.credentials)
+    predictor = get_tiered_predictor().predictor
+    # Loads in the background; GET /artifacts shows when the new version is live
+    return {"success": predictor.reload(), **predictor.status()}
+
+@app.get("/metrics")
+def get_metrics(format: str = "prometheus"):
+    # Per-stage timing histograms of the prediction pipeline, scraped as Prometheus text or dumped as JSON
+    if format == "json":
+        return TIMINGS.to_dict()
+    return PlainTextResponse(TIMINGS.to_prometheus(), media_type="text/plain; version=0.0.4")
+
 @app.post("/license_well")
 def license_well(
     request: LicenseWellRequest,
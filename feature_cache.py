@@ -0,0 +1,111 @@
+import json
+import logging
+import math
+import time
+
+from geo import KM_PER_DEGREE
+from sqlite_cache import MAX_QUERY_PARAMETERS, SQLiteCache
+
+
+class FeatureCache(SQLiteCache):
+    """
+    On-disk cache of Earth Engine statistics keyed by a quantized location.
+
+    Locations are snapped to a grid whose cell size matches the scale the statistics are reduced
+    at, so any point inside the same cell reuses the cached value. Entries expire after `ttl_seconds`
+    and the least recently used ones are evicted once the cache holds more than `max_entries`.
+    The cache is backed by SQLite, so it is shared by every thread and process using the same file.
+
+    Attributes:
+        hits: Number of lookups answered from the cache.
+        misses: Number of lookups that were missing or expired.
+    """
+
+    table = 'features'
+
+    def __init__(self, filepath='bins/feature_cache.db', max_entries=100000, ttl_seconds=30 * 24 * 3600, evict_every=1000):
+        """
+        Open (or create) the cache file.
+
+        Args:
+            filepath (str): Path to the SQLite file backing the cache.
+            max_entries (int): Maximum number of entries kept on disk, exceeded by at most `evict_every` between evictions.
+            ttl_seconds (float): Age after which an entry is considered stale.
+            evict_every (int): Number of inserts after which the least recently used entries are evicted.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.evict_every = evict_every
+        self._inserts_since_eviction = 0
+        super().__init__(filepath)
+
+    def _create_tables(self):
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS features ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS features_accessed_at ON features (accessed_at)")
+        self._evict()
+
+    def make_key(self, kind, coords, scale_m, *extra):
+        # Grid cells of the size of the scale the statistics are reduced at
+        step = scale_m / (KM_PER_DEGREE * 1000)
+        row = math.floor(coords[0] / step)
+        col = math.floor(coords[1] / step)
+        return ':'.join(str(part) for part in (kind, scale_m, row, col) + extra)
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def get_many(self, keys):
+        """
+        Look up several keys in one transaction.
+
+        Returns:
+            list: Cached value of each key, or None where it is missing or expired.
+        """
+        keys = list(keys)
+        now = time.time()
+        rows = {}
+        with self._lock, self._conn:
+            for start in range(0, len(keys), MAX_QUERY_PARAMETERS):
+                chunk = keys[start:start + MAX_QUERY_PARAMETERS]
+                placeholders = ', '.join('?' * len(chunk))
+                for key, value, created_at in self._conn.execute(
+                        f"SELECT key, value, created_at FROM features WHERE key IN ({placeholders})", chunk):
+                    rows[key] = (value, created_at)
+            expired = [key for key, (_, created_at) in rows.items() if now - created_at > self.ttl_seconds]
+            for key in expired:
+                del rows[key]
+            self._conn.executemany("DELETE FROM features WHERE key = ?", [(key,) for key in expired])
+            self._conn.executemany("UPDATE features SET accessed_at = ? WHERE key = ?", [(now, key) for key in rows])
+            n_hits = sum(key in rows for key in keys)
+            self.hits += n_hits
+            self.misses += len(keys) - n_hits
+        return [json.loads(rows[key][0]) if key in rows else None for key in keys]
+
+    def set(self, key, value):
+        self.set_many([(key, value)])
+
+    def set_many(self, items):
+        """
+        Store several (key, value) pairs in one transaction.
+        """
+        now = time.time()
+        rows = [(key, json.dumps(value), now, now) for key, value in items]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO features (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)", rows)
+            self._inserts_since_eviction += len(rows)
+            if self._inserts_since_eviction >= self.evict_every:
+                self._evict()
+
+    def _evict(self):
+        self._inserts_since_eviction = 0
+        count = self._conn.execute("SELECT COUNT(*) FROM features").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM features WHERE key IN (SELECT key FROM features ORDER BY accessed_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+            logging.info(f"Evicted {count - self.max_entries} entries from feature cache")
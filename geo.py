@@ -0,0 +1,6 @@
+import math
+
+# Mean Earth radius, also the one the haversine metric of the well index uses
+EARTH_RADIUS_KM = 6371.0088
+# Length of one degree of latitude on that sphere, used to size grid cells given in km or m
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180
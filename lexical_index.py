@@ -0,0 +1,140 @@
+import math
+import re
+
+import numpy as np
+
+ARTICLE_REFERENCE = re.compile(r'المادة\s*(\d+)')
+# Article references alone, e.g. "المادة 45" or "المادة 45 و المادة 46"
+ARTICLE_REFERENCES_ONLY = re.compile(r'\s*(?:المادة\s*\d+[\s،,؟?.و]*)+')
+# Short vowels, shadda, sukun and tatweel, which the articles may or may not carry
+DIACRITICS = re.compile(r'[\u064B-\u0652\u0640]')
+WORD = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """
+    Split text that went through `nlp.preprocess_arabic_text` (or `nlp.normalize_query`) into the
+    terms the index is built on: words without diacritics, with the forms of alef unified.
+    """
+    text = DIACRITICS.sub('', text)
+    text = re.sub(r'[\u0622\u0623\u0625]', '\u0627', text)
+    return WORD.findall(text)
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuse rankings of the same items by summing 1 / (k + rank) over the rankings each item appears in.
+
+    Args:
+        rankings (list): Lists of items, best first.
+        k (int): Damping constant; 60 is the value of the original RRF paper.
+
+    Returns:
+        list: (item, fused score) pairs, best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda pair: pair[1], reverse=True)
+
+
+class LexicalIndex:
+    """
+    In-memory inverted index over the tokenized articles of laws/, scored with Okapi BM25.
+
+    Each term maps to the positions of the articles containing it and its frequency in each, so a
+    query only touches the postings of its own terms. Articles are also indexed by the number of
+    their leading "المادة N" header, which resolves article references without scoring.
+
+    Attributes:
+        names: Name of each article, e.g. "article_12".
+        texts: Text of each article.
+        articles_by_number: Position of each article by its number.
+    """
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        """
+        Build the index.
+
+        Args:
+            documents (dict): Text of each document by name, e.g. as returned by `rag.load_articles`.
+            k1 (float): Term frequency saturation of BM25.
+            b (float): Document length normalization of BM25.
+        """
+        self.names = list(documents)
+        self.texts = [documents[name] for name in self.names]
+        self.k1 = k1
+        self.b = b
+        self.articles_by_number = {}
+        postings = {}
+        lengths = []
+        for position, text in enumerate(self.texts):
+            header = ARTICLE_REFERENCE.match(text.lstrip())
+            if header:
+                self.articles_by_number.setdefault(int(header.group(1)), position)
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                postings.setdefault(token, ([], []))
+                postings[token][0].append(position)
+                postings[token][1].append(count)
+
+        self.lengths = np.asarray(lengths, dtype=np.float64)
+        self.average_length = self.lengths.mean() if len(lengths) else 0.0
+        n = len(self.texts)
+        self.postings = {
+            token: (np.asarray(positions, dtype=np.int32), np.asarray(counts, dtype=np.float64),
+                    math.log(1 + (n - len(positions) + 0.5) / (len(positions) + 0.5)))
+            for token, (positions, counts) in postings.items()
+        }
+        # Length normalization of each article, the part of the BM25 denominator that does not depend on the query
+        self._norms = self.k1 * (1 - self.b + self.b * self.lengths / self.average_length) if n else self.lengths
+
+    def __len__(self):
+        return len(self.texts)
+
+    def referenced_articles(self, query):
+        """
+        Positions of the indexed articles that `query` refers to as "المادة N", in order of mention.
+        """
+        positions = []
+        for match in ARTICLE_REFERENCE.finditer(query):
+            position = self.articles_by_number.get(int(match.group(1)))
+            if position is not None and position not in positions:
+                positions.append(position)
+        return positions
+
+    def is_reference_only(self, query):
+        return ARTICLE_REFERENCES_ONLY.fullmatch(query) is not None and bool(self.referenced_articles(query))
+
+    def scores(self, query):
+        scores = np.zeros(len(self.texts))
+        for token in tokenize(query):
+            if token not in self.postings:
+                continue
+            positions, counts, idf = self.postings[token]
+            scores[positions] += idf * counts * (self.k1 + 1) / (counts + self._norms[positions])
+        return scores
+
+    def search(self, query, top_k=6):
+        """
+        Rank the articles for `query`, the articles it refers to first and then by BM25 score.
+
+        Returns:
+            list: (position, score) pairs of at most `top_k` articles with a positive score, best first.
+                  Referenced articles get an infinite score.
+        """
+        referenced = self.referenced_articles(query)
+        results = [(position, math.inf) for position in referenced][:top_k]
+        scores = self.scores(ARTICLE_REFERENCE.sub(' ', query))
+        scores[referenced] = 0
+        n_scored = min(top_k - len(results), int(np.count_nonzero(scores > 0)))
+        if n_scored > 0:
+            top = np.argpartition(-scores, n_scored - 1)[:n_scored]
+            top = top[np.argsort(-scores[top], kind='stable')]
+            results += [(int(position), float(scores[position])) for position in top]
+        return results
@@ -1,12 +1,14 @@
 import streamlit as st
 import streamlit.components.v1 as components
 import requests
-import subprocess
+import logging
 import plotly.graph_objects as go
 import numpy as np
 import random
 import time
 from chatbot import RAGPipeline
+from artifact_reloader import ReloadingPredictor
+from tiered_predictor import TieredPredictor
 from pydantic import BaseModel
 
 st.set_page_config(page_title="Aabar Dashboard", layout="wide")
@@ -16,6 +18,9 @@ def get_language():
 
 language = get_language()
 API_BASE_URL = "http://127.0.0.1:8000"
+# Longest a step two run waits for the Random Forest refinement before leaving the quick estimate up
+REFINEMENT_TIMEOUT_S = 120
+ARTIFACT_WATCH_INTERVAL_S = 60
 
 translations = {
     "en": {
@@ -77,6 +82,9 @@ translations = {
         "status_licensed": "Status: Licensed",
         "status_pending": "Status: Pending Review",
         "processing": "Processing...",
+        "quick_estimate": "Quick estimate: {depth} meters from {n_wells} nearby wells (nearest {nearest_km} km away). Refining with soil and climate data...",
+        "refining": "Refining with soil and climate data...",
+        "refinement_failed": "Could not refine the estimate, showing the quick estimate: {depth} meters",
         "license_well": "License Well",
         "cancel": "Cancel",
     },
@@ -139,6 +147,9 @@ translations = {
         "status_licensed": "الحالة: مرخصة",
         "status_pending": "الحالة: قيد المراجعة",
         "processing": "جاري المعالجة...",
+        "quick_estimate": "تقدير سريع: {depth} متر من {n_wells} آبار قريبة (أقربها على بعد {nearest_km} كم). جاري التحسين باستخدام بيانات التربة والمناخ...",
+        "refining": "جاري التحسين باستخدام بيانات التربة والمناخ...",
+        "refinement_failed": "تعذر تحسين التقدير، عرض التقدير السريع: {depth} متر",
         "license_well": "ترخيص البئر",
         "cancel": "إلغاء",
     },
@@ -154,11 +165,13 @@ map_html = """
     <script src="https://unpkg.com/ol-mapbox-style@12.1.1/dist/olms.js"></script>
     <style>
       #map { position: absolute; top: 0; right: 0; bottom: 0; left: 0; }
+      #estimate { position: absolute; top: 10px; right: 10px; padding: 6px 10px; background: rgba(255, 255, 255, 0.9); border-radius: 4px; font-family: sans-serif; display: none; }
     </style>
   </head>
   <body>
     <div id="map">
     </div>
+    <div id="estimate"></div>
     <script>
       const key = 'IFASARDK187wYyZM6CW5';
       const styleJson = `https://api.maptiler.com/maps/dc73a1b5-4d79-4cb0-a741-9aaf5e474dd5/style.json?key=${key}`;
@@ -177,7 +190,17 @@ map_html = """
         }),
       });
 
-      olms.apply(map, styleJson);
+      const depthLayer = new ol.layer.Tile({
+        source: new ol.source.XYZ({
+          url: 'http://127.0.0.1:8000/tiles/depth/{z}/{x}/{y}.png',
+        }),
+        opacity: 0.6,
+      });
+
+      // Added once the basemap style is applied so the heatmap is drawn on top of it
+      olms.apply(map, styleJson).then(() => map.addLayer(depthLayer));
+
+      const estimate = document.getElementById('estimate');
 
       let markerLayer = null;
 
@@ -223,6 +246,18 @@ map_html = """
             }
           })
           .catch((error) => console.error('Error:', error));
+
+        fetch(`http://127.0.0.1:8000/depth?lat=${lat}&lon=${lon}`)
+          .then((response) => (response.ok ? response.json() : null))
+          .then((data) => {
+            if (data) {
+              estimate.textContent = `~${data.predicted_depth.toFixed(1)} m to water`;
+              estimate.style.display = 'block';
+            } else {
+              estimate.style.display = 'none';
+            }
+          })
+          .catch((error) => console.error('Error:', error));
       });
     </script>
   </body>
@@ -272,9 +307,8 @@ def step_two():
 
     if lat and lon:
         with st.spinner(translations[language]["processing"]):
-            result = run_predictor(lat, lon)
-            if result:
-                st.success(f"{translations[language]['prediction_result']} {str(result)} meters")
+            result = get_prediction(lat, lon, st.empty())
+            if result is not None:
                 col1, col2 = st.columns(2)
                 with col1:
                     if st.button(translations[language]["license_well"]):
@@ -302,18 +336,98 @@ def step_two():
     else:
         st.error(translations[language]["please_select_location"])
         
-def run_predictor(lat, lon):
+@st.cache_resource
+def get_predictor():
+    # Loaded once per server process and shared by every session and rerun, new artifacts are swapped in live
+    predictor = ReloadingPredictor()
+    predictor.watch(ARTIFACT_WATCH_INTERVAL_S)
+    return predictor
+
+@st.cache_resource
+def get_tiered_predictor():
+    return TieredPredictor(get_predictor())
+
+def get_prediction(lat, lon, placeholder):
+    # Reruns of step two (e.g. pressing License) reuse the prediction job of the same location
+    cached = st.session_state.get("prediction")
+    job = get_job(cached[1], cached[2]) if cached and cached[0] == (lat, lon) else None
+    if job is None:
+        # The API server started predicting when the location was clicked, before Confirm
+        origin = "api"
+        job = fetch_speculative_job(lat, lon)
+        if job is None:
+            origin = "local"
+            job = run_predictor(lat, lon)
+        if job is None:
+            return None
+        st.session_state["prediction"] = ((lat, lon), job["job_id"], origin)
+    else:
+        origin = cached[2]
+    
+    # The quick estimate is shown while the Random Forest refinement runs, then replaced by it
+    show_prediction(placeholder, job)
+    if job["status"] == "pending":
+        job = get_job(job["job_id"], origin, timeout=REFINEMENT_TIMEOUT_S) or job
+        show_prediction(placeholder, job)
+    return job["predicted_depth"]
+
+def fetch_speculative_job(lat, lon):
     try:
-        command = ["python3", "predictor.py", "--lon", str(float(lon)), "--lat", str(float(lat))]
-        # for hambam env
-        # command = ["conda", "run", "-n", "base", "python", "predictor.py", "--lon", str(float(lon)), "--lat", str(float(lat))]
-        result = subprocess.run(command, capture_output=True, text=True)
-        
-        if result.returncode == 0:
-            return result.stdout.strip()
-        else:
-            st.error(translations[language]["error_running_predictor"] + result.stderr)
+        response = requests.get(f"{API_BASE_URL}/speculative_result", params={"lat": lat, "lon": lon}, timeout=5)
+        if response.status_code != 200:
             return None
+        job = response.json()
+        logging.info(f"Dig-a-well prediction: using speculative job {job['job_id']} ({job['status']}, {job['source']} estimate)")
+        return job
+    except Exception as e:
+        logging.warning(f"Could not fetch the speculative prediction: {e}")
+        return None
+
+def get_job(job_id, origin, timeout=0):
+    if origin == "local":
+        tiered_predictor = get_tiered_predictor()
+        return tiered_predictor.wait(job_id, timeout=timeout) if timeout else tiered_predictor.get(job_id)
+    
+    # The API server caps each wait at 30 s, so longer waits poll it repeatedly
+    deadline = time.monotonic() + timeout
+    job = None
+    try:
+        while True:
+            wait_s = min(30, max(deadline - time.monotonic(), 0))
+            response = requests.get(f"{API_BASE_URL}/predict/{job_id}", params={"wait": wait_s}, timeout=wait_s + 10)
+            if response.status_code != 200:
+                return job
+            job = response.json()
+            if job["status"] != "pending" or time.monotonic() >= deadline:
+                return job
+    except Exception as e:
+        logging.warning(f"Could not fetch prediction job {job_id}: {e}")
+        return job
+
+def show_prediction(placeholder, job):
+    depth = job["predicted_depth"]
+    if job["status"] == "done":
+        placeholder.success(f"{translations[language]['prediction_result']} {depth} meters")
+    elif job["status"] == "pending" and depth is not None:
+        estimate = job["estimate"]
+        placeholder.info(translations[language]["quick_estimate"].format(
+            depth=round(depth, 1), n_wells=estimate["n_wells"], nearest_km=round(estimate["nearest_well_km"], 1)))
+    elif job["status"] == "pending":
+        placeholder.info(translations[language]["refining"])
+    elif depth is not None:
+        placeholder.warning(translations[language]["refinement_failed"].format(depth=round(depth, 1)))
+    else:
+        placeholder.error(translations[language]["error_running_predictor"] + "no prediction for this location")
+
+def run_predictor(lat, lon):
+    try:
+        start = time.perf_counter()
+        tiered_predictor = get_tiered_predictor()
+        loaded = time.perf_counter()
+        job = tiered_predictor.submit((float(lat), float(lon)))
+        # Predictor load time is only paid by the first (cold) prediction of the server process
+        logging.info(f"Dig-a-well prediction: predictor ready in {loaded - start:.3f} s, {job['source']} estimate took {time.perf_counter() - loaded:.3f} s with artifact version {job['artifact_version']}")
+        return job
     except Exception as e:
         st.error(translations[language]["error_running_predictor"] + str(e))
         return None
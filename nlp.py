@@ -6,15 +6,12 @@ from nltk.tokenize import word_tokenize
 from nltk.corpus import stopwords
 from camel_tools.tokenizers.word import simple_word_tokenize
 
-# Ensure you have the necessary NLTK resources
-nltk.download('punkt')
-nltk.download('stopwords')
-
-# Configure logging
-log_folder = 'log'
-os.makedirs(log_folder, exist_ok=True)
-logging.basicConfig(filename=os.path.join(log_folder, 'nlp.log'), level=logging.INFO, 
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+# Ensure you have the necessary NLTK resources, without a network round-trip when they are already installed
+for resource, path in (('punkt', 'tokenizers/punkt'), ('punkt_tab', 'tokenizers/punkt_tab'), ('stopwords', 'corpora/stopwords')):
+    try:
+        nltk.data.find(path)
+    except LookupError:
+        nltk.download(resource)
 
 # Arabic stopwords (can be adjusted based on your needs)
 stop_words = set(stopwords.words('arabic'))
@@ -79,6 +76,10 @@ def preprocess_arabic_text(text):
         processed_articles.append(final_article)
     return processed_articles
 
+# Normalize a user query the way the articles in laws/ were, so equivalent questions map to the same text
+def normalize_query(query):
+    return remove_stopwords(tokenize_text(clean_text(query)))
+
 # Function to read and preprocess the text from a file
 def read_and_preprocess_file(file_path):
     logging.info(f'Reading and preprocessing file: {file_path}')
@@ -96,10 +97,17 @@ def save_articles_to_files(articles, output_folder='laws'):
         with open(file_path, 'w', encoding='utf-8') as f:
             f.write(article)
 
-# Example usage with 'water-law-36-15.txt'
-file_path = 'data/water-laws-36-15.txt'  # Update with the correct path to your text file
-processed_articles = read_and_preprocess_file(file_path)
-save_articles_to_files(processed_articles)
+if __name__ == '__main__':
+    # Configure logging
+    log_folder = 'log'
+    os.makedirs(log_folder, exist_ok=True)
+    logging.basicConfig(filename=os.path.join(log_folder, 'nlp.log'), level=logging.INFO, 
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    # Example usage with 'water-law-36-15.txt'
+    file_path = 'data/water-laws-36-15.txt'  # Update with the correct path to your text file
+    processed_articles = read_and_preprocess_file(file_path)
+    save_articles_to_files(processed_articles)
 
-logging.info("Processed articles have been saved to the 'laws' folder.")
-print(f"Processed articles have been saved to the 'laws' folder.")
+    logging.info("Processed articles have been saved to the 'laws' folder.")
+    print(f"Processed articles have been saved to the 'laws' folder.")
@@ -0,0 +1,143 @@
+import hashlib
+import logging
+import math
+import os
+import time
+
+import numpy as np
+
+from geo import EARTH_RADIUS_KM, KM_PER_DEGREE
+from sqlite_cache import SQLiteCache
+
+# Memoized predictions closer than this are treated as the same location
+SAME_LOCATION_KM = 0.001
+# Rows of other artifacts are purged once none was added for this long, so processes still serving them keep theirs
+RETIRED_FINGERPRINT_IDLE_S = 24 * 3600
+
+
+def artifact_fingerprint(filepaths):
+    """
+    Fingerprint of the model and well network files a prediction was made with, from their size and
+    modification time, so replacing any of them invalidates the predictions made before.
+    """
+    parts = []
+    for filepath in filepaths:
+        if filepath and os.path.exists(filepath):
+            stat = os.stat(filepath)
+            parts.append(f"{os.path.abspath(filepath)}:{stat.st_size}:{stat.st_mtime_ns}")
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+
+class PredictionMemo(SQLiteCache):
+    """
+    Table of recent predictions, looked up by location before predicting from scratch.
+
+    Predictions are stored in the `prediction_memo` table of `wells.db` with the grid cell of their
+    location, whose size is the memo radius, so the predictions near a point are found by an indexed
+    lookup of the cells around it. Each row carries the fingerprint of the artifacts it was predicted
+    with and only rows matching the current fingerprint are used; rows of fingerprints no longer in use are purged.
+
+    Attributes:
+        radius_km: Distance within which prior predictions are reused.
+        max_age_seconds: Age after which a prediction is no longer reused.
+        hits: Number of lookups answered from the memo.
+        misses: Number of lookups that found no recent prediction nearby.
+    """
+
+    table = 'prediction_memo'
+
+    def __init__(self, filepath='wells.db', radius_km=0.25, max_age_seconds=30 * 24 * 3600):
+        """
+        Open (or create) the memo table.
+
+        Args:
+            filepath (str): Path to the SQLite database holding the table.
+            radius_km (float): Distance within which prior predictions are reused.
+            max_age_seconds (float): Age after which a prediction is no longer reused.
+        """
+        self.radius_km = radius_km
+        self.max_age_seconds = max_age_seconds
+        # Grid cells of the size of the memo radius
+        self.cell_size = radius_km / KM_PER_DEGREE
+        super().__init__(filepath)
+
+    def _create_tables(self):
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS prediction_memo ("
+            "id INTEGER PRIMARY KEY, fingerprint TEXT NOT NULL, cell_row INTEGER NOT NULL, cell_col INTEGER NOT NULL, "
+            "lat REAL NOT NULL, lon REAL NOT NULL, predicted_depth REAL NOT NULL, source TEXT, created_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS prediction_memo_cell ON prediction_memo (fingerprint, cell_row, cell_col)"
+        )
+
+    def cell(self, lat, lon):
+        return math.floor(lat / self.cell_size), math.floor(lon / self.cell_size)
+
+    def lookup(self, lat, lon, fingerprint):
+        """
+        Blend the recent predictions within `radius_km` of (lat, lon) made with the `fingerprint` artifacts.
+
+        Returns:
+            dict: Inverse-distance weighted `predicted_depth` of the `n_predictions` found and the distance
+                to the `nearest_km` one, or None if there is none.
+        """
+        row, col = self.cell(lat, lon)
+        # Cells are square in degrees, so more columns are needed where a degree of longitude is shorter
+        col_span = math.ceil(1 / max(math.cos(math.radians(lat)), 1e-6))
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT lat, lon, predicted_depth FROM prediction_memo "
+                "WHERE fingerprint = ? AND cell_row BETWEEN ? AND ? AND cell_col BETWEEN ? AND ? AND created_at >= ?",
+                (fingerprint, row - 1, row + 1, col - col_span, col + col_span, time.time() - self.max_age_seconds),
+            ).fetchall()
+
+        distances = np.empty(0)
+        if rows:
+            memo = np.asarray(rows, dtype=np.float64)
+            distances = haversine_km(lat, lon, memo[:, 0], memo[:, 1])
+            within = distances < self.radius_km
+            memo, distances = memo[within], distances[within]
+
+        with self._lock:
+            if len(distances) == 0:
+                self.misses += 1
+                return None
+            self.hits += 1
+        weights = 1 / np.maximum(distances, SAME_LOCATION_KM)
+        return {
+            "predicted_depth": float(np.dot(memo[:, 2], weights) / weights.sum()),
+            "n_predictions": len(distances),
+            "nearest_km": float(distances.min()),
+        }
+
+    def record(self, lat, lon, predicted_depth, fingerprint, source=None):
+        row, col = self.cell(lat, lon)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO prediction_memo (fingerprint, cell_row, cell_col, lat, lon, predicted_depth, source, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (fingerprint, row, col, lat, lon, float(predicted_depth), source, time.time()),
+            )
+
+    def purge(self, fingerprint, idle_seconds=RETIRED_FINGERPRINT_IDLE_S):
+        """
+        Delete the predictions too old to be reused, and those of other artifacts than `fingerprint`
+        that no process has added to for `idle_seconds`.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            deleted = self._conn.execute(
+                "DELETE FROM prediction_memo WHERE created_at < ? OR fingerprint IN ("
+                "SELECT fingerprint FROM prediction_memo WHERE fingerprint != ? GROUP BY fingerprint HAVING MAX(created_at) < ?)",
+                (now - self.max_age_seconds, fingerprint, now - idle_seconds),
+            ).rowcount
+        if deleted:
+            logging.info(f"Purged {deleted} stale predictions from the prediction memo")
+        return deleted
+
+
+def haversine_km(lat, lon, lats, lons):
+    lat, lon, lats, lons = map(np.radians, (lat, lon, lats, lons))
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
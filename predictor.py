@@ -1,83 +1,234 @@
 import pickle
+import numpy as np
 import pandas as pd
-from geopy.distance import geodesic
 import ee
 from google.oauth2 import service_account
 import logging
 import os
-import gdown
-import zipfile
 import argparse
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from well_index import WellIndex
+from well_shards import ShardedWellIndex, write_shards
+from well_store import WellStore, check_node_id
+from well_updates import WellDeltaLog, squash_ops
+from feature_cache import FeatureCache
+from raster_store import RasterStore
+from rf_compiled import CompiledForest, compile_rf_model
+from ee_fetcher import EEFetcher
+from prediction_memo import PredictionMemo, artifact_fingerprint
+from artifact_manager import ArtifactManager
+from timing import TIMINGS, format_trace, profiled, span
+
+# shift to fit Morocco's coordinates inside USA's bounding box since the model was trained on USA data
+# ONLY FOR TESTING PURPOSES
+COORDINATE_SHIFT = (2.5, -80.0)
+
+SOIL_IMAGES = {
+    "ph": "OpenLandMap/SOL/SOL_PH-H2O_USDA-4C1A2A_M/v02",
+    "carbon": "OpenLandMap/SOL/SOL_ORGANIC-CARBON_USDA-6A1C_M/v02",
+    "sand": "OpenLandMap/SOL/SOL_SAND-WFRACTION_USDA-3A1A1A_M/v02",
+    "silt": "OpenLandMap/SOL/SOL_TEXTURE-CLASS_USDA-TT_M/v02",
+    "clay": "OpenLandMap/SOL/SOL_CLAY-WFRACTION_USDA-3A1A1A_M/v02"
+}
+SOIL_BANDS = ["b0", "b10", "b100", "b200", "b30", "b60"]
+CLIMATE_BANDS = ["ppt", "tmean"]
+
+FEATURES = [
+    "soil_ph_b0", "soil_ph_b10", "soil_ph_b100", "soil_ph_b200", "soil_ph_b30", "soil_ph_b60", 
+    "soil_carbon_b0", "soil_carbon_b10", "soil_carbon_b100", "soil_carbon_b200", "soil_carbon_b30", "soil_carbon_b60", 
+    "soil_sand_b0", "soil_sand_b10", "soil_sand_b100", "soil_sand_b200", "soil_sand_b30", "soil_sand_b60", 
+    "soil_silt_b0", "soil_silt_b10", "soil_silt_b100", "soil_silt_b200", "soil_silt_b30", "soil_silt_b60", 
+    "soil_clay_b0", "soil_clay_b10", "soil_clay_b100", "soil_clay_b200", "soil_clay_b30", "soil_clay_b60", 
+    "climate_conditions_ppt", "climate_conditions_tmean", "Lat", "Lon"
+]
+FEATURE_BANDS = [feature for feature in FEATURES if feature not in ("Lat", "Lon")]
+
+# Above this many rows sklearn's C tree traversal beats the compiled NumPy forest
+COMPILED_RF_MAX_ROWS = 1000
+
+# Quick estimates away from the well network weight this many nearest wells, searched up to this far
+NEAREST_WELLS_K = 8
+NEAREST_WELLS_MAX_KM = 160
+
+# Number of logged well changes after which they are compacted into the well store
+WELL_DELTA_COMPACT_OPS = 10000
+
+# Loaded shards of a sharded well network are evicted beyond this size
+WELL_SHARDS_MEMORY_BUDGET_MB = 256
+
+# Deadline of each HTTP call to Earth Engine, so a hung request fails and is retried instead of blocking a worker
+EE_REQUEST_TIMEOUT_S = 60
+
+def shift_coordinates(coords):
+    return [coords[0] + COORDINATE_SHIFT[0], coords[1] + COORDINATE_SHIFT[1]]
+
+def is_newer(filepath, than_filepath):
+    # Whether `filepath` was published after `than_filepath`, which is derived from it, was written
+    return os.path.exists(filepath) and os.path.getmtime(filepath) > os.path.getmtime(than_filepath)
+
+def initialize_earth_engine(project='morocco-ai-2024'):
+    try:
+        # Authenticate and initialize Google Earth Engine
+        key_path = 'morocco-ai-2024-a2fad45fa0f6.json'
+        credentials = service_account.Credentials.from_service_account_file(
+            key_path, scopes=['https://www.googleapis.com/auth/earthengine']
+        )
+        logging.info("\nInitializing Google Earth Engine")
+        with span("ee_auth"):
+            ee.Initialize(credentials=credentials, project=project)
+        ee.data.setDeadline(EE_REQUEST_TIMEOUT_S * 1000)
+        logging.info("Google Earth Engine initialized successfully")
+    except Exception as e:
+        logging.error(f"Error initializing Google Earth Engine: {e}")
 
 class WellNetworkPredictor:
     """
     Class to predict depth to water for new well locations based on well network and geospatial data.
+
+    Predictions only read the loaded model and well index, so a single instance can be shared
+    across threads and async workers.
     
     Attributes:
         rf_model: The pre-trained Random Forest model used for prediction.
-        well_net: The well network graph containing existing well data.
+        compiled_rf_model: The same forest flattened to node arrays, used for small batches.
+        well_net: Store of the Lat, Lon and depth to water of the wells in the well network, None when it is sharded.
+        well_index: Spatial index over the wells of the network used for neighbor search, including the logged changes
+            (a ShardedWellIndex loading grid shards on demand when the network is sharded).
+        artifact_manager: Fetches missing or mismatching artifacts from the archive listed in its manifest.
+        well_delta_log: Append-only log of the wells added, re-measured or retired since the well store was compacted.
+        feature_cache: On-disk cache of the soil and climate statistics fetched from Earth Engine.
+        ee_fetcher: Concurrent, rate-limited executor the Earth Engine requests are sent through.
+        raster_store: Local soil and climate rasters sampled before falling back to Earth Engine, if exported.
+        prediction_memo: Recent Random Forest predictions, reused for nearby locations away from the well network.
+        artifact_fingerprint: Fingerprint of the model and well network files, invalidating memoized predictions when they change.
+        artifact_version: Short form of the fingerprint, reported with predictions to tell which artifacts made them.
+        network_fingerprint: Fingerprint of the well network file alone, recorded with each logged well change.
     """
     
-    def __init__(self, rf_model_filepath='bins/rf_depth_to_water.pkl', well_network_filepath='bins/well_network.gpickle', project='morocco-ai-2024'):
+    def __init__(self, rf_model_filepath='bins/rf_depth_to_water.pkl', well_network_filepath='bins/well_network.gpickle', project='morocco-ai-2024', feature_cache_filepath='bins/feature_cache.db', raster_store_directory='bins/feature_rasters', prediction_memo_filepath='wells.db', well_shards_directory='bins/well_shards'):
         """
         Initialize the WellNetworkPredictor class with a Random Forest model and well network graph.
         
         Args:
             rf_model_filepath (str): Path to the pre-trained Random Forest model.
-            well_network_filepath (str): Path to the well network file.
+            well_network_filepath (str): Path to the well network file, either a networkx pickle or a .npy well store.
             project (str): Earth Engine project name.
+            feature_cache_filepath (str): Path to the on-disk soil and climate feature cache.
+            raster_store_directory (str): Directory of the exported soil and climate rasters, used instead of Earth Engine inside their coverage.
+            prediction_memo_filepath (str): Path to the SQLite database holding the memo of prior predictions.
+            well_shards_directory (str): Directory of the grid-sharded well network; when it exists, shards are
+                loaded on demand instead of loading the whole well network.
         """
+        self.rf_model_filepath = rf_model_filepath
+        self.well_network_filepath = well_network_filepath
+        self.project = project
+        self.feature_cache_filepath = feature_cache_filepath
+        self.raster_store_directory = raster_store_directory
+        self.prediction_memo_filepath = prediction_memo_filepath
+        self.well_shards_directory = well_shards_directory
+        self.artifact_manager = ArtifactManager(os.path.dirname(rf_model_filepath) or '.')
+        self.well_delta_log = WellDeltaLog(os.path.splitext(well_network_filepath)[0] + '.delta.jsonl')
+        self.n_delta_ops = 0
+        self._well_update_lock = threading.Lock()
+        self._compaction_lock = threading.Lock()
+        
         # Configure logging
         if not os.path.exists('log'):
             os.makedirs('log')
         logging.basicConfig(filename='log/predictor.log', level=logging.INFO, 
                             format='%(asctime)s - %(levelname)s - %(message)s')
         
-        try:
-            # Authenticate and initialize Google Earth Engine
-            key_path = 'morocco-ai-2024-a2fad45fa0f6.json'
-            credentials = service_account.Credentials.from_service_account_file(
-                key_path, scopes=['https://www.googleapis.com/auth/earthengine']
-            )
-            logging.info("\nInitializing Google Earth Engine")
-            ee.Initialize(credentials=credentials, project=project)
-            logging.info("Google Earth Engine initialized successfully")
-        except Exception as e:
-            logging.error(f"Error initializing Google Earth Engine: {e}")
+        initialize_earth_engine(project)
+        
+        self.feature_cache = FeatureCache(feature_cache_filepath)
+        self.ee_fetcher = EEFetcher()
+        self.raster_store = self.load_raster_store(raster_store_directory)
+        
+        # Taken before loading, so files replaced while loading show up as a newer version
+        self.artifact_fingerprint = artifact_fingerprint(self.artifact_filepaths())
+        self.artifact_version = self.artifact_fingerprint[:12]
+        self.network_fingerprint = artifact_fingerprint([well_network_filepath])
         
         try:
             # Load the model and well network
-            self.rf_model = self.load_rf_model(rf_model_filepath)
-            self.well_net = self.load_well_network(well_network_filepath)
+            with span("artifact_load"):
+                self.rf_model = self.load_rf_model(rf_model_filepath)
+                self.compiled_rf_model = self.load_compiled_rf_model(self.rf_model, rf_model_filepath)
+                if os.path.exists(os.path.join(well_shards_directory, 'manifest.json')):
+                    self.well_net = None
+                    self.refresh_well_shards(well_shards_directory, well_network_filepath)
+                    self.well_index = self.replay_well_updates(self.load_well_shards(well_shards_directory))
+                else:
+                    self.well_net = self.load_well_network(well_network_filepath)
+                    self.well_index = self.replay_well_updates(self.build_well_index(self.well_net))
         except Exception as e:
             logging.error(f"Error loading model or well network: {e}")
+        # Taken after loading, which may rewrite the store from a newer well network
+        self.store_fingerprint = artifact_fingerprint(self.store_filepaths())
+        
+        self.prediction_memo = self.load_prediction_memo(prediction_memo_filepath)
             
-    def download_and_extract_zip(self, zip_url, extract_to='bins'):
-        try:
-            zip_filepath = os.path.join(extract_to, 'model_and_network.zip')
-            if not os.path.exists(zip_filepath):
-                logging.info(f"{zip_filepath} not found. Downloading from {zip_url}.")
-                gdown.download(zip_url, zip_filepath, quiet=False)
-                logging.info(f"Downloaded ZIP file to: {zip_filepath}")
-            else:
-                logging.info(f"ZIP file already exists at: {zip_filepath}")
-            
-            if not os.path.exists(extract_to):
-                os.makedirs(extract_to)
-            
-            logging.info(f"Extracting ZIP file to: {extract_to}")
-            with zipfile.ZipFile(zip_filepath, 'r') as zip_ref:
-                zip_ref.extractall(extract_to)
-            logging.info("ZIP file extracted successfully")
-        except Exception as e:
-            logging.error(f"Error downloading or extracting ZIP file: {e}")
+    def artifact_filepaths(self):
+        # Only the published files: the compiled forest, the .npy well store and the shards are derived
+        # from them, and rewritten by loading and compaction without making a new version
+        return [self.rf_model_filepath, self.well_network_filepath]
+
+    def store_filepaths(self):
+        # The well store the delta log is compacted into
+        return [os.path.splitext(self.well_network_filepath)[0] + '.npy', os.path.join(self.well_shards_directory, 'manifest.json')]
+
+    def snapshot(self):
+        return self
+
+    def is_compacting(self):
+        return self._compaction_lock.locked()
+
+    def close(self, wait=True):
+        """
+        Release the Earth Engine executor, the SQLite connections and the shard prefetch thread.
+
+        The Earth Engine requests in flight finish first when `wait` is set; predictions still
+        running on this predictor afterwards go without the caches.
+        """
+        self.ee_fetcher.shutdown(wait=wait)
+        for cache in (self.feature_cache, self.prediction_memo):
+            if cache is not None:
+                cache.close()
+        if isinstance(self.well_index, ShardedWellIndex):
+            self.well_index.close()
+
+    def validate(self):
+        """
+        Check that the model and well network loaded and can predict.
         
+        Returns:
+            list: Description of each problem found, empty if the artifacts are usable.
+        """
+        problems = []
+        if getattr(self, 'rf_model', None) is None:
+            problems.append("Random Forest model did not load")
+        elif list(getattr(self.rf_model, 'feature_names_in_', FEATURES)) != FEATURES:
+            problems.append("Random Forest model was trained on different features")
+        if getattr(self, 'well_index', None) is None or len(self.well_index) == 0:
+            problems.append("Well network did not load or has no wells")
+        if not problems:
+            try:
+                predictions = self.predict_feature_rows([[0.0] * len(FEATURES)])
+                if len(predictions) != 1 or not np.isfinite(predictions[0]):
+                    problems.append(f"Random Forest model predicted {predictions} for a test row")
+            except Exception as e:
+                problems.append(f"Random Forest model failed on a test row: {e}")
+        return problems
+
     def load_rf_model(self, filepath):
         try:
             if not os.path.exists(filepath):
-                logging.info(f"{filepath} not found. Attempting to download and extract ZIP file.")
-                zip_url = 'https://link.storjshare.io/s/jwrsgkkankl7zkpqjpwv3ahspoyq/moroccoai/model_and_network.zip?download=1'
-                self.download_and_extract_zip(zip_url)
+                logging.info(f"{filepath} not found. Fetching it from the artifact archive.")
+            self.artifact_manager.ensure(filepath)
             
             logging.info(f"Loading Random Forest model from: {filepath}")
             with open(filepath, 'rb') as f:
@@ -88,101 +239,455 @@ class WellNetworkPredictor:
             logging.error(f"Error loading Random Forest model: {e}")
             return None
 
+    def load_compiled_rf_model(self, rf_model, filepath):
+        try:
+            compiled_filepath = os.path.splitext(filepath)[0] + '.npz'
+            if os.path.exists(compiled_filepath) and os.path.getmtime(compiled_filepath) >= os.path.getmtime(filepath):
+                logging.info(f"Loading compiled Random Forest model from: {compiled_filepath}")
+                compiled_rf_model = CompiledForest.load(compiled_filepath)
+                # Forests compiled before missing-value routing was stored are recompiled when sklearn routes NaNs
+                routes_missing = compiled_rf_model.missing_left is not None or not hasattr(rf_model.estimators_[0].tree_, 'missing_go_to_left')
+                if compiled_rf_model.feature_names == FEATURES and len(compiled_rf_model.roots) == len(rf_model.estimators_) and routes_missing:
+                    return compiled_rf_model
+                logging.warning(f"{compiled_filepath} does not match the Random Forest model, recompiling")
+            
+            logging.info("Compiling Random Forest model")
+            compiled_rf_model = compile_rf_model(rf_model, FEATURES)
+            compiled_rf_model.save(compiled_filepath)
+            logging.info(f"Compiled Random Forest model saved to: {compiled_filepath}")
+            return compiled_rf_model
+        except Exception as e:
+            logging.error(f"Error compiling Random Forest model: {e}")
+            return None
+
     def load_well_network(self, filepath):
         try:
+            # A .npy well store next to the pickle is memory-mapped instead of unpickling the graph
+            store_filepath = os.path.splitext(filepath)[0] + '.npy'
+            # A pickle published after the store was written replaces it
+            if os.path.exists(store_filepath):
+                if not is_newer(filepath, store_filepath):
+                    logging.info(f"Loading well store from: {store_filepath}")
+                    well_store = WellStore.load(store_filepath)
+                    logging.info(f"Well store loaded successfully with {len(well_store)} wells")
+                    return well_store
+                logging.warning(f"{filepath} is newer than {store_filepath}, replacing the store and the well changes compacted into it")
+            
             if not os.path.exists(filepath):
-                logging.info(f"{filepath} not found. Attempting to download and extract ZIP file.")
-                zip_url = 'https://link.storjshare.io/s/jwrsgkkankl7zkpqjpwv3ahspoyq/moroccoai/model_and_network.zip?download=1'
-                self.download_and_extract_zip(zip_url)
+                logging.info(f"{filepath} not found. Fetching it from the artifact archive.")
+            self.artifact_manager.ensure(filepath)
             logging.info(f"Loading well network from: {filepath}")
             with open(filepath, 'rb') as f:
                 well_net = pickle.load(f)
+            well_store = WellStore.from_graph(well_net)
             logging.info("Well network loaded successfully")
-            return well_net
+            self.save_well_store(well_store, store_filepath)
+            return well_store
         except Exception as e:
             logging.error(f"Error loading well network: {e}")
             return None
-    
-    def create_well_point(self, well_coordinates):
+
+    def refresh_well_shards(self, directory, well_network_filepath):
         try:
-            return ee.Geometry.Point([well_coordinates[1], well_coordinates[0]])
+            manifest_filepath = os.path.join(directory, 'manifest.json')
+            if not is_newer(well_network_filepath, manifest_filepath):
+                return
+            logging.warning(f"{well_network_filepath} is newer than the sharded well network in {directory}, "
+                            f"rewriting the shards without the well changes compacted into them")
+            well_store = self.load_well_network(well_network_filepath)
+            if well_store is None:
+                return
+            with open(manifest_filepath) as f:
+                cell_deg = json.load(f)["cell_deg"]
+            write_shards(well_store.records, directory, cell_deg)
         except Exception as e:
-            logging.error(f"Error creating well point: {e}")
+            logging.error(f"Error rewriting sharded well network in {directory}: {e}")
+
+    def load_well_shards(self, directory):
+        try:
+            logging.info(f"Opening sharded well network in: {directory}")
+            well_index = ShardedWellIndex.open(directory, WELL_SHARDS_MEMORY_BUDGET_MB * 1024 * 1024)
+            logging.info(f"Sharded well network opened with {len(well_index.store)} wells in {len(well_index.store.shards)} shards")
+            return well_index
+        except Exception as e:
+            logging.error(f"Error opening sharded well network: {e}")
             return None
 
-    def fetch_climate_data(self, start_date, end_date, well_point):
+    def save_well_store(self, well_store, filepath):
         try:
-            climate_data = ee.ImageCollection("OREGONSTATE/PRISM/AN81m") \
-                .filterDate(start_date, end_date) \
-                .select(['tmean', 'ppt'])
-            climate_clip = climate_data.mean().clip(well_point.buffer(1000))
-            climate_stats = climate_clip.reduceRegion(
-                reducer=ee.Reducer.mean(),
-                geometry=well_point,
-                scale=1000
-            )
-            return climate_stats
+            well_store.save(filepath)
+            logging.info(f"Well store saved to: {filepath}")
         except Exception as e:
-            logging.error(f"Error fetching climate data: {e}")
+            logging.warning(f"Could not save well store to {filepath}: {e}")
+
+    def load_raster_store(self, directory):
+        try:
+            if not os.path.exists(os.path.join(directory, 'manifest.json')):
+                logging.info(f"No feature rasters found in {directory}, soil and climate data will come from Earth Engine")
+                return None
+            raster_store = RasterStore(directory)
+            logging.info(f"Feature rasters loaded from {directory}, covering {raster_store.bbox}")
+            return raster_store
+        except Exception as e:
+            logging.error(f"Error loading feature rasters: {e}")
             return None
-    
-    def fetch_soil_data(self, well_point):
+
+    def replay_well_updates(self, well_index):
         try:
-            soil_data = {}
-            soil_types = {
-                "ph": "OpenLandMap/SOL/SOL_PH-H2O_USDA-4C1A2A_M/v02",
-                "carbon": "OpenLandMap/SOL/SOL_ORGANIC-CARBON_USDA-6A1C_M/v02",
-                "sand": "OpenLandMap/SOL/SOL_SAND-WFRACTION_USDA-3A1A1A_M/v02",
-                "silt": "OpenLandMap/SOL/SOL_TEXTURE-CLASS_USDA-TT_M/v02",
-                "clay": "OpenLandMap/SOL/SOL_CLAY-WFRACTION_USDA-3A1A1A_M/v02"
-            }
-            
-            for soil_type, image_id in soil_types.items():
-                soil_data[soil_type] = self.fetch_single_soil_stat(image_id, well_point)
+            ops = self.well_delta_log.read()
+            if not ops:
+                return well_index
+            self.n_delta_ops = len(ops)
+            # Node ids of changes logged against an earlier well network may name other wells of this one.
+            # Entries written before the network was recorded are kept
+            stale = [op for op in ops if op.get('base', self.network_fingerprint) != self.network_fingerprint]
+            if stale:
+                logging.warning(f"Dropping {len(stale)} well changes logged against an earlier version of {self.well_network_filepath}, "
+                                f"they are removed from {self.well_delta_log.filepath} at the next compaction")
+                ops = [op for op in ops if op.get('base', self.network_fingerprint) == self.network_fingerprint]
+            wells, retired_node_ids = squash_ops(ops)
+            logging.info(f"Replayed {len(ops)} logged well changes: {len(wells)} wells added or updated, {len(retired_node_ids)} retired")
+            return well_index.with_updates(wells, retired_node_ids)
+        except Exception as e:
+            logging.error(f"Error replaying well changes from {self.well_delta_log.filepath}: {e}")
+            return well_index
+
+    def update_wells(self, wells=(), retired_node_ids=()):
+        """
+        Add, re-measure or retire wells of the loaded network without reloading it.
+        
+        The changes are appended to the delta log before they are applied to the spatial index, which
+        is swapped for an updated copy, so predictions in flight keep the index they started with.
+        The log is appended to under the artifact lock, shared with the other processes serving the
+        same network, after applying their logged changes, so new node ids follow theirs.
+        
+        Args:
+            wells (list): Dicts with the `Lat`, `Lon` and measured `DepthToWater_m` of each well, and the
+                `node_id` of the well it replaces (a new node id is assigned when it is missing).
+            retired_node_ids (list): Node ids of the wells to remove from the network.
+        
+        Returns:
+            list: Node id of each well of `wells`, or None if the changes could not be applied.
+        """
+        try:
+            with self.artifact_manager.locked(), self._well_update_lock:
+                self._catch_up_well_updates()
+                next_node_id = max(self.well_index.next_node_id(), self.stored_max_node_id() + 1)
+                ops = []
+                for well in wells:
+                    node_id = well.get('node_id')
+                    if node_id is None:
+                        node_id = next_node_id
+                        next_node_id += 1
+                    ops.append({
+                        'op': 'upsert',
+                        'base': self.network_fingerprint,
+                        'node_id': check_node_id(node_id),
+                        'Lat': float(well['Lat']),
+                        'Lon': float(well['Lon']),
+                        'DepthToWater_m': float(well['DepthToWater_m']),
+                    })
+                ops.extend({'op': 'retire', 'base': self.network_fingerprint, 'node_id': check_node_id(node_id)} for node_id in retired_node_ids)
+                
+                self.well_delta_log.append(ops)
+                self.well_index = self.well_index.with_updates(*squash_ops(ops))
+                self.n_delta_ops += len(ops)
+                logging.info(f"Applied {len(ops)} well changes, {len(self.well_index)} wells in the network")
             
-            return soil_data
+            if self.n_delta_ops >= WELL_DELTA_COMPACT_OPS and not self.is_compacting():
+                threading.Thread(target=self.compact_well_network, daemon=True).start()
+            return [op['node_id'] for op in ops if op['op'] == 'upsert']
+        except Exception as e:
+            logging.error(f"Error updating wells: {e}")
+            return None
+
+    def catch_up_well_updates(self):
+        """
+        Apply the well changes other processes appended to the delta log since it was last read.
+
+        Returns:
+            bool: Whether any change was applied.
+        """
+        with self._well_update_lock:
+            return self._catch_up_well_updates()
+
+    def _catch_up_well_updates(self):
+        n_logged = len(self.well_delta_log.read())
+        if n_logged < self.n_delta_ops:
+            # Another process compacted the log into the store, which only a reload of the store picks up;
+            # the changes logged since are still applied, so node ids keep following theirs
+            self.n_delta_ops = 0
+        if n_logged == self.n_delta_ops:
+            return False
+        # The whole log is replayed: applying a change twice gives the same network
+        self.well_index = self.replay_well_updates(self.well_index)
+        return True
+
+    def stored_max_node_id(self):
+        """
+        Largest node id of the well store on disk, which another process may have compacted more wells into.
+        """
+        manifest_filepath = os.path.join(self.well_shards_directory, 'manifest.json')
+        store_filepath = os.path.splitext(self.well_network_filepath)[0] + '.npy'
+        if isinstance(self.well_index, ShardedWellIndex) and os.path.exists(manifest_filepath):
+            with open(manifest_filepath) as f:
+                return json.load(f)["max_node_id"]
+        if os.path.exists(store_filepath):
+            node_ids = WellStore.load(store_filepath).records['node_id']
+            return int(node_ids.max()) if len(node_ids) else -1
+        return -1
+
+    def compact_well_network(self):
+        """
+        Write the wells of the network with the logged changes applied to the well store, truncate the
+        delta log and rebuild the spatial index over the compacted store.
+
+        The artifact lock is held from reading the log to truncating it, so no process appends to
+        the log in between. A store another process compacted since this one was loaded is left for
+        a reload to pick up, as compacting over it would drop the wells it holds that this process lacks.
+
+        Returns:
+            bool: Whether the changes were compacted, False if a compaction is already running, the
+                store changed on disk or compacting failed.
+        """
+        if not self._compaction_lock.acquire(blocking=False):
+            logging.info("Well network compaction already running")
+            return False
+        try:
+            with self.artifact_manager.locked(), self._well_update_lock:
+                if artifact_fingerprint(self.store_filepaths()) != self.store_fingerprint:
+                    logging.info("Well store was compacted by another process, not compacting until it is reloaded")
+                    return False
+                # Changes logged by other processes are compacted along with ours
+                self._catch_up_well_updates()
+                well_index = self.well_index
+                records = well_index.live_records()
+                
+                if isinstance(well_index, ShardedWellIndex):
+                    store_filepath = self.well_shards_directory
+                    write_shards(records, store_filepath, well_index.store.cell_deg)
+                    self.well_delta_log.truncate()
+                    self.well_index = ShardedWellIndex.open(store_filepath, well_index.store.memory_budget_bytes)
+                else:
+                    store_filepath = os.path.splitext(self.well_network_filepath)[0] + '.npy'
+                    WellStore(records).save(store_filepath)
+                    self.well_delta_log.truncate()
+                    self.well_net = WellStore.load(store_filepath)
+                    self.well_index = WellIndex.from_store(self.well_net)
+                    if store_filepath == self.well_network_filepath:
+                        # The published network is the store itself, later changes are logged against the compacted one
+                        self.network_fingerprint = artifact_fingerprint([store_filepath])
+                logging.info(f"Compacted {self.n_delta_ops} well changes into {store_filepath} ({len(records)} wells)")
+                self.n_delta_ops = 0
+                self.store_fingerprint = artifact_fingerprint(self.store_filepaths())
+            return True
+        except Exception as e:
+            logging.error(f"Error compacting well network: {e}")
+            return False
+        finally:
+            self._compaction_lock.release()
+
+    def load_prediction_memo(self, filepath):
+        try:
+            return PredictionMemo(filepath)
+        except Exception as e:
+            logging.error(f"Error opening prediction memo: {e}")
+            return None
+
+    def lookup_prior_prediction(self, new_location_coords):
+        try:
+            if self.prediction_memo is None:
+                return None
+            prior = self.prediction_memo.lookup(new_location_coords[0], new_location_coords[1], self.artifact_fingerprint)
+            if prior is not None:
+                logging.info(f"Reusing {prior['n_predictions']} prior predictions within {prior['nearest_km']:.3f} km of location: {new_location_coords}")
+            return prior
+        except Exception as e:
+            logging.error(f"Error looking up prior predictions: {e}")
+            return None
+
+    def record_prediction(self, new_location_coords, predicted_depth, source):
+        try:
+            if self.prediction_memo is not None and predicted_depth is not None:
+                self.prediction_memo.record(new_location_coords[0], new_location_coords[1], predicted_depth, self.artifact_fingerprint, source)
         except Exception as e:
-            logging.error(f"Error fetching soil data: {e}")
+            logging.error(f"Error recording prediction: {e}")
+
+    def build_well_index(self, well_store):
+        try:
+            logging.info("Building spatial index over the well network")
+            well_index = WellIndex.from_store(well_store)
+            logging.info(f"Spatial index built over {len(well_index)} wells")
+            return well_index
+        except Exception as e:
+            logging.error(f"Error building spatial index: {e}")
             return None
     
-    def fetch_single_soil_stat(self, image_id, well_point):
+    def create_well_point(self, well_coordinates):
         try:
-            soil_data = ee.Image(image_id)
-            soil_clip = soil_data.clip(well_point.buffer(30))
-            soil_stats = soil_clip.reduceRegion(
+            return ee.Geometry.Point([well_coordinates[1], well_coordinates[0]])
+        except Exception as e:
+            logging.error(f"Error creating well point: {e}")
+            return None
+
+    @staticmethod
+    def build_feature_image(start_date, end_date, soil=True, climate=True):
+        try:
+            bands = []
+            if soil:
+                for soil_type, image_id in SOIL_IMAGES.items():
+                    soil_names = [f"soil_{soil_type}_{band}" for band in SOIL_BANDS]
+                    bands.append(ee.Image(image_id).select(SOIL_BANDS, soil_names))
+            if climate:
+                climate_names = [f"climate_conditions_{band}" for band in CLIMATE_BANDS]
+                climate_data = ee.ImageCollection("OREGONSTATE/PRISM/AN81m") \
+                    .filterDate(start_date, end_date) \
+                    .select(CLIMATE_BANDS, climate_names)
+                # Climate stats are taken on the 1000 m grid even though the stack is reduced at 30 m
+                bands.append(climate_data.mean().reproject(crs='EPSG:4326', scale=1000))
+            return ee.Image.cat(bands)
+        except Exception as e:
+            logging.error(f"Error building feature image: {e}")
+            return None
+
+    def request_key(self, ee_object):
+        # Identical computations serialize identically, so concurrent duplicates are sent only once
+        return hashlib.sha1(ee_object.serialize().encode()).hexdigest()
+
+    def fetch_feature_stats(self, feature_image, well_point):
+        try:
+            feature_stats = feature_image.reduceRegion(
                 reducer=ee.Reducer.mean(),
                 geometry=well_point,
                 scale=30
             )
-            return soil_stats
+            return self.ee_fetcher.fetch(self.request_key(feature_stats), feature_stats.getInfo)
+        except Exception as e:
+            logging.error(f"Error fetching feature stats: {e}")
+            return None
+
+    def fetch_feature_stats_many(self, feature_image, well_points, chunk_size=1000):
+        """
+        Fetch the feature stats of many locations, as one reduceRegions request per chunk of `chunk_size`
+        locations (to stay under Earth Engine's payload limits) with the chunks fetched concurrently.
+        
+        Returns:
+            list: Dict of band name to mean value for each location, or None for the locations of chunks that failed.
+        """
+        try:
+            chunks = [well_points[start:start + chunk_size] for start in range(0, len(well_points), chunk_size)]
+            requests = []
+            for chunk in chunks:
+                collection = ee.FeatureCollection([ee.Feature(point, {'idx': i}) for i, point in enumerate(chunk)])
+                reduced = feature_image.reduceRegions(
+                    collection=collection,
+                    reducer=ee.Reducer.mean(),
+                    scale=30
+                )
+                requests.append((self.request_key(reduced), reduced.getInfo))
+            
+            feature_stats = []
+            for chunk, reduced in zip(chunks, self.ee_fetcher.fetch_many(requests)):
+                if isinstance(reduced, Exception):
+                    logging.error(f"Error fetching feature stats for a chunk of {len(chunk)} locations: {reduced}")
+                    feature_stats.extend([None] * len(chunk))
+                    continue
+                chunk_stats = [{} for _ in chunk]
+                for feature in reduced['features']:
+                    properties = dict(feature['properties'])
+                    chunk_stats[properties.pop('idx')] = properties
+                feature_stats.extend(chunk_stats)
+            return feature_stats
         except Exception as e:
-            logging.error(f"Error fetching single soil stat: {e}")
+            logging.error(f"Error fetching feature stats for {len(well_points)} locations: {e}")
             return None
 
+    def nest_feature_stats(self, feature_stats):
+        nested = {}
+        for soil_type in SOIL_IMAGES:
+            nested[f"soil_{soil_type}"] = {band: feature_stats.get(f"soil_{soil_type}_{band}") for band in SOIL_BANDS}
+        nested["climate_conditions"] = {band: feature_stats.get(f"climate_conditions_{band}") for band in CLIMATE_BANDS}
+        return nested
+
     def get_soil_climate_data(self, well_coordinates, start_date = '2023-01-01', end_date =  '2023-12-31'):
         try:
-            well_point = self.create_well_point(well_coordinates)
+            if self.raster_store is not None:
+                sample = self.raster_store.sample(well_coordinates, start_date, end_date)
+                if sample is not None:
+                    logging.info(f"Soil and climate data for location {well_coordinates} read from feature rasters")
+                    return self.nest_feature_stats(sample)
             
-            logging.info(f"Fetching soil and climate data for location: {well_coordinates}")
-            climate_stats = self.fetch_climate_data(start_date, end_date, well_point)
-            logging.info(f"Climate data fetched successfully")
-            logging.info(f"Climate data: {climate_stats.getInfo()}")
-            soil_data = self.fetch_soil_data(well_point)
-            logging.info(f"Soil data fetched successfully")
+            # Keys follow the 30 m soil and 1000 m climate reduce scales
+            soil_key = self.feature_cache.make_key('soil', well_coordinates, 30)
+            climate_key = self.feature_cache.make_key('climate', well_coordinates, 1000, start_date, end_date)
+            soil_stats, climate_conditions = self.feature_cache.get_many([soil_key, climate_key])
             
-            combined_data = {
-                "soil_ph": soil_data["ph"].getInfo(),
-                "soil_carbon": soil_data["carbon"].getInfo(),
-                "soil_sand": soil_data["sand"].getInfo(),
-                "soil_silt": soil_data["silt"].getInfo(),
-                "soil_clay": soil_data["clay"].getInfo(),
-                "climate_conditions": climate_stats.getInfo(),
-            }
+            if soil_stats is None or climate_conditions is None:
+                logging.info(f"Fetching soil and climate data for location: {well_coordinates}")
+                well_point = self.create_well_point(well_coordinates)
+                feature_image = self.build_feature_image(start_date, end_date, soil=soil_stats is None, climate=climate_conditions is None)
+                fetched = self.nest_feature_stats(self.fetch_feature_stats(feature_image, well_point))
+                logging.info(f"Soil and climate data fetched successfully: {fetched}")
+                
+                fetched_items = []
+                if soil_stats is None:
+                    soil_stats = {f"soil_{soil_type}": fetched[f"soil_{soil_type}"] for soil_type in SOIL_IMAGES}
+                    fetched_items.append((soil_key, soil_stats))
+                if climate_conditions is None:
+                    climate_conditions = fetched["climate_conditions"]
+                    fetched_items.append((climate_key, climate_conditions))
+                self.feature_cache.set_many(fetched_items)
+            else:
+                logging.info(f"Soil and climate data for location {well_coordinates} found in cache")
+            
+            combined_data = dict(soil_stats)
+            combined_data["climate_conditions"] = climate_conditions
             return combined_data
         except Exception as e:
             logging.error(f"Error getting soil and climate data: {e}")
             return None
 
+    def get_soil_climate_data_many(self, locations_coords, start_date = '2023-01-01', end_date =  '2023-12-31'):
+        try:
+            combined_data = [None] * len(locations_coords)
+            if self.raster_store is not None:
+                for i, sample in enumerate(self.raster_store.sample_many(locations_coords, start_date, end_date)):
+                    if sample is not None:
+                        combined_data[i] = self.nest_feature_stats(sample)
+            
+            pending = [i for i in range(len(locations_coords)) if combined_data[i] is None]
+            keys = {i: (self.feature_cache.make_key('soil', locations_coords[i], 30),
+                        self.feature_cache.make_key('climate', locations_coords[i], 1000, start_date, end_date)) for i in pending}
+            cached = self.feature_cache.get_many(key for i in pending for key in keys[i])
+            missing = []
+            for n, i in enumerate(pending):
+                soil_stats, climate_conditions = cached[2 * n], cached[2 * n + 1]
+                if soil_stats is None or climate_conditions is None:
+                    missing.append(i)
+                else:
+                    combined_data[i] = dict(soil_stats, climate_conditions=climate_conditions)
+            
+            if missing:
+                logging.info(f"Fetching soil and climate data for {len(missing)} locations ({len(locations_coords) - len(missing)} found in cache)")
+                well_points = [self.create_well_point(locations_coords[i]) for i in missing]
+                feature_image = self.build_feature_image(start_date, end_date)
+                feature_stats = self.fetch_feature_stats_many(feature_image, well_points) or [None] * len(missing)
+                fetched_items = []
+                for i, stats in zip(missing, feature_stats):
+                    if stats is None:
+                        continue
+                    fetched = self.nest_feature_stats(stats)
+                    soil_key, climate_key = keys[i]
+                    fetched_items.append((soil_key, {f"soil_{soil_type}": fetched[f"soil_{soil_type}"] for soil_type in SOIL_IMAGES}))
+                    fetched_items.append((climate_key, fetched["climate_conditions"]))
+                    combined_data[i] = fetched
+                self.feature_cache.set_many(fetched_items)
+                logging.info(f"Soil and climate data fetched for {len(missing)} locations")
+            return combined_data
+        except Exception as e:
+            logging.error(f"Error getting soil and climate data for {len(locations_coords)} locations: {e}")
+            return [None] * len(locations_coords)
+
     def json_to_dataframe(self, json_data):
         try:
             data = {}
@@ -198,55 +703,37 @@ class WellNetworkPredictor:
             logging.error(f"Error converting JSON to DataFrame: {e}")
             return None
     
-    def add_new_node_and_edges(self, new_location_coords, threshold_km=5):
-        try:
-            new_lat, new_lon = new_location_coords
-            logging.info(f"Adding new node at location: {new_location_coords}")
-            self.well_net.add_node('new_node')
-            logging.info(f"New node added successfully")
-            
-            logging.info(f"Adding edges to neighbors within {threshold_km} km")
-            for i in self.well_net.nodes:
-                if i != 'new_node':
-                    existing_lat = self.well_net.nodes[i]['Lat']
-                    existing_lon = self.well_net.nodes[i]['Lon']
-                    distance = geodesic((new_lat, new_lon), (existing_lat, existing_lon)).kilometers
-                    if distance < threshold_km:
-                        self.well_net.add_edge('new_node', i, weight=distance)
-            logging.info(f"Edges added successfully")
-        except Exception as e:
-            logging.error(f"Error adding new node and edges: {e}")
-    
-    def remove_new_node(self):
+    def find_neighbors(self, new_location_coords, threshold_km=5, well_index=None):
         try:
-            self.well_net.remove_node('new_node')
-            logging.info("New node removed successfully")
+            well_index = well_index if well_index is not None else self.well_index
+            logging.info(f"Searching neighbors within {threshold_km} km of location: {new_location_coords}")
+            with span("neighbor_search"):
+                positions, distances = well_index.query_radius(new_location_coords, threshold_km)
+            logging.info(f"Found {len(positions)} neighbors")
+            return positions, distances
         except Exception as e:
-            logging.error(f"Error removing new node: {e}")
+            logging.error(f"Error searching neighbors: {e}")
+            return None
     
-    def compute_depth_using_neighbors(self):
+    def compute_depth_using_neighbors(self, positions, distances, well_index=None):
         try:
-            total_weight = 0
-            weighted_sum = 0
-            
-            logging.info("Computing depth using neighbors")        
-            for neighbor in self.well_net.neighbors('new_node'):
-                weight = 1 / self.well_net.edges['new_node', neighbor]['weight'] if self.well_net.edges['new_node', neighbor]['weight'] > 0 else 0
-                weighted_sum += self.well_net.nodes[neighbor]['DepthToWater_m'] * weight
-                total_weight += weight
+            well_index = well_index if well_index is not None else self.well_index
+            logging.info("Computing depth using neighbors")
+            weights = np.divide(1, distances, out=np.zeros_like(distances), where=distances > 0)
+            total_weight = weights.sum()
             
             if total_weight > 0:
-                logging.info(f"Computed depth using neighbors: {weighted_sum / total_weight} meters")
-                return weighted_sum / total_weight
+                depth = float(np.dot(well_index.depths_at(positions), weights) / total_weight)
+                logging.info(f"Computed depth using neighbors: {depth} meters")
+                return depth
             logging.warning("No neighbors found within threshold distance")
             return None
         except Exception as e:
             logging.error(f"Error computing depth using neighbors: {e}")
             return None
 
-    def predict_depth_with_rf_model(self, new_location_coords):
+    def build_feature_row(self, new_location_coords, extra_data):
         try:
-            extra_data = self.get_soil_climate_data(new_location_coords)
             extra_data_flat = self.json_to_dataframe(extra_data)
             
             combined_features = {
@@ -254,60 +741,296 @@ class WellNetworkPredictor:
                 'Lon': new_location_coords[1],
             }
             combined_features.update(extra_data_flat)
+            return [combined_features[feature] for feature in FEATURES]
+        except Exception as e:
+            logging.error(f"Error building feature row: {e}")
+            return None
+
+    def predict_depth_with_rf_model(self, new_location_coords):
+        try:
+            # Includes the Earth Engine fetches, which are also timed on their own as ee_fetch
+            with span("feature_assembly"):
+                extra_data = self.get_soil_climate_data(new_location_coords)
+                feature_row = self.build_feature_row(new_location_coords, extra_data)
             
-            features = [
-                "soil_ph_b0", "soil_ph_b10", "soil_ph_b100", "soil_ph_b200", "soil_ph_b30", "soil_ph_b60", 
-                "soil_carbon_b0", "soil_carbon_b10", "soil_carbon_b100", "soil_carbon_b200", "soil_carbon_b30", "soil_carbon_b60", 
-                "soil_sand_b0", "soil_sand_b10", "soil_sand_b100", "soil_sand_b200", "soil_sand_b30", "soil_sand_b60", 
-                "soil_silt_b0", "soil_silt_b10", "soil_silt_b100", "soil_silt_b200", "soil_silt_b30", "soil_silt_b60", 
-                "soil_clay_b0", "soil_clay_b10", "soil_clay_b100", "soil_clay_b200", "soil_clay_b30", "soil_clay_b60", 
-                "climate_conditions_ppt", "climate_conditions_tmean", "Lat", "Lon"
-            ]
-            
-            combined_features_vector = pd.DataFrame([list(combined_features.values())], columns=features)
-            
-            return self.rf_model.predict(combined_features_vector)[0]
+            return self.predict_feature_rows([feature_row])[0]
         except Exception as e:
             logging.error(f"Error predicting depth with Random Forest model: {e}")
             return None
+
+    def predict_feature_rows(self, rows):
+        with span("model_inference"):
+            if self.compiled_rf_model is not None and len(rows) <= COMPILED_RF_MAX_ROWS:
+                X = np.asarray(rows, dtype=np.float64)
+                # Masked Earth Engine or raster values come through as NaN, which sklearn routes if the compiled forest cannot
+                if self.compiled_rf_model.missing_left is not None or not np.isnan(X).any():
+                    return self.compiled_rf_model.predict(X)
+            return self.rf_model.predict(pd.DataFrame(rows, columns=FEATURES))
+
+    def predict_many_with_rf_model(self, locations_coords):
+        try:
+            logging.info(f"Predicting depth with Random Forest model for {len(locations_coords)} locations")
+            predicted_depths = [None] * len(locations_coords)
+            rows = []
+            row_positions = []
+            with span("feature_assembly"):
+                extra_data_many = self.get_soil_climate_data_many(locations_coords)
+                for i, (coords, extra_data) in enumerate(zip(locations_coords, extra_data_many)):
+                    feature_row = self.build_feature_row(coords, extra_data) if extra_data else None
+                    if feature_row is not None:
+                        rows.append(feature_row)
+                        row_positions.append(i)
+            
+            if rows:
+                predictions = self.predict_feature_rows(rows)
+                for i, prediction in zip(row_positions, predictions):
+                    predicted_depths[i] = float(prediction)
+            return predicted_depths
+        except Exception as e:
+            logging.error(f"Error predicting depths with Random Forest model: {e}")
+            return [None] * len(locations_coords)
     
-    def compute_and_predict_depth_of_water(self, new_location_coords, threshold_km=5):
-        # shift to fit Morocco's coordinates inside USA's bounding box since the model was trained on USA data
-        # ONLY FOR TESTING PURPOSES
-        new_location_coords = list(new_location_coords)
-        new_location_coords[0] += 2.5
-        new_location_coords[1] -= 80.0
+    def compute_and_predict_depth_of_water(self, new_location_coords, threshold_km=5, profile=None):
+        """
+        Predict depth to water at `new_location_coords`, logging how long each stage of the prediction took.
+        
+        Args:
+            new_location_coords (tuple): (lat, lon) of the location.
+            threshold_km (float): Radius within which wells are used as neighbors.
+            profile (bool or str): Profile this call with pyinstrument or cProfile ("pyinstrument",
+                "cProfile", or True for pyinstrument when installed) and write the report under log/profiles.
+        """
+        if profile:
+            engine = profile if isinstance(profile, str) else None
+            output_filepath = os.path.join('log', 'profiles', f"prediction_{time.strftime('%Y%m%d-%H%M%S')}.txt")
+            with profiled(engine, output_filepath):
+                return self.compute_and_predict_depth_of_water(new_location_coords, threshold_km)
+        
+        with TIMINGS.trace() as spans, span("prediction"):
+            predicted_depth = self._compute_and_predict_depth_of_water(new_location_coords, threshold_km)
+        logging.info(f"Prediction timings: {format_trace(spans)}")
+        return predicted_depth
+
+    def _compute_and_predict_depth_of_water(self, new_location_coords, threshold_km):
+        new_location_coords = shift_coordinates(new_location_coords)
         try:
             logging.info(f"Starting prediction for location: {new_location_coords} with threshold: {threshold_km} km")
             
-            self.add_new_node_and_edges(new_location_coords, threshold_km)
+            # Positions are only valid in the index they were found in, which well updates may swap
+            well_index = self.well_index
+            positions, distances = self.find_neighbors(new_location_coords, threshold_km, well_index)
             
             predicted_depth = None
-            if self.well_net.degree('new_node') > 0:
-                predicted_depth = self.compute_depth_using_neighbors()
+            if len(positions) > 0:
+                predicted_depth = self.compute_depth_using_neighbors(positions, distances, well_index)
                 logging.info(f"Predicted depth using neighbors: {predicted_depth} meters")
             else:
-                predicted_depth = self.predict_depth_with_rf_model(new_location_coords)
-                logging.info(f"Predicted depth using Random Forest model: {predicted_depth} meters")
+                prior = self.lookup_prior_prediction(new_location_coords)
+                if prior is not None:
+                    predicted_depth = prior["predicted_depth"]
+                    logging.info(f"Predicted depth using prior predictions: {predicted_depth} meters")
+                else:
+                    predicted_depth = self.predict_depth_with_rf_model(new_location_coords)
+                    self.record_prediction(new_location_coords, predicted_depth, "random_forest")
+                    logging.info(f"Predicted depth using Random Forest model: {predicted_depth} meters")
             
-            self.remove_new_node()
             logging.info(f"Prediction completed for location: {new_location_coords}")
             return predicted_depth
         except Exception as e:
             logging.error(f"Error computing and predicting depth of water: {e}")
             return None
 
-parser = argparse.ArgumentParser(description ='Take some input')
-parser.add_argument("--lon", type=float, required=True, help="Longitude value")
-parser.add_argument("--lat", type=float, required=True, help="Latitude value")
-args = parser.parse_args()
+    def predict_with_metadata(self, new_location_coords, threshold_km=5):
+        return {
+            "predicted_depth": self.compute_and_predict_depth_of_water(new_location_coords, threshold_km),
+            "artifact_version": self.artifact_version,
+        }
+
+    def estimate_depth(self, new_location_coords, threshold_km=5, k=NEAREST_WELLS_K, max_radius_km=NEAREST_WELLS_MAX_KM):
+        """
+        Estimate depth to water from the well network alone, without Earth Engine or the Random Forest model.
+        
+        Locations with wells within `threshold_km` get the same inverse-distance weighting as
+        `compute_and_predict_depth_of_water`, which is final, and so are prior Random Forest predictions
+        found nearby in the prediction memo. Elsewhere the `k` nearest wells found by doubling the search
+        radius up to `max_radius_km` are weighted instead, as a quick stand-in for the Random Forest prediction.
+        
+        Returns:
+            dict: `predicted_depth` (None if no well is within `max_radius_km`), its `source`
+                ("neighbors", "memo", "nearest_wells" or None), `final`, `n_wells` used, `nearest_well_km`,
+                `radius_km` searched and the `artifact_version` used.
+        """
+        new_location_coords = shift_coordinates(new_location_coords)
+        try:
+            well_index = self.well_index
+            positions, distances = self.find_neighbors(new_location_coords, threshold_km, well_index)
+            final = len(positions) > 0
+            radius_km = threshold_km
+            if not final:
+                prior = self.lookup_prior_prediction(new_location_coords)
+                if prior is not None:
+                    return {
+                        "predicted_depth": prior["predicted_depth"],
+                        "source": "memo",
+                        "final": True,
+                        "n_wells": 0,
+                        "nearest_well_km": None,
+                        "radius_km": radius_km,
+                        "artifact_version": self.artifact_version,
+                    }
+                with span("neighbor_search"):
+                    positions, distances, radius_km = well_index.query_nearest(new_location_coords, k, threshold_km, max_radius_km)
+                logging.info(f"Found {len(positions)} nearest wells within {radius_km} km")
+            
+            predicted_depth = self.compute_depth_using_neighbors(positions, distances, well_index) if len(positions) > 0 else None
+            return {
+                "predicted_depth": predicted_depth,
+                "source": ("neighbors" if final else "nearest_wells") if predicted_depth is not None else None,
+                "final": final and predicted_depth is not None,
+                "n_wells": len(positions),
+                "nearest_well_km": float(distances.min()) if len(distances) > 0 else None,
+                "radius_km": radius_km,
+                "artifact_version": self.artifact_version,
+            }
+        except Exception as e:
+            logging.error(f"Error estimating depth from the well network: {e}")
+            return None
+
+    def predict_many(self, coords, threshold_km=5, workers=1, executor=None):
+        """
+        Predict depth to water for many locations at once.
+        
+        Neighbors of all locations are looked up with a single index query, and the locations
+        without neighbors go through one batched Random Forest prediction.
+        
+        Args:
+            coords (iterable): (lat, lon) pairs of the locations.
+            threshold_km (float): Radius within which wells are used as neighbors.
+            workers (int): Number of processes to split the locations across.
+            executor (ProcessPoolExecutor): Pool of `workers` processes from `process_pool` to reuse across
+                calls, instead of starting (and loading the artifacts in) new processes for this call.
+        
+        Returns:
+            list: Predicted depth in meters for each location, or None where it could not be predicted.
+        """
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        if workers > 1 and len(coords) > 1:
+            return self._predict_many_in_processes(coords, threshold_km, workers, executor)
+        
+        try:
+            logging.info(f"Starting batch prediction for {len(coords)} locations with threshold: {threshold_km} km")
+            shifted_coords = coords + COORDINATE_SHIFT
+            well_index = self.well_index
+            with span("neighbor_search"):
+                neighbors = well_index.query_radius_many(shifted_coords, threshold_km)
+            
+            predicted_depths = [None] * len(coords)
+            rf_positions = []
+            for i, (positions, distances) in enumerate(neighbors):
+                if len(positions) > 0:
+                    predicted_depths[i] = self.compute_depth_using_neighbors(positions, distances, well_index)
+                if predicted_depths[i] is None:
+                    rf_positions.append(i)
+            
+            if rf_positions:
+                rf_depths = self.predict_many_with_rf_model([list(shifted_coords[i]) for i in rf_positions])
+                for i, depth in zip(rf_positions, rf_depths):
+                    predicted_depths[i] = depth
+            
+            logging.info(f"Batch prediction completed: {len(coords) - len(rf_positions)} from neighbors, {len(rf_positions)} from Random Forest model")
+            return predicted_depths
+        except Exception as e:
+            logging.error(f"Error predicting depths in batch: {e}")
+            return [None] * len(coords)
+
+    def process_pool(self, workers):
+        """
+        Pool of `workers` processes, each with its own predictor loaded from the same artifacts.
+        """
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(self.rf_model_filepath, self.well_network_filepath, self.project,
+                      self.feature_cache_filepath, self.raster_store_directory, self.prediction_memo_filepath,
+                      self.well_shards_directory),
+        )
+
+    def _predict_many_in_processes(self, coords, threshold_km, workers, executor=None):
+        chunks = np.array_split(coords, min(workers, len(coords)))
+        logging.info(f"Splitting batch prediction of {len(coords)} locations across {len(chunks)} processes")
+        if executor is None:
+            with self.process_pool(len(chunks)) as executor:
+                return self._predict_many_in_processes(coords, threshold_km, workers, executor)
+        results = executor.map(_predict_chunk, chunks, [threshold_km] * len(chunks))
+        return [depth for chunk_depths in results for depth in chunk_depths]
+
+_worker_predictor = None
+
+def _init_worker(rf_model_filepath, well_network_filepath, project, feature_cache_filepath, raster_store_directory, prediction_memo_filepath, well_shards_directory):
+    global _worker_predictor
+    _worker_predictor = WellNetworkPredictor(rf_model_filepath, well_network_filepath, project,
+                                             feature_cache_filepath, raster_store_directory, prediction_memo_filepath,
+                                             well_shards_directory)
+
+def _predict_chunk(coords, threshold_km):
+    return _worker_predictor.predict_many(coords, threshold_km)
+
+def read_coordinates(filepath):
+    if filepath.endswith('.parquet'):
+        df = pd.read_parquet(filepath)
+    else:
+        df = pd.read_csv(filepath)
+    columns = {column.lower(): column for column in df.columns}
+    if 'lat' not in columns or 'lon' not in columns:
+        raise ValueError(f"{filepath} must have 'lat' and 'lon' columns")
+    return df, df[[columns['lat'], columns['lon']]].to_numpy(dtype=float)
+
+def write_predictions(df, filepath):
+    if filepath.endswith('.parquet'):
+        df.to_parquet(filepath, index=False)
+    else:
+        df.to_csv(filepath, index=False)
+
+def main():
+    parser = argparse.ArgumentParser(description ='Take some input')
+    parser.add_argument("--lon", type=float, help="Longitude value")
+    parser.add_argument("--lat", type=float, help="Latitude value")
+    parser.add_argument("--input", help="CSV or Parquet file with lat and lon columns to predict in bulk")
+    parser.add_argument("--output", help="CSV or Parquet file the bulk predictions are written to")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes used for bulk prediction")
+    parser.add_argument("--threshold-km", type=float, default=5, help="Radius within which wells are used as neighbors")
+    parser.add_argument("--profile", nargs='?', const=True, choices=["pyinstrument", "cProfile"],
+                        help="Profile the single prediction, with pyinstrument if installed unless an engine is given")
+    parser.add_argument("--timings", help="JSON file the per-stage timing histograms are written to")
+    args = parser.parse_args()
+    
+    if args.input:
+        if not args.output:
+            parser.error("--output is required with --input")
+        df, coords = read_coordinates(args.input)
+        predictplz = WellNetworkPredictor()
+        df['predicted_depth'] = predictplz.predict_many(coords, args.threshold_km, args.workers)
+        write_predictions(df, args.output)
+        print(f"Wrote {len(df)} predictions to {args.output}")
+        if args.timings:
+            TIMINGS.dump(args.timings)
+        return
     
-lon = args.lon
-lat = args.lat
-predictplz = WellNetworkPredictor()
-new_location_coords = (lat, lon)
-predicted_depth = predictplz.compute_and_predict_depth_of_water(new_location_coords)
-print(predicted_depth)
+    if args.lat is None or args.lon is None:
+        parser.error("--lat and --lon are required unless --input is given")
+    predictplz = WellNetworkPredictor()
+    new_location_coords = (args.lat, args.lon)
+    predicted_depth = predictplz.compute_and_predict_depth_of_water(new_location_coords, args.threshold_km, profile=args.profile)
+    print(predicted_depth)
+    if args.timings:
+        TIMINGS.dump(args.timings)
+
+if __name__ == '__main__':
+    main()
 
 # # location in USA
-# python predictor.py --lon -122.3321 --lat 47.6062
\ No newline at end of file
+# python predictor.py --lon -122.3321 --lat 47.6062
+# # bulk prediction
+# python predictor.py --input candidates.csv --output predictions.csv --workers 4
+# # stage timings and a profile of one prediction
+# python predictor.py --lon -122.3321 --lat 47.6062 --timings log/timings.json --profile
@@ -0,0 +1,124 @@
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from sqlite_cache import SQLiteCache
+
+
+class QueryEmbeddingCache(SQLiteCache):
+    """
+    Bounded in-memory LRU of query embeddings, optionally backed by a SQLite file.
+
+    Entries are keyed by the embedding model and the normalized query text, so repeated questions
+    skip the feature-extraction call. Entries expire after `ttl_seconds`, and the least recently used
+    ones are evicted once the cache holds more than `max_entries`. With a `filepath`, embeddings are
+    written through to disk and a memory miss falls back to the file, so the cache survives restarts;
+    the oldest rows of the file are evicted every `evict_every` inserts.
+
+    Attributes:
+        hits: Number of lookups answered from memory or disk.
+        disk_hits: Number of lookups answered from disk after a memory miss.
+        misses: Number of lookups that were missing or expired.
+        evictions: Number of entries evicted from memory to stay within `max_entries`.
+    """
+
+    table = 'query_embeddings'
+
+    def __init__(self, max_entries=1024, ttl_seconds=7 * 24 * 3600, filepath=None, evict_every=100):
+        """
+        Args:
+            max_entries (int): Maximum number of embeddings kept in memory, and on disk, where it is
+                exceeded by at most `evict_every` between evictions.
+            ttl_seconds (float): Age after which an embedding is considered stale.
+            filepath (str): Optional path to the SQLite file persisting the cache.
+            evict_every (int): Number of inserts after which the oldest embeddings on disk are evicted.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.evict_every = evict_every
+        self._inserts_since_eviction = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self.entries = OrderedDict()
+        super().__init__(filepath)
+
+    def _create_tables(self):
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS query_embeddings ("
+            "model TEXT NOT NULL, query TEXT NOT NULL, vector BLOB NOT NULL, created_at REAL NOT NULL, "
+            "PRIMARY KEY (model, query))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS query_embeddings_created_at ON query_embeddings (created_at)")
+        self._conn.execute("DELETE FROM query_embeddings WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        self._evict()
+
+    def get(self, model, query):
+        now = time.time()
+        key = (model, query)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and now - entry[1] > self.ttl_seconds:
+                del self.entries[key]
+                entry = None
+            if entry is None and self.filepath:
+                row = self._conn.execute(
+                    "SELECT vector, created_at FROM query_embeddings WHERE model = ? AND query = ?", key).fetchone()
+                if row is not None and now - row[1] <= self.ttl_seconds:
+                    entry = (np.frombuffer(row[0], dtype=np.float64), row[1])
+                    self._put(key, entry)
+                    self.disk_hits += 1
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return entry[0].tolist()
+
+    def set(self, model, query, embedding):
+        now = time.time()
+        key = (model, query)
+        vector = np.asarray(embedding, dtype=np.float64)
+        with self._lock:
+            self._put(key, (vector, now))
+            if self.filepath:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO query_embeddings (model, query, vector, created_at) VALUES (?, ?, ?, ?)",
+                        (model, query, vector.tobytes(), now),
+                    )
+                    self._inserts_since_eviction += 1
+                    if self._inserts_since_eviction >= self.evict_every:
+                        self._evict()
+
+    def _evict(self):
+        self._inserts_since_eviction = 0
+        count = self._conn.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM query_embeddings WHERE rowid IN "
+                "(SELECT rowid FROM query_embeddings ORDER BY created_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def _put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def _count_entries(self):
+        # Entries held in memory, the file may hold more
+        return len(self.entries)
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stats.update(
+                disk_hits=self.disk_hits,
+                evictions=self.evictions,
+                memory_bytes=sum(vector.nbytes for vector, _ in self.entries.values()),
+            )
+        return stats
+
@@ -1,10 +1,21 @@
+import functools
 import json
-import pinecone
 import requests
 import numpy as np
-import tqdm
 import logging
 import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from embedding_cache import EmbeddingCache, content_hash
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from query_cache import QueryEmbeddingCache
+from vector_index import LocalVectorIndex, PineconeIndex
+
+# Set on an index whose doc_{i} vectors of earlier versions are still to be deleted
+LEGACY_PURGE_FLAG = 'legacy_purge_pending'
 
 # Configure logging
 log_folder = 'log'
@@ -32,14 +43,79 @@ with open('apis_keys.json') as f:
 pinecone_api_key = data["pinecone"]["api_key"]
 huggingface_api_key = data["huggingface"]["api_key"]
 
+def load_articles(laws_folder='laws'):
+    """
+    Read the articles of the laws folder.
+
+    Returns:
+        dict: Text of each article by name (the file name without extension, e.g. "article_12"), in article order.
+    """
+    articles = {}
+    filenames = [filename for filename in os.listdir(laws_folder) if filename.endswith('.txt')]
+    for filename in sorted(filenames, key=lambda name: [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]):
+        with open(os.path.join(laws_folder, filename), 'r', encoding='utf-8') as file:
+            articles[os.path.splitext(filename)[0]] = file.read()
+    return articles
+
+@functools.lru_cache(maxsize=None)
+def nlp_normalizer():
+    """
+    `nlp.normalize_query`, imported on first use so importing this module does not load camel_tools or
+    NLTK, or None if it cannot be imported. The import is only attempted once.
+    """
+    try:
+        from nlp import normalize_query as nlp_normalize_query
+        return nlp_normalize_query
+    except Exception as e:
+        logger.warning(f"Could not import nlp, queries are used as is: {e}")
+        return None
+
+def normalize_query(query):
+    """
+    Normalize a question like the articles were (see `nlp.normalize_query`), or just strip it if that fails.
+    """
+    normalize = nlp_normalizer()
+    if normalize is None:
+        return query.strip()
+    try:
+        return normalize(query) or query.strip()
+    except Exception as e:
+        logger.warning(f"Could not normalize query, using it as is: {e}")
+        return query.strip()
+
+def document_id(name, text):
+    # Stable across runs and listing orders, and changes whenever the text does
+    return f"{name}_{content_hash(text)[:16]}"
+
+
 class HuggingFaceEmbedding:
-    def __init__(self, model_name='sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'):
+    """
+    Sentence embeddings from the Hugging Face feature-extraction endpoint.
+
+    Requests go through one `requests.Session` whose connection pool keeps up to `max_workers`
+    keep-alive connections, and rate limiting or server errors are retried with backoff.
+    `generate_embeddings` sends texts in batches (a list input per request) with up to
+    `max_workers` batches in flight. With a `cache`, texts embedded before are not sent again.
+    `embed_query` looks questions up in `query_cache` before calling the endpoint.
+    """
+
+    def __init__(self, model_name='sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2', api_url=None, max_workers=4, timeout_s=120, cache=None, query_cache=None):
         self.model_name = model_name
-        self.api_url = f"https://api-inference.huggingface.co/pipeline/feature-extraction/{model_name}"
+        self.cache = cache
+        self.query_cache = query_cache
+        self.api_url = api_url or f"https://api-inference.huggingface.co/pipeline/feature-extraction/{model_name}"
         self.headers = {
             "Authorization": f"Bearer {huggingface_api_key}",
             "Content-Type": "application/json"
         }
+        self.max_workers = max_workers
+        self.timeout_s = timeout_s
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        retry = Retry(total=3, backoff_factor=1, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=["POST"])
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         logger.info(f"\nInitialized HuggingFaceEmbedding with model {model_name}")
     
     def generate_embedding(self, text):
@@ -50,10 +126,10 @@ class HuggingFaceEmbedding:
         }
         
         try:
-            response = requests.post(
+            response = self.session.post(
                 self.api_url, 
-                headers=self.headers, 
-                json=payload
+                json=payload,
+                timeout=self.timeout_s
             )
             response.raise_for_status()
             embedding = response.json()
@@ -65,6 +141,88 @@ class HuggingFaceEmbedding:
             logger.error(f"Error generating embedding: {e}")
             return None
     
+    def embed_query(self, query):
+        """
+        Embed a question normalized like the articles were (see `nlp.normalize_query`), so rephrasings
+        that only differ in formatting or stopwords share one cache entry.
+        """
+        normalized = normalize_query(query)
+        if self.query_cache is None:
+            return self.generate_embedding(normalized)
+
+        embedding = self.query_cache.get(self.model_name, normalized)
+        if embedding is not None:
+            logger.info(f"\nQuery embedding found in cache for: {normalized[:50]}...")
+            return embedding
+        embedding = self.generate_embedding(normalized)
+        if embedding is not None:
+            self.query_cache.set(self.model_name, normalized, embedding)
+        return embedding
+
+    def generate_embeddings(self, texts, batch_size=32):
+        """
+        Embed many texts with one request per batch of `batch_size` texts, sending batches concurrently.
+
+        Returns:
+            list: Normalized embedding of each text, or None for the texts of batches that failed.
+        """
+        if self.cache is None:
+            return self._embed_texts(texts, batch_size)
+
+        hashes = [content_hash(text) for text in texts]
+        embeddings = self.cache.get_many(self.model_name, list(set(hashes)))
+        missing = {digest: text for digest, text in zip(hashes, texts) if digest not in embeddings}
+        logger.info(f"\n{len(texts) - len(missing)} of {len(texts)} embeddings found in cache")
+        if missing:
+            embedded = dict(zip(missing, self._embed_texts(list(missing.values()), batch_size)))
+            embedded = {digest: embedding for digest, embedding in embedded.items() if embedding is not None}
+            self.cache.set_many(self.model_name, embedded)
+            embeddings.update(embedded)
+        return [embeddings.get(digest) for digest in hashes]
+
+    def _embed_texts(self, texts, batch_size):
+        batches = [texts[start:start + batch_size] for start in range(0, len(texts), batch_size)]
+        logger.info(f"\nGenerating embeddings for {len(texts)} texts in {len(batches)} batches")
+        if not batches:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as executor:
+            results = list(executor.map(self._embed_batch, batches))
+
+        positions = []
+        rows = []
+        for start, batch_embeddings in zip(range(0, len(texts), batch_size), results):
+            if batch_embeddings is None:
+                continue
+            for i, embedding in enumerate(batch_embeddings):
+                positions.append(start + i)
+                rows.append(embedding[0] if isinstance(embedding[0], list) else embedding)
+
+        embeddings = [None] * len(texts)
+        if rows:
+            matrix = np.asarray(rows, dtype=np.float64)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            normalized = np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+            for position, embedding in zip(positions, normalized.tolist()):
+                embeddings[position] = embedding
+        logger.info(f"Generated {len(rows)} of {len(texts)} embeddings")
+        return embeddings
+
+    def _embed_batch(self, batch):
+        payload = {
+            "inputs": batch,
+            "options": {"wait_for_model": True}
+        }
+        try:
+            response = self.session.post(self.api_url, json=payload, timeout=self.timeout_s)
+            response.raise_for_status()
+            batch_embeddings = response.json()
+            if len(batch_embeddings) != len(batch):
+                raise ValueError(f"got {len(batch_embeddings)} embeddings for {len(batch)} texts")
+            return batch_embeddings
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"Error generating embeddings for a batch of {len(batch)} texts: {e}")
+            return None
+
     def _normalize_embedding(self, embedding):
         if isinstance(embedding[0], list):
             embedding = embedding[0]
@@ -74,45 +232,201 @@ class HuggingFaceEmbedding:
         return normalized_embedding
 
 class ArabicRAG:
-    def __init__(self, index_name='water-laws', dimension=384):
-        self.embedding_model = HuggingFaceEmbedding()
-        self.pc = pinecone.Pinecone(api_key=pinecone_api_key)
+    """
+    Retrieval over the embedded law articles.
+
+    The vectors live either in a hosted Pinecone index or, with `backend='local'`, in a
+    LocalVectorIndex on disk that answers queries in-process without network access.
+    Query embeddings are kept in a QueryEmbeddingCache, persisted to `query_cache_filepath` if given.
+    A BM25 LexicalIndex over the articles of `laws_folder` serves lexical retrieval, article number
+    lookups and, fused with the dense ranking, the `retrieval='hybrid'` mode.
+    """
+
+    def __init__(self, index_name='water-laws', dimension=384, embedding_cache_filepath='bins/embedding_cache.db', backend='pinecone', local_index_directory='bins/vector_index', query_cache_filepath='bins/query_cache.db', query_cache_size=1024, query_cache_ttl_seconds=7 * 24 * 3600, retrieval='dense', laws_folder='laws'):
+        self.embedding_cache = EmbeddingCache(embedding_cache_filepath)
+        self.query_cache = QueryEmbeddingCache(query_cache_size, query_cache_ttl_seconds, query_cache_filepath)
+        self.embedding_model = HuggingFaceEmbedding(cache=self.embedding_cache, query_cache=self.query_cache)
         self.index_name = index_name
         self.dimension = dimension
+        self.backend = backend
+        self.retrieval = retrieval
+        self.laws_folder = laws_folder
+        self._lexical_index = None
         
-        try:
-            self.pc.create_index(
-                name=self.index_name, 
-                dimension=self.dimension, 
-                metric='cosine'
-            )
-            logger.info(f"Index {self.index_name} created successfully")
-        except Exception as e:
-            logger.warning(f"Index may already exist: {e}")
-        
-        self.index = self.pc.Index(self.index_name)
-        logger.info(f"Connected to index {self.index_name}")
+        if backend == 'local':
+            self.index = LocalVectorIndex(local_index_directory, dimension)
+        elif backend == 'pinecone':
+            self.index = PineconeIndex(index_name, dimension, pinecone_api_key)
+        else:
+            raise ValueError(f"Unknown vector index backend: {backend}")
     
-    def upsert_documents(self, documents):
-        logger.info("\nUpserting documents into Pinecone index")
-        vectors = []
-        for i, doc in enumerate(tqdm.tqdm(documents)):
-            embedding = self.embedding_model.generate_embedding(doc)
-            
-            if embedding is not None:
-                vectors.append((
-                    f"doc_{i}",
-                    embedding,
-                    {"text": doc}
-                ))
-        
-        if vectors:
+    def upsert_documents(self, documents, batch_size=32, upsert_batch_size=100, max_upserts_in_flight=4):
+        """
+        Embed and upsert documents under content-addressed ids, streaming them through fixed-size upsert batches.
+
+        Documents are embedded `upsert_batch_size` at a time, and each batch is upserted in the
+        background while the next one is embedded, with at most `max_upserts_in_flight` upserts
+        running at once. Every upserted batch is recorded in the embedding cache right away, which
+        is the checkpoint `sync_documents` resumes from if the run is interrupted.
+
+        Args:
+            documents (dict): Text of each document by name, e.g. as returned by `load_articles`.
+            batch_size (int): Texts per embedding request.
+            upsert_batch_size (int): Vectors per upsert request, kept under the request size limit of the index.
+            max_upserts_in_flight (int): Upsert requests sent concurrently.
+
+        Returns:
+            dict: Name of each upserted document by vector id.
+        """
+        logger.info(f"\nUpserting {len(documents)} documents into index {self.index.name} in batches of {upsert_batch_size}")
+        names = list(documents)
+        upserted = {}
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_upserts_in_flight) as executor:
+            pending = set()
+            for batch_start in range(0, len(names), upsert_batch_size):
+                batch_names = names[batch_start:batch_start + upsert_batch_size]
+                texts = [documents[name] for name in batch_names]
+                embeddings = self.embedding_model.generate_embeddings(texts, batch_size=batch_size)
+                vectors = [
+                    (document_id(name, doc), embedding, {"text": doc, "name": name, "content_hash": content_hash(doc)})
+                    for name, doc, embedding in zip(batch_names, texts, embeddings)
+                    if embedding is not None
+                ]
+                if not vectors:
+                    continue
+                # Bound the embedded batches waiting for an upsert slot
+                if len(pending) >= 2 * max_upserts_in_flight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        upserted.update(future.result())
+                pending.add(executor.submit(self._upsert_batch, vectors))
+            for future in pending:
+                upserted.update(future.result())
+
+        elapsed = time.perf_counter() - start
+        logger.info(f"{len(upserted)} of {len(documents)} documents upserted in {elapsed:.1f} s "
+                    f"({len(upserted) / elapsed if elapsed > 0 else 0:.1f} docs/s)")
+        return upserted
+
+    def _upsert_batch(self, vectors):
+        try:
             self.index.upsert(vectors)
-            logger.info("Documents upserted successfully")
+        except Exception as e:
+            logger.error(f"Error upserting a batch of {len(vectors)} vectors: {e}")
+            return {}
+        upserted = {vector_id: metadata["name"] for vector_id, _, metadata in vectors}
+        self.embedding_cache.record_indexed(self.index.name, upserted)
+        return upserted
+
+    def sync_documents(self, documents, batch_size=32, full=False, upsert_batch_size=100, max_upserts_in_flight=4):
+        """
+        Bring the index in line with `documents`, embedding and upserting only the new or changed ones.
+
+        The vector ids the index holds are tracked in the embedding cache, batch by batch, so
+        syncing again after an interrupted or partly failed run only upserts what is missing.
+        Vectors of removed or changed documents are deleted once their replacement is upserted.
+        The `doc_{i}` vectors of earlier versions are deleted once a sync of the index upserts
+        every document, so a first sync that fails leaves them serving.
+        With `full`, every document is upserted again (from the embedding cache), e.g. after the
+        index was recreated.
+
+        Args:
+            documents (dict): Text of each document by name, e.g. as returned by `load_articles`.
+
+        Returns:
+            dict: Number of documents `upserted`, vectors `deleted`, documents left `unchanged` and
+                  documents that `failed` to be embedded or upserted.
+        """
+        indexed = self.embedding_cache.indexed_vectors(self.index.name)
+        current = {document_id(name, text): name for name, text in documents.items()}
+        changed = {name: documents[name] for vector_id, name in current.items() if full or vector_id not in indexed}
+        # Flagged before upserting, as once the first batch is tracked the index no longer looks unsynced
+        if not indexed:
+            self.embedding_cache.set_flag(self.index.name, LEGACY_PURGE_FLAG)
+
+        upserted = self.upsert_documents(changed, batch_size, upsert_batch_size, max_upserts_in_flight) if changed else {}
+        # Documents whose new version did not make it keep their previous vector
+        failed = set(changed) - set(upserted.values())
+        stale = [vector_id for vector_id, name in indexed.items() if vector_id not in current and name not in failed]
+        for start in range(0, len(stale), 1000):
+            self.index.delete(ids=stale[start:start + 1000])
+        self.embedding_cache.forget_indexed(self.index.name, stale)
+        legacy = []
+        if not failed and self.embedding_cache.has_flag(self.index.name, LEGACY_PURGE_FLAG):
+            legacy = self.legacy_vector_ids(len(documents))
+            for start in range(0, len(legacy), 1000):
+                self.index.delete(ids=legacy[start:start + 1000])
+            self.embedding_cache.set_flag(self.index.name, LEGACY_PURGE_FLAG, False)
+        self._lexical_index = LexicalIndex(documents)
+
+        summary = {"upserted": len(upserted), "deleted": len(stale) + len(legacy), "unchanged": len(current) - len(changed), "failed": len(failed)}
+        logger.info(f"Synced {len(documents)} documents into index {self.index.name}: {summary}")
+        return summary
+
+    def legacy_vector_ids(self, n_documents):
+        try:
+            return [vector_id for page in self.index.list(prefix='doc_') for vector_id in page]
+        except Exception as e:
+            # Pod-based indexes cannot list ids; earlier versions used doc_0 ... doc_{n-1} for the n files of laws/
+            logger.info(f"Could not list legacy vector ids ({e}), deleting doc_0 to doc_{n_documents - 1}")
+            return [f"doc_{i}" for i in range(n_documents)]
     
-    def retrieve_relevant_context(self, query, top_k=6):
-        logger.info(f"Retrieving relevant context for query: {query[:50]}...")
-        query_embedding = self.embedding_model.generate_embedding(query)
+    @property
+    def lexical_index(self):
+        if self._lexical_index is None:
+            if not os.path.isdir(self.laws_folder):
+                logger.warning(f"No articles folder at {self.laws_folder}, lexical retrieval and article lookups return nothing")
+            self._lexical_index = LexicalIndex(load_articles(self.laws_folder) if os.path.isdir(self.laws_folder) else {})
+            logger.info(f"Built lexical index over {len(self._lexical_index)} articles of {self.laws_folder}")
+        return self._lexical_index
+
+    def retrieve_relevant_context(self, query, top_k=6, retrieval=None):
+        """
+        Retrieve the articles most relevant to `query`.
+
+        Articles the query refers to as "المادة N" come first, and a query made only of such
+        references is answered from the lexical index without any remote call.
+
+        Args:
+            query (str): The question.
+            top_k (int): Number of articles to return.
+            retrieval (str): 'dense' (embedding similarity), 'lexical' (BM25, no network) or 'hybrid'
+                (both rankings fused with reciprocal rank fusion). Defaults to the mode the instance was created with.
+
+        Returns:
+            list: Text of each retrieved article, best first.
+        """
+        retrieval = retrieval or self.retrieval
+        logger.info(f"Retrieving relevant context ({retrieval}) for query: {query[:50]}...")
+        normalized = normalize_query(query)
+        referenced = [self.lexical_index.texts[position] for position in self.lexical_index.referenced_articles(normalized)]
+        if self.lexical_index.is_reference_only(normalized):
+            logger.info(f"Resolved {len(referenced)} referenced articles from the lexical index")
+            return referenced[:top_k]
+
+        if retrieval == 'lexical':
+            ranked = self._lexical_search(normalized, top_k)
+        elif retrieval == 'dense':
+            ranked = self._dense_search(query, top_k)
+        elif retrieval == 'hybrid':
+            # Fuse deeper candidate lists, so articles ranked a little lower by one retriever can still make the cut
+            n_candidates = max(4 * top_k, 20)
+            rankings = [self._lexical_search(normalized, n_candidates), self._dense_search(query, n_candidates)]
+            ranked = [text for text, _ in reciprocal_rank_fusion([ranking for ranking in rankings if ranking])]
+        else:
+            raise ValueError(f"Unknown retrieval mode: {retrieval}")
+
+        contexts = list(dict.fromkeys(referenced + ranked))[:top_k]
+        logger.info(f"Retrieved {len(contexts)} relevant contexts")
+        return contexts
+
+    def _lexical_search(self, normalized_query, top_k):
+        return [self.lexical_index.texts[position] for position, _ in self.lexical_index.search(normalized_query, top_k)]
+
+    def _dense_search(self, query, top_k):
+        query_embedding = self.embedding_model.embed_query(query)
+        logger.info(f"Query embedding cache: {self.query_cache.stats()}")
         
         if query_embedding is None:
             return []
@@ -123,13 +437,10 @@ class ArabicRAG:
             include_metadata=True
         )
         
-        contexts = [
+        return [
             result['metadata']['text'] 
             for result in results['matches']
         ]
-        
-        logger.info(f"Retrieved {len(contexts)} relevant contexts")
-        return contexts
     
     def generate_response(self, query):
         logger.info(f"\nGenerating response for query: {query[:50]}...")
@@ -143,16 +454,11 @@ class ArabicRAG:
         logger.info("Response generated successfully")
         return response
 
-rag = ArabicRAG(index_name='water-laws')
-
-# Read all txt files in the laws/ folder
-laws_folder = 'laws'
-arabic_documents = []
+if __name__ == '__main__':
+    rag = ArabicRAG(index_name='water-laws')
 
-for filename in os.listdir(laws_folder):
-    if filename.endswith('.txt'):
-        filepath = os.path.join(laws_folder, filename)
-        with open(filepath, 'r', encoding='utf-8') as file:
-            arabic_documents.append(file.read())
+    # Read all txt files in the laws/ folder
+    arabic_documents = load_articles('laws')
 
-# rag.upsert_documents(arabic_documents)
\ No newline at end of file
+    # Only new or edited articles are embedded and upserted, removed ones are deleted
+    # rag.sync_documents(arabic_documents)
@@ -0,0 +1,191 @@
+import argparse
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from geo import KM_PER_DEGREE
+
+# Earth Engine limits computePixels requests to 48 MB, which 512x512 float32 pixels of 32 bands fit in
+TILE_SIZE = 512
+NODATA = -9999.0
+
+
+def create_grid(directory, prefix, dtype, shape):
+    """
+    Memory-mapped array for a new version of a grid, kept out of readers' sight until `publish_grid`.
+
+    Returns:
+        tuple: The writable array and the file name it will be published under.
+    """
+    os.makedirs(directory, exist_ok=True)
+    filename = f"{prefix}.{time.time_ns()}.npy"
+    grid = np.lib.format.open_memmap(os.path.join(directory, f"{filename}.tmp"), mode='w+', dtype=dtype, shape=shape)
+    return grid, filename
+
+
+def publish_grid(grid, directory, filename, manifest):
+    """
+    Swap in a grid written with `create_grid` together with its manifest.
+
+    The grid file is renamed into place before the manifest naming it replaces the previous one, so a
+    reader opening the directory sees either the old grid or the new one, and a process that has the
+    old grid memory-mapped keeps reading it.
+    """
+    grid.flush()
+    os.replace(os.path.join(directory, f"{filename}.tmp"), os.path.join(directory, filename))
+    tmp_filepath = os.path.join(directory, f"manifest.json.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_filepath, 'w') as f:
+        json.dump({**manifest, 'grid_file': filename}, f, indent=2)
+    os.replace(tmp_filepath, os.path.join(directory, 'manifest.json'))
+    prefix = filename.split('.')[0]
+    for other in os.listdir(directory):
+        if other != filename and other.startswith(f"{prefix}.") and other.endswith('.npy'):
+            try:
+                os.remove(os.path.join(directory, other))
+            except OSError:
+                pass
+
+
+class RasterStore:
+    """
+    Soil and climate feature grids materialised from Earth Engine for a fixed region.
+
+    The grid is stored as a memory-mapped `features.<version>.npy` array of shape (rows, cols, bands) next to
+    a `manifest.json` describing the band names, the date range of the climate bands and the affine
+    transform (north-west corner and pixel size in degrees), so sampling a point is a single array read.
+
+    Attributes:
+        bands: Feature names of the bands, in the order of the last array axis.
+        bbox: (min_lon, min_lat, max_lon, max_lat) covered by the grid.
+        start_date: Start of the date range the climate bands were averaged over.
+        end_date: End of the date range the climate bands were averaged over.
+    """
+
+    def __init__(self, directory='bins/feature_rasters'):
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            manifest = json.load(f)
+        self.directory = directory
+        self.bands = manifest['bands']
+        self.start_date = manifest['start_date']
+        self.end_date = manifest['end_date']
+        self.west, self.north, self.pixel_size = manifest['transform']
+        # Directories written before grids were versioned hold a plain features.npy
+        self.data = np.load(os.path.join(directory, manifest.get('grid_file', 'features.npy')), mmap_mode='r')
+        rows, cols, _ = self.data.shape
+        self.bbox = (self.west, self.north - rows * self.pixel_size, self.west + cols * self.pixel_size, self.north)
+
+    def pixel_indices(self, coords):
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        rows = np.floor((self.north - coords[:, 0]) / self.pixel_size).astype(np.int64)
+        cols = np.floor((coords[:, 1] - self.west) / self.pixel_size).astype(np.int64)
+        inside = (rows >= 0) & (rows < self.data.shape[0]) & (cols >= 0) & (cols < self.data.shape[1])
+        return rows, cols, inside
+
+    def sample(self, coords, start_date, end_date):
+        return self.sample_many([coords], start_date, end_date)[0]
+
+    def sample_many(self, coords, start_date, end_date):
+        """
+        Read the feature values of each location from the grid.
+
+        Returns:
+            list: Dict of feature name to value (None where masked) for each location, or None for
+                locations outside the grid or when the date range differs from the exported one.
+        """
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        if (start_date, end_date) != (self.start_date, self.end_date):
+            return [None] * len(coords)
+        rows, cols, inside = self.pixel_indices(coords)
+        values = np.asarray(self.data[rows[inside], cols[inside]], dtype=np.float64)
+
+        samples = [None] * len(coords)
+        for i, pixel in zip(np.flatnonzero(inside), values):
+            samples[i] = {band: None if np.isnan(value) else float(value) for band, value in zip(self.bands, pixel)}
+        return samples
+
+
+def export_feature_rasters(feature_image, bands, bbox, directory, start_date, end_date, scale_m=250):
+    """
+    Download `feature_image` over `bbox` tile by tile into a RasterStore directory.
+
+    Args:
+        feature_image (ee.Image): Image whose bands are the features to export.
+        bands (list): Names of the bands to export, in order.
+        bbox (tuple): (min_lon, min_lat, max_lon, max_lat) of the region to export.
+        directory (str): Directory the grid and manifest are written to.
+        start_date (str): Start of the date range the climate bands were averaged over.
+        end_date (str): End of the date range the climate bands were averaged over.
+        scale_m (float): Pixel size in meters.
+    """
+    import ee
+
+    min_lon, min_lat, max_lon, max_lat = bbox
+    pixel_size = scale_m / (KM_PER_DEGREE * 1000)
+    rows = math.ceil((max_lat - min_lat) / pixel_size)
+    cols = math.ceil((max_lon - min_lon) / pixel_size)
+    data, grid_file = create_grid(directory, 'features', np.float32, (rows, cols, len(bands)))
+
+    image = feature_image.select(bands).toFloat().unmask(NODATA)
+    n_tiles = math.ceil(rows / TILE_SIZE) * math.ceil(cols / TILE_SIZE)
+    logging.info(f"Exporting {rows}x{cols} pixels of {len(bands)} bands in {n_tiles} tiles to {directory}")
+    for row in range(0, rows, TILE_SIZE):
+        for col in range(0, cols, TILE_SIZE):
+            height = min(TILE_SIZE, rows - row)
+            width = min(TILE_SIZE, cols - col)
+            tile = ee.data.computePixels({
+                'expression': image,
+                'fileFormat': 'NUMPY_NDARRAY',
+                'grid': {
+                    'dimensions': {'width': width, 'height': height},
+                    'affineTransform': {
+                        'scaleX': pixel_size, 'shearX': 0, 'translateX': min_lon + col * pixel_size,
+                        'shearY': 0, 'scaleY': -pixel_size, 'translateY': max_lat - row * pixel_size,
+                    },
+                    'crsCode': 'EPSG:4326',
+                },
+            })
+            block = np.stack([tile[band] for band in bands], axis=-1).astype(np.float32)
+            block[block == NODATA] = np.nan
+            data[row:row + height, col:col + width] = block
+            logging.info(f"Exported tile at row {row}, col {col}")
+    publish_grid(data, directory, grid_file, {
+        'bands': list(bands),
+        'start_date': start_date,
+        'end_date': end_date,
+        'transform': [min_lon, max_lat, pixel_size],
+    })
+    logging.info(f"Feature rasters exported to {directory}")
+
+
+def main():
+    from predictor import FEATURE_BANDS, WellNetworkPredictor, initialize_earth_engine
+
+    parser = argparse.ArgumentParser(description='Export soil and climate feature rasters for offline prediction')
+    parser.add_argument("--bbox", type=float, nargs=4, required=True, metavar=('MIN_LON', 'MIN_LAT', 'MAX_LON', 'MAX_LAT'),
+                        help="Region to export, in the (shifted) coordinates the model is queried with")
+    parser.add_argument("--output", default='bins/feature_rasters', help="Directory the rasters are written to")
+    parser.add_argument("--scale", type=float, default=250, help="Pixel size in meters")
+    parser.add_argument("--start-date", default='2023-01-01', help="Start of the climate date range")
+    parser.add_argument("--end-date", default='2023-12-31', help="End of the climate date range")
+    parser.add_argument("--project", default='morocco-ai-2024', help="Earth Engine project name")
+    args = parser.parse_args()
+
+    os.makedirs('log', exist_ok=True)
+    logging.basicConfig(filename='log/raster_store.log', level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    initialize_earth_engine(args.project)
+    feature_image = WellNetworkPredictor.build_feature_image(args.start_date, args.end_date)
+    export_feature_rasters(feature_image, FEATURE_BANDS, args.bbox, args.output, args.start_date, args.end_date, args.scale)
+    print(f"Feature rasters exported to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
+
+# # export the shifted Souss-Massa region
+# python raster_store.py --bbox -90.5 31.5 -88.5 33.5
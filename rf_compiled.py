@@ -0,0 +1,174 @@
+import argparse
+import os
+import pickle
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+class CompiledForest:
+    """
+    Random forest regressor flattened into node arrays and evaluated with vectorized NumPy.
+
+    The nodes of every tree are concatenated into shared arrays, so all trees are walked together
+    for a whole batch of rows with a handful of NumPy calls per tree level. Predictions match the sklearn
+    forest exactly: rows are compared as float32 like sklearn's trees do, missing (NaN) values follow
+    each split's `missing_go_to_left` like in sklearn >= 1.3, and the per-tree values are accumulated
+    in estimator order before dividing by the number of trees.
+
+    Attributes:
+        feature_names: Names of the features, in the column order `predict` expects.
+        missing_left: Whether a NaN goes to the left child at each node, or None for forests from
+            sklearn versions that cannot predict NaN inputs.
+    """
+
+    def __init__(self, feature, threshold, left, right, value, roots, feature_names, missing_left=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.feature_names = [str(name) for name in feature_names]
+        self.missing_left = missing_left
+        self.is_leaf = left == np.arange(len(left))
+
+    @classmethod
+    def from_sklearn(cls, rf_model, feature_names=None):
+        if getattr(rf_model, 'n_outputs_', 1) != 1:
+            raise ValueError("Only single-output random forests can be compiled")
+        if feature_names is None:
+            feature_names = rf_model.feature_names_in_
+
+        features, thresholds, lefts, rights, values, roots, missing_lefts = [], [], [], [], [], [], []
+        offset = 0
+        for estimator in rf_model.estimators_:
+            tree = estimator.tree_
+            node_ids = np.arange(tree.node_count) + offset
+            leaf = tree.children_left == -1
+            features.append(np.where(leaf, 0, tree.feature))
+            thresholds.append(np.where(leaf, np.inf, tree.threshold))
+            lefts.append(np.where(leaf, node_ids, tree.children_left + offset))
+            rights.append(np.where(leaf, node_ids, tree.children_right + offset))
+            values.append(tree.value[:, 0, 0])
+            if hasattr(tree, 'missing_go_to_left'):
+                missing_lefts.append(np.asarray(tree.missing_go_to_left, dtype=bool))
+            roots.append(offset)
+            offset += tree.node_count
+
+        return cls(
+            feature=np.concatenate(features).astype(np.intp),
+            threshold=np.concatenate(thresholds).astype(np.float64),
+            left=np.concatenate(lefts).astype(np.intp),
+            right=np.concatenate(rights).astype(np.intp),
+            value=np.concatenate(values).astype(np.float64),
+            roots=np.asarray(roots, dtype=np.intp),
+            feature_names=feature_names,
+            missing_left=np.concatenate(missing_lefts) if len(missing_lefts) == len(roots) else None,
+        )
+
+    @classmethod
+    def load(cls, filepath):
+        with np.load(filepath) as arrays:
+            return cls(
+                feature=arrays['feature'].astype(np.intp),
+                threshold=arrays['threshold'],
+                left=arrays['left'].astype(np.intp),
+                right=arrays['right'].astype(np.intp),
+                value=arrays['value'],
+                roots=arrays['roots'].astype(np.intp),
+                feature_names=arrays['feature_names'].tolist(),
+                missing_left=arrays['missing_left'] if 'missing_left' in arrays else None,
+            )
+
+    def save(self, filepath):
+        # Unique per writer, so processes compiling the same forest at once do not write into each other's file
+        tmp_filepath = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez(
+            tmp_filepath,
+            feature=self.feature,
+            threshold=self.threshold,
+            left=self.left,
+            right=self.right,
+            value=self.value,
+            roots=self.roots,
+            feature_names=np.asarray(self.feature_names),
+            **({'missing_left': self.missing_left} if self.missing_left is not None else {}),
+        )
+        os.replace(tmp_filepath, filepath)
+
+    def predict(self, X):
+        if hasattr(X, 'columns'):
+            X = X[self.feature_names].to_numpy()
+        # sklearn trees compare float32 inputs against float64 thresholds
+        X = np.asarray(X, dtype=np.float32).reshape(-1, len(self.feature_names)).astype(np.float64)
+        has_missing = np.isnan(X).any()
+        if has_missing and self.missing_left is None:
+            raise ValueError("Input contains NaN")
+
+        # Walk every (tree, row) pair together, dropping pairs from the active set once they hit a leaf
+        n_rows = len(X)
+        nodes = np.repeat(self.roots, n_rows)
+        rows = np.tile(np.arange(n_rows), len(self.roots))
+        active = np.flatnonzero(~self.is_leaf[nodes])
+        while len(active):
+            current = nodes[active]
+            values = X[rows[active], self.feature[current]]
+            go_left = values <= self.threshold[current]
+            if has_missing:
+                go_left = np.where(np.isnan(values), self.missing_left[current], go_left)
+            current = np.where(go_left, self.left[current], self.right[current])
+            nodes[active] = current
+            active = active[~self.is_leaf[current]]
+
+        tree_values = self.value[nodes].reshape(len(self.roots), n_rows)
+        predictions = np.zeros(n_rows, dtype=np.float64)
+        for values in tree_values:
+            predictions += values
+        predictions /= len(self.roots)
+        return predictions
+
+
+def compile_rf_model(rf_model, feature_names=None, n_check_rows=1000):
+    """
+    Compile `rf_model` and check it against sklearn on random rows spanning the split thresholds.
+    """
+    compiled = CompiledForest.from_sklearn(rf_model, feature_names)
+    rng = np.random.default_rng(0)
+    low = np.full(len(compiled.feature_names), np.inf)
+    high = np.full(len(compiled.feature_names), -np.inf)
+    split = ~compiled.is_leaf
+    np.minimum.at(low, compiled.feature[split], compiled.threshold[split])
+    np.maximum.at(high, compiled.feature[split], compiled.threshold[split])
+    low[~np.isfinite(low)] = 0
+    high[~np.isfinite(high)] = 1
+    X = rng.uniform(low - 1, high + 1, size=(n_check_rows, len(low)))
+    if compiled.missing_left is not None:
+        # Masked Earth Engine and raster values reach the model as NaN
+        X[rng.random(X.shape) < 0.05] = np.nan
+
+    expected = rf_model.predict(pd.DataFrame(X, columns=compiled.feature_names))
+    if not np.array_equal(compiled.predict(X), expected):
+        raise ValueError("Compiled forest predictions differ from the sklearn model")
+    return compiled
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile the random forest depth model to flat node arrays')
+    parser.add_argument("model", help="Path to the pickled sklearn random forest")
+    parser.add_argument("output", nargs='?', help="Path of the compiled .npz (defaults to the model path with .npz)")
+    args = parser.parse_args()
+
+    with open(args.model, 'rb') as f:
+        rf_model = pickle.load(f)
+    output = args.output or os.path.splitext(args.model)[0] + '.npz'
+    compiled = compile_rf_model(rf_model)
+    compiled.save(output)
+    print(f"Wrote {len(compiled.roots)} trees ({len(compiled.value)} nodes) to {output}")
+
+
+if __name__ == '__main__':
+    main()
+
+# python rf_compiled.py bins/rf_depth_to_water.pkl bins/rf_depth_to_water.npz
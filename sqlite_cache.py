@@ -0,0 +1,57 @@
+import os
+import sqlite3
+import threading
+
+# Keys per SELECT, below the 999 parameters older SQLite builds allow per statement
+MAX_QUERY_PARAMETERS = 500
+
+
+class SQLiteCache:
+    """
+    Base of the caches backed by a SQLite file, shared by every thread and process using the same file.
+
+    Opens the file, creating its directory, and creates the tables of the subclass in `_create_tables`.
+    Without a file the tables are kept in an in-memory database, lost when the cache is closed.
+    The connection is used from any thread, serialized by `_lock`. Subclasses count their lookups in
+    `hits` and `misses`, and `stats` reports the rows of `table` as the entries of the cache.
+
+    Attributes:
+        filepath: Path to the SQLite file, or None for an in-memory database.
+        hits: Number of lookups answered from the cache.
+        misses: Number of lookups that were missing or expired.
+    """
+
+    table = None
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if filepath:
+            directory = os.path.dirname(filepath)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(filepath or ':memory:', timeout=30, check_same_thread=False)
+        with self._conn:
+            self._create_tables()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _create_tables(self):
+        raise NotImplementedError
+
+    def _count_entries(self):
+        return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": self._count_entries(),
+            }
@@ -0,0 +1,24 @@
+import json
+import os
+import sys
+
+import pytest
+
+# The modules live at the repository root, as the benchmarks import them
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='session')
+def rag(tmp_path_factory):
+    # rag reads its API keys and opens its log relative to the working directory when imported
+    directory = tmp_path_factory.mktemp('rag')
+    (directory / 'apis_keys.json').write_text(json.dumps({"pinecone": {"api_key": "stub"}, "huggingface": {"api_key": "stub"}}))
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        import rag
+    finally:
+        os.chdir(cwd)
+    return rag
@@ -0,0 +1,111 @@
+"""
+Local stand-in for the part of the Earth Engine API the predictor uses, installed in place of `ee`.
+
+Images carry the names of their bands and the dataset each one comes from, and reducing them returns
+a deterministic value per band and location instead of calling Earth Engine. Every `getInfo` is
+recorded in `fetched`, so tests can count the round-trips a prediction makes.
+"""
+import json
+import zlib
+
+# Serialized computation of each getInfo call, in call order
+fetched = []
+
+
+def reset():
+    fetched.clear()
+
+
+def band_value(source, coords):
+    return zlib.crc32(json.dumps([source, list(coords)]).encode()) % 1000 / 10
+
+
+class ComputedObject:
+    def __init__(self, computation, result):
+        self.computation = computation
+        self.result = result
+
+    def serialize(self):
+        return json.dumps(self.computation, sort_keys=True)
+
+    def getInfo(self):
+        fetched.append(self.serialize())
+        return self.result()
+
+
+class Image:
+    def __init__(self, image_id=None, bands=None):
+        self.image_id = image_id
+        self.bands = bands or {}
+
+    def select(self, selectors, names=None):
+        return Image(bands={name: f"{self.image_id}:{band}" for band, name in zip(selectors, names or selectors)})
+
+    def reproject(self, crs=None, scale=None):
+        return self
+
+    @staticmethod
+    def cat(images):
+        bands = {}
+        for image in images:
+            bands.update(image.bands)
+        return Image(bands=bands)
+
+    def reduceRegion(self, reducer, geometry, scale):
+        return ComputedObject(
+            {"reduceRegion": self.bands, "geometry": geometry.coords, "scale": scale},
+            lambda: {name: band_value(source, geometry.coords) for name, source in self.bands.items()},
+        )
+
+    def reduceRegions(self, collection, reducer, scale):
+        def result():
+            return {"features": [
+                {"properties": dict({name: band_value(source, feature.geometry.coords) for name, source in self.bands.items()}, **feature.properties)}
+                for feature in collection.features
+            ]}
+        return ComputedObject(
+            {"reduceRegions": self.bands, "geometries": [feature.geometry.coords for feature in collection.features], "scale": scale},
+            result,
+        )
+
+
+class ImageCollection:
+    def __init__(self, collection_id):
+        self.collection_id = collection_id
+        self.bands = {}
+
+    def filterDate(self, start_date, end_date):
+        return self
+
+    def select(self, selectors, names=None):
+        self.bands = {name: f"{self.collection_id}:{band}" for band, name in zip(selectors, names or selectors)}
+        return self
+
+    def mean(self):
+        return Image(bands=dict(self.bands))
+
+
+class Point:
+    def __init__(self, coords):
+        self.coords = list(coords)
+
+
+class Geometry:
+    Point = Point
+
+
+class Feature:
+    def __init__(self, geometry, properties):
+        self.geometry = geometry
+        self.properties = properties
+
+
+class FeatureCollection:
+    def __init__(self, features):
+        self.features = features
+
+
+class Reducer:
+    @staticmethod
+    def mean():
+        return 'mean'
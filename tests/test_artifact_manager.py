@@ -0,0 +1,198 @@
+import hashlib
+import http.server
+import io
+import json
+import os
+import threading
+import zipfile
+
+import pytest
+
+import artifact_manager
+from artifact_manager import ArtifactManager
+
+MEMBERS = {
+    "model_and_network/rf_depth_to_water.pkl": os.urandom(300 * 1024),
+    "model_and_network/well_network.gpickle": os.urandom(100 * 1024),
+}
+HASHES = {os.path.basename(name): hashlib.sha256(data).hexdigest() for name, data in MEMBERS.items()}
+
+
+def make_archive():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+        for name, data in MEMBERS.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+class ArtifactServer(http.server.ThreadingHTTPServer):
+    """
+    Serves the archive, honouring Range requests unless `ignore_range`, and cuts the first `drops` responses short.
+    """
+
+    def __init__(self, payload):
+        super().__init__(("127.0.0.1", 0), ArtifactHandler)
+        self.payload = payload
+        self.drops = 0
+        self.ignore_range = False
+        self.ranges = []
+        self.lock = threading.Lock()
+
+
+class ArtifactHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server, payload = self.server, self.server.payload
+        with server.lock:
+            server.ranges.append(self.headers.get("Range"))
+            drop = server.drops > 0
+            server.drops -= drop
+        start = 0
+        if "Range" in self.headers and not server.ignore_range:
+            start = int(self.headers["Range"].split("=")[1].split("-")[0])
+            if start >= len(payload):
+                self.send_response(416)
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(payload) - 1}/{len(payload)}")
+        else:
+            self.send_response(200)
+        body = payload[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if drop:
+            # Part of the body, then the connection is dropped
+            self.wfile.write(body[:len(body) // 3])
+            self.wfile.flush()
+            self.connection.close()
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    server = ArtifactServer(make_archive())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # Chunks smaller than the part of the archive sent before a drop, so that part reaches the disk
+    monkeypatch.setattr(artifact_manager, 'CHUNK_SIZE', 16 * 1024)
+
+
+@pytest.fixture
+def directory(tmp_path, server):
+    manifest = {
+        "archive": {"url": f"http://127.0.0.1:{server.server_port}/model_and_network.zip",
+                    "filename": "model_and_network.zip", "sha256": hashlib.sha256(server.payload).hexdigest()},
+        "files": {name: {"sha256": digest} for name, digest in HASHES.items()},
+    }
+    (tmp_path / "artifacts.json").write_text(json.dumps(manifest))
+    return str(tmp_path)
+
+
+def sha256_of(filepath):
+    with open(filepath, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def test_interrupted_download_resumes_with_range_requests(server, directory):
+    server.drops = 2
+    filepath = os.path.join(directory, "rf_depth_to_water.pkl")
+
+    assert ArtifactManager(directory, base_delay_s=0).ensure(filepath)
+    assert sha256_of(filepath) == HASHES["rf_depth_to_water.pkl"]
+    assert len(server.ranges) == 3
+    assert server.ranges[0] is None
+    offsets = [int(header.split("=")[1].split("-")[0]) for header in server.ranges[1:]]
+    # Each attempt resumes after the bytes the previous ones wrote
+    assert 0 < offsets[0] < offsets[1] < len(server.payload)
+    assert not os.path.exists(os.path.join(directory, "model_and_network.zip.part"))
+
+
+def test_download_restarts_when_range_is_ignored(server, directory):
+    server.drops = 1
+    server.ignore_range = True
+    filepath = os.path.join(directory, "rf_depth_to_water.pkl")
+
+    assert ArtifactManager(directory, base_delay_s=0).ensure(filepath)
+    assert sha256_of(filepath) == HASHES["rf_depth_to_water.pkl"]
+
+
+def test_only_the_requested_member_is_extracted(server, directory):
+    assert ArtifactManager(directory).ensure(os.path.join(directory, "rf_depth_to_water.pkl"))
+
+    assert not os.path.exists(os.path.join(directory, "well_network.gpickle"))
+
+
+def test_concurrent_loaders_download_once(server, directory):
+    filepath = os.path.join(directory, "rf_depth_to_water.pkl")
+    managers = [ArtifactManager(directory) for _ in range(4)]
+    threads = [threading.Thread(target=manager.ensure, args=(filepath,)) for manager in managers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(server.ranges) == 1
+    assert sha256_of(filepath) == HASHES["rf_depth_to_water.pkl"]
+
+
+def test_matching_artifacts_are_not_fetched_again(server, directory):
+    manager = ArtifactManager(directory)
+    for name in HASHES:
+        assert manager.ensure(os.path.join(directory, name))
+    requests_before = len(server.ranges)
+
+    for name in HASHES:
+        assert ArtifactManager(directory).ensure(os.path.join(directory, name))
+    assert len(server.ranges) == requests_before == 1
+
+
+def test_corrupted_artifact_is_refused_or_restored(server, directory):
+    filepath = os.path.join(directory, "rf_depth_to_water.pkl")
+    assert ArtifactManager(directory).ensure(filepath)
+    with open(filepath, 'r+b') as f:
+        f.write(b'corrupted')
+
+    assert not ArtifactManager(directory).ensure(filepath, repair=False)
+    assert ArtifactManager(directory).ensure(filepath)
+    assert sha256_of(filepath) == HASHES["rf_depth_to_water.pkl"]
+
+
+def test_published_artifact_is_kept(server, directory):
+    filepath = os.path.join(directory, "rf_depth_to_water.pkl")
+    assert ArtifactManager(directory).ensure(filepath)
+    published_filepath = os.path.join(directory, "new_model.pkl")
+    with open(published_filepath, 'wb') as f:
+        f.write(b'published model')
+
+    ArtifactManager(directory).publish(published_filepath, "rf_depth_to_water.pkl")
+
+    assert ArtifactManager(directory).ensure(filepath)
+    with open(filepath, 'rb') as f:
+        assert f.read() == b'published model'
+    with open(os.path.join(directory, "artifacts.json")) as f:
+        assert json.load(f)["files"]["rf_depth_to_water.pkl"]["sha256"] == hashlib.sha256(b'published model').hexdigest()
+
+
+def test_archive_with_wrong_hash_is_rejected(server, directory):
+    manifest_filepath = os.path.join(directory, "artifacts.json")
+    with open(manifest_filepath) as f:
+        manifest = json.load(f)
+    manifest["archive"]["sha256"] = "0" * 64
+    with open(manifest_filepath, 'w') as f:
+        json.dump(manifest, f)
+
+    with pytest.raises(ValueError, match="sha256"):
+        ArtifactManager(directory).ensure(os.path.join(directory, "rf_depth_to_water.pkl"))
+    assert not os.path.exists(os.path.join(directory, "model_and_network.zip.part"))
@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+
+import ee_fetcher
+from ee_fetcher import EEFetcher, is_transient_error
+
+
+@pytest.fixture
+def fetcher():
+    fetcher = EEFetcher(max_workers=4, rate_per_second=1000, max_retries=3, base_delay_s=0)
+    yield fetcher
+    fetcher.shutdown()
+
+
+class FlakyRequest:
+    """
+    Request failing with each of `errors` in turn before returning `result`.
+    """
+
+    def __init__(self, errors, result='ok'):
+        self.errors = list(errors)
+        self.result = result
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.result
+
+
+@pytest.mark.parametrize("error", [
+    RuntimeError("Too many concurrent aggregations."),
+    RuntimeError("Earth Engine capacity exceeded."),
+    RuntimeError('<HttpError 503 when requesting https://earthengine.googleapis.com returned "Service Unavailable">'),
+    RuntimeError("HTTPSConnectionPool(host='earthengine.googleapis.com', port=443): Read timed out. (read timeout=60)"),
+    RuntimeError("('Connection aborted.', RemoteDisconnected('Remote end closed connection without response'))"),
+    RuntimeError("Deadline exceeded."),
+    TimeoutError(),
+    ConnectionResetError(),
+])
+def test_transient_errors_are_retried(error):
+    assert is_transient_error(error)
+
+
+@pytest.mark.parametrize("error", [
+    RuntimeError("Computation timed out."),
+    RuntimeError("User memory limit exceeded."),
+    RuntimeError("Image.load: Image asset 'users/x/missing' not found."),
+    ValueError("Invalid geometry for location (31.0, -8.0)"),
+])
+def test_permanent_errors_are_not_retried(error):
+    assert not is_transient_error(error)
+
+
+def test_transient_failures_are_retried_until_success(fetcher):
+    request = FlakyRequest([RuntimeError("Too many concurrent aggregations."), RuntimeError("Deadline exceeded.")])
+
+    assert fetcher.fetch('key', request) == 'ok'
+    assert request.calls == 3
+    assert fetcher.stats()["retries"] == 2
+
+
+def test_permanent_failure_is_raised_at_once(fetcher):
+    request = FlakyRequest([RuntimeError("Computation timed out.")])
+
+    with pytest.raises(RuntimeError, match="Computation timed out"):
+        fetcher.fetch('key', request)
+    assert request.calls == 1
+    assert fetcher.stats()["failures"] == 1
+
+
+def test_retries_give_up_after_max_retries(fetcher):
+    request = FlakyRequest([RuntimeError("Service unavailable")] * 10)
+
+    with pytest.raises(RuntimeError):
+        fetcher.fetch('key', request)
+    assert request.calls == fetcher.max_retries + 1
+
+
+def test_no_retry_past_the_caller_timeout(monkeypatch):
+    fetcher = EEFetcher(rate_per_second=1000, max_retries=5, base_delay_s=10, max_delay_s=10)
+    # The longest backoff, which would outlast the caller
+    monkeypatch.setattr(ee_fetcher.random, 'uniform', lambda low, high: high)
+    request = FlakyRequest([RuntimeError("Service unavailable")] * 10)
+
+    start = time.monotonic()
+    with pytest.raises(RuntimeError):
+        fetcher.fetch('key', request, timeout=1)
+    assert time.monotonic() - start < 1
+    assert request.calls == 1
+    fetcher.shutdown()
+
+
+def test_in_flight_requests_are_deduplicated(fetcher):
+    release = threading.Event()
+    calls = []
+
+    def request():
+        calls.append(1)
+        release.wait(5)
+        return 'ok'
+
+    first = fetcher.submit('key', request)
+    second = fetcher.submit('key', request)
+    other = fetcher.submit('other key', request)
+    release.set()
+
+    assert second is first
+    assert [first.result(), second.result(), other.result()] == ['ok'] * 3
+    assert len(calls) == 2
+    assert fetcher.stats()["deduplicated"] == 1
+
+
+def test_completed_requests_are_sent_again(fetcher):
+    request = FlakyRequest([])
+
+    fetcher.fetch('key', request)
+    # The request is forgotten by a callback run just after its result is set
+    deadline = time.monotonic() + 5
+    while fetcher.stats()["in_flight"] and time.monotonic() < deadline:
+        time.sleep(0.001)
+    fetcher.fetch('key', request)
+    assert request.calls == 2
+
+
+def test_fetch_many_isolates_failures(fetcher):
+    results = fetcher.fetch_many([('a', FlakyRequest([], 1)), ('b', FlakyRequest([ValueError("Invalid geometry")])), ('c', FlakyRequest([], 3))])
+
+    assert results[0] == 1 and results[2] == 3
+    assert isinstance(results[1], ValueError)
@@ -0,0 +1,65 @@
+import pytest
+
+import fake_ee
+import predictor
+from ee_fetcher import EEFetcher
+from feature_cache import FeatureCache
+from predictor import CLIMATE_BANDS, SOIL_BANDS, SOIL_IMAGES, WellNetworkPredictor
+
+
+@pytest.fixture
+def make_predictor(tmp_path, monkeypatch):
+    monkeypatch.setattr(predictor, 'ee', fake_ee)
+    fake_ee.reset()
+    predictors = []
+
+    def make(name='feature_cache.db'):
+        # Only what fetching soil and climate data needs, without loading a model or well network
+        well_predictor = WellNetworkPredictor.__new__(WellNetworkPredictor)
+        well_predictor.raster_store = None
+        well_predictor.feature_cache = FeatureCache(str(tmp_path / name))
+        well_predictor.ee_fetcher = EEFetcher()
+        predictors.append(well_predictor)
+        return well_predictor
+
+    yield make
+    for well_predictor in predictors:
+        well_predictor.ee_fetcher.shutdown()
+
+
+def test_one_request_per_location(make_predictor):
+    data = make_predictor().get_soil_climate_data((31.5, -7.9))
+
+    assert len(fake_ee.fetched) == 1
+    assert set(data) == {f"soil_{soil_type}" for soil_type in SOIL_IMAGES} | {"climate_conditions"}
+    assert all(set(data[f"soil_{soil_type}"]) == set(SOIL_BANDS) for soil_type in SOIL_IMAGES)
+    assert set(data["climate_conditions"]) == set(CLIMATE_BANDS)
+    assert all(value is not None for group in data.values() for value in group.values())
+
+
+def test_cached_location_is_not_fetched_again(make_predictor):
+    well_predictor = make_predictor()
+    first = well_predictor.get_soil_climate_data((31.5, -7.9))
+    second = well_predictor.get_soil_climate_data((31.5, -7.9))
+
+    assert len(fake_ee.fetched) == 1
+    assert second == first
+
+
+def test_one_request_per_batch(make_predictor):
+    locations = [(31.0 + i / 10, -8.0 + i / 10) for i in range(25)]
+    batch = make_predictor().get_soil_climate_data_many(locations)
+
+    assert len(fake_ee.fetched) == 1
+    # Each location gets the same statistics as when it is fetched on its own
+    single = make_predictor('single.db')
+    assert batch == [single.get_soil_climate_data(location) for location in locations]
+
+
+def test_batch_is_chunked(make_predictor):
+    well_predictor = make_predictor()
+    points = [fake_ee.Point([-8.0 + i / 10, 31.0]) for i in range(25)]
+    stats = well_predictor.fetch_feature_stats_many(WellNetworkPredictor.build_feature_image('2023-01-01', '2023-12-31'), points, chunk_size=10)
+
+    assert len(fake_ee.fetched) == 3
+    assert len(stats) == 25 and all(stats)
@@ -0,0 +1,135 @@
+import http.server
+import json
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from embedding_cache import EmbeddingCache
+
+
+def stub_embedding(text):
+    # Distinct per text and not normalized, so tests can tell which text an embedding belongs to
+    return [float(len(text)), float(sum(map(ord, text)) % 97), 1.0, 2.0]
+
+
+class EmbeddingServer(http.server.ThreadingHTTPServer):
+    """
+    Feature-extraction stub answering a list input with one embedding per text. Batches holding a text
+    of `failing` get a 400, and every response waits `latency_s`.
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), EmbeddingHandler)
+        self.failing = set()
+        self.latency_s = 0
+        self.batches = []
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.lock = threading.Lock()
+
+
+class EmbeddingHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        inputs = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["inputs"]
+        with server.lock:
+            server.batches.append(inputs)
+            server.in_flight += 1
+            server.peak_in_flight = max(server.peak_in_flight, server.in_flight)
+        time.sleep(server.latency_s)
+        with server.lock:
+            server.in_flight -= 1
+        if server.failing.intersection(inputs):
+            self.send_response(400)
+            body = b'{"error": "bad input"}'
+        else:
+            self.send_response(200)
+            body = json.dumps([stub_embedding(text) for text in inputs]).encode()
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    server = EmbeddingServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def embedding(rag, server):
+    return rag.HuggingFaceEmbedding(api_url=f"http://127.0.0.1:{server.server_port}/pipeline/feature-extraction/stub", max_workers=3)
+
+
+def expected(text):
+    vector = np.asarray(stub_embedding(text))
+    return vector / np.linalg.norm(vector)
+
+
+def test_texts_are_sent_in_batches(embedding, server):
+    texts = [f"article {i}" for i in range(10)]
+    embeddings = embedding.generate_embeddings(texts, batch_size=4)
+
+    assert sorted(len(batch) for batch in server.batches) == [2, 4, 4]
+    for text, vector in zip(texts, embeddings):
+        np.testing.assert_allclose(vector, expected(text))
+
+
+def test_failed_batch_does_not_fail_the_others(embedding, server):
+    texts = [f"article {i}" for i in range(10)]
+    server.failing = {"article 5"}
+    embeddings = embedding.generate_embeddings(texts, batch_size=4)
+
+    # Only the texts of the batch holding article 5 are missing
+    assert [vector is None for vector in embeddings] == [False] * 4 + [True] * 4 + [False] * 2
+    for text, vector in zip(texts, embeddings):
+        if vector is not None:
+            np.testing.assert_allclose(vector, expected(text))
+
+
+def test_batches_are_sent_concurrently_up_to_max_workers(embedding, server):
+    server.latency_s = 0.05
+    embedding.generate_embeddings([f"article {i}" for i in range(40)], batch_size=4)
+
+    assert 1 < server.peak_in_flight <= embedding.max_workers
+
+
+def test_only_failed_texts_are_sent_again(rag, server, tmp_path):
+    embedding = rag.HuggingFaceEmbedding(api_url=f"http://127.0.0.1:{server.server_port}/pipeline/feature-extraction/stub",
+                                         cache=EmbeddingCache(str(tmp_path / 'embedding_cache.db')))
+    texts = [f"article {i}" for i in range(10)]
+    server.failing = {"article 5"}
+    embedding.generate_embeddings(texts, batch_size=4)
+    server.failing = set()
+    server.batches.clear()
+
+    embeddings = embedding.generate_embeddings(texts, batch_size=4)
+
+    assert sorted(text for batch in server.batches for text in batch) == sorted(f"article {i}" for i in range(4, 8))
+    assert all(vector is not None for vector in embeddings)
+
+
+def test_embedding_count_mismatch_fails_the_batch(embedding, server, monkeypatch):
+    monkeypatch.setattr(EmbeddingHandler, 'do_POST', short_response)
+    assert embedding.generate_embeddings(["a", "b"], batch_size=2) == [None, None]
+
+
+def short_response(handler):
+    handler.rfile.read(int(handler.headers["Content-Length"]))
+    body = json.dumps([stub_embedding("a")]).encode()
+    handler.send_response(200)
+    handler.send_header("Content-Type", "application/json")
+    handler.send_header("Content-Length", str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
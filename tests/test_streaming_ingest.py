@@ -0,0 +1,137 @@
+import threading
+
+import pytest
+
+from embedding_cache import EmbeddingCache
+
+
+class Interrupted(BaseException):
+    # Not an Exception, so it aborts the sync like a killed process instead of failing one batch
+    pass
+
+
+class MemoryIndex:
+    """
+    In-memory stand-in for the Pinecone index, failing the upserts after the first `fail_after` with `failure`.
+    """
+
+    def __init__(self, name='memory'):
+        self.name = name
+        self.vectors = {}
+        self.upserts = []
+        self.fail_after = None
+        self.failure = None
+        self.lock = threading.Lock()
+
+    def upsert(self, vectors):
+        with self.lock:
+            if self.fail_after is not None and len(self.upserts) >= self.fail_after:
+                raise self.failure
+            self.upserts.append(len(vectors))
+            for vector_id, values, metadata in vectors:
+                self.vectors[vector_id] = (values, metadata)
+
+    def delete(self, ids):
+        with self.lock:
+            for vector_id in ids:
+                self.vectors.pop(vector_id, None)
+
+    def list(self, prefix=None):
+        yield [vector_id for vector_id in self.vectors if prefix is None or vector_id.startswith(prefix)]
+
+
+class FakeEmbedding:
+    model_name = 'fake'
+
+    def __init__(self):
+        self.embedded = 0
+
+    def generate_embeddings(self, texts, batch_size=32):
+        self.embedded += len(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+@pytest.fixture
+def open_store(rag, tmp_path):
+    def open_store(index):
+        # ArabicRAG without connecting to Pinecone or the embedding endpoint
+        store = rag.ArabicRAG.__new__(rag.ArabicRAG)
+        store.index_name = 'water-laws'
+        store.index = index
+        store.embedding_cache = EmbeddingCache(str(tmp_path / 'embedding_cache.db'))
+        store.embedding_model = FakeEmbedding()
+        return store
+    return open_store
+
+
+DOCUMENTS = {f"article_{i}": f"text of article {i}" for i in range(50)}
+
+
+def test_upserts_are_sent_in_fixed_size_batches(open_store):
+    index = MemoryIndex()
+    summary = open_store(index).sync_documents(DOCUMENTS, upsert_batch_size=8)
+
+    assert summary == {"upserted": 50, "deleted": 0, "unchanged": 0, "failed": 0}
+    assert sorted(index.upserts) == [2] + [8] * 6
+    assert len(index.vectors) == 50
+
+
+def test_interrupted_sync_resumes_where_it_stopped(open_store):
+    index = MemoryIndex()
+    index.fail_after = 3
+    index.failure = Interrupted()
+    with pytest.raises(Interrupted):
+        open_store(index).sync_documents(DOCUMENTS, upsert_batch_size=10, max_upserts_in_flight=1)
+    assert len(index.vectors) == 30
+
+    index.fail_after = None
+    store = open_store(index)
+    summary = store.sync_documents(DOCUMENTS, upsert_batch_size=10, max_upserts_in_flight=1)
+
+    assert summary == {"upserted": 20, "deleted": 0, "unchanged": 30, "failed": 0}
+    assert store.embedding_model.embedded == 20
+    assert len(index.vectors) == 50
+
+
+def test_failed_batches_are_upserted_on_the_next_sync(open_store):
+    index = MemoryIndex()
+    index.fail_after = 2
+    index.failure = RuntimeError("request too large")
+    summary = open_store(index).sync_documents(DOCUMENTS, upsert_batch_size=10, max_upserts_in_flight=1)
+    assert summary["upserted"] == 20 and summary["failed"] == 30
+
+    index.fail_after = None
+    summary = open_store(index).sync_documents(DOCUMENTS, upsert_batch_size=10, max_upserts_in_flight=1)
+
+    assert summary == {"upserted": 30, "deleted": 0, "unchanged": 20, "failed": 0}
+    assert len(index.vectors) == 50
+
+
+def test_changed_documents_replace_their_vectors(open_store):
+    index = MemoryIndex()
+    open_store(index).sync_documents(DOCUMENTS)
+    documents = dict(DOCUMENTS, article_0="amended text of article 0")
+    del documents["article_1"]
+
+    summary = open_store(index).sync_documents(documents)
+
+    assert summary == {"upserted": 1, "deleted": 2, "unchanged": 48, "failed": 0}
+    assert sorted(metadata["name"] for _, metadata in index.vectors.values()) == sorted(documents)
+
+
+def test_legacy_vectors_are_deleted_once_every_document_is_upserted(open_store):
+    index = MemoryIndex()
+    index.vectors.update({f"doc_{i}": ([1.0, 0.0], {"text": "old"}) for i in range(5)})
+    index.fail_after = 2
+    index.failure = Interrupted()
+    with pytest.raises(Interrupted):
+        open_store(index).sync_documents(DOCUMENTS, upsert_batch_size=10, max_upserts_in_flight=1)
+    # The legacy vectors keep serving while the new ones are incomplete
+    assert all(f"doc_{i}" in index.vectors for i in range(5))
+
+    index.fail_after = None
+    summary = open_store(index).sync_documents(DOCUMENTS, upsert_batch_size=10, max_upserts_in_flight=1)
+
+    assert summary["deleted"] == 5
+    assert not any(vector_id.startswith("doc_") for vector_id in index.vectors)
+    assert len(index.vectors) == 50
@@ -0,0 +1,197 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ThreadPoolExecutor, TimeoutError
+
+from predictor import shift_coordinates
+from timing import TIMINGS, format_trace
+
+
+class TieredPredictor:
+    """
+    Two-tier prediction on top of a WellNetworkPredictor.
+
+    `submit` answers right away with the well-network estimate of `WellNetworkPredictor.estimate_depth`.
+    When that estimate is not final (no well within the threshold), the Random Forest prediction,
+    which needs Earth Engine and takes seconds, is scheduled on a thread pool as a job that callers
+    can poll with `get`, block on with `wait` or subscribe to with `subscribe`.
+
+    `speculate` submits a job for a location the user has only picked so far, cancelling the
+    speculative job of the location picked before, so the prediction is under way (and its Earth
+    Engine features cached) by the time it is asked for.
+
+    Attributes:
+        predictor: The WellNetworkPredictor (or ReloadingPredictor) used for both tiers, shared by the worker threads.
+        max_jobs: Number of most recent jobs kept for polling; older ones are forgotten.
+        speculative_job_id: Job of the last location passed to `speculate`, or None.
+    """
+
+    def __init__(self, predictor, max_workers=4, max_jobs=1000):
+        self.predictor = predictor
+        self.max_jobs = max_jobs
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='rf-refine')
+        self.jobs = OrderedDict()
+        self.futures = {}
+        self.speculative_job_id = None
+        self.lock = threading.Lock()
+
+    def submit(self, new_location_coords, threshold_km=5):
+        """
+        Estimate depth to water at `new_location_coords` and schedule its refinement if needed.
+
+        Returns:
+            dict: The job, as returned by `get`. Its `status` is "done" when the estimate is final
+                and "pending" while the Random Forest refinement runs.
+        """
+        lat, lon = float(new_location_coords[0]), float(new_location_coords[1])
+        predictor = self.predictor.snapshot()
+        estimate = predictor.estimate_depth((lat, lon), threshold_km) or {
+            "predicted_depth": None, "source": None, "final": False, "n_wells": 0, "nearest_well_km": None, "radius_km": None,
+            "artifact_version": predictor.artifact_version,
+        }
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "lat": lat,
+            "lon": lon,
+            "threshold_km": threshold_km,
+            "status": "done" if estimate["final"] else "pending",
+            "predicted_depth": estimate["predicted_depth"],
+            "source": estimate["source"],
+            "artifact_version": estimate["artifact_version"],
+            "estimate": estimate,
+            "submitted_at": time.time(),
+            "completed_at": time.time() if estimate["final"] else None,
+        }
+        with self.lock:
+            self.jobs[job["job_id"]] = job
+            while len(self.jobs) > self.max_jobs:
+                old_job_id, _ = self.jobs.popitem(last=False)
+                self.futures.pop(old_job_id, None)
+            if not estimate["final"]:
+                future = self.executor.submit(self._refine, job["job_id"], (lat, lon))
+                self.futures[job["job_id"]] = future
+        logging.info(f"Prediction job {job['job_id']} for ({lat}, {lon}): {estimate['source']} estimate {estimate['predicted_depth']}, status {job['status']}")
+        return dict(job)
+
+    def speculate(self, new_location_coords, threshold_km=5):
+        """
+        Submit a job for `new_location_coords` in place of the previous speculative job, which is cancelled.
+
+        Returns:
+            dict: The job, as returned by `get`; the previous one if it is for the same location and threshold.
+        """
+        lat, lon = float(new_location_coords[0]), float(new_location_coords[1])
+        with self.lock:
+            previous = self.jobs.get(self.speculative_job_id)
+        if previous is not None and (previous["lat"], previous["lon"], previous["threshold_km"]) == (lat, lon, threshold_km) \
+                and previous["status"] != "cancelled":
+            return dict(previous)
+        if previous is not None and self.cancel(previous["job_id"]):
+            logging.info(f"Cancelled speculative prediction job {previous['job_id']} superseded by ({lat}, {lon})")
+        job = self.submit((lat, lon), threshold_km)
+        with self.lock:
+            self.speculative_job_id = job["job_id"]
+        return job
+
+    def speculative_job(self, new_location_coords, threshold_km=5):
+        """
+        Speculative job of `new_location_coords`, or None if the last location passed to `speculate` differs.
+        """
+        lat, lon = float(new_location_coords[0]), float(new_location_coords[1])
+        job = self.get(self.speculative_job_id) if self.speculative_job_id is not None else None
+        if job is None or (job["lat"], job["lon"], job["threshold_km"]) != (lat, lon, threshold_km) or job["status"] == "cancelled":
+            return None
+        return job
+
+    def cancel(self, job_id):
+        """
+        Cancel the refinement of a pending job. A refinement already running still completes (an Earth Engine
+        request cannot be interrupted) and warms the feature cache and prediction memo, but the job keeps
+        its "cancelled" status.
+
+        Returns:
+            bool: Whether the job was pending.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] != "pending":
+                return False
+            job["status"] = "cancelled"
+            job["completed_at"] = time.time()
+            future = self.futures.get(job_id)
+        if future is not None:
+            future.cancel()
+        return True
+
+    def _refine(self, job_id, new_location_coords):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] == "cancelled":
+                return None
+        start = time.perf_counter()
+        predictor = self.predictor.snapshot()
+        shifted_coords = shift_coordinates(new_location_coords)
+        with TIMINGS.trace() as spans:
+            predicted_depth = predictor.predict_depth_with_rf_model(shifted_coords)
+        predictor.record_prediction(shifted_coords, predicted_depth, "random_forest")
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] == "cancelled":
+                return predicted_depth
+            if predicted_depth is not None:
+                job.update(status="done", predicted_depth=float(predicted_depth), source="random_forest",
+                           artifact_version=predictor.artifact_version)
+            else:
+                # The quick estimate stays the best available value
+                job["status"] = "failed"
+            job["completed_at"] = time.time()
+        logging.info(f"Prediction job {job_id} refined in {time.perf_counter() - start:.3f} s ({format_trace(spans)}): {predicted_depth}")
+        return predicted_depth
+
+    def get(self, job_id):
+        """
+        Current state of a job, or None if it is unknown or was forgotten.
+
+        The dict holds the `predicted_depth` and `source` of the best value so far ("neighbors", "memo",
+        "nearest_wells" or "random_forest"), the `status` ("pending", "done", "failed" or "cancelled") and the
+        quick `estimate` with its provenance and distance to the nearest well. `artifact_version` is the
+        version of the model and well network that produced the best value.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def wait(self, job_id, timeout=None):
+        """
+        Block until the refinement of a job completes or `timeout` seconds pass, then return the job.
+        """
+        with self.lock:
+            future = self.futures.get(job_id)
+        if future is not None:
+            try:
+                future.exception(timeout=timeout)
+            except (TimeoutError, CancelledError):
+                pass
+        return self.get(job_id)
+
+    def subscribe(self, job_id, callback):
+        """
+        Call `callback(job)` once the job completes, immediately if it already has.
+
+        Returns:
+            bool: False if the job is unknown.
+        """
+        with self.lock:
+            if job_id not in self.jobs:
+                return False
+            future = self.futures.get(job_id)
+        if future is None:
+            callback(self.get(job_id))
+        else:
+            future.add_done_callback(lambda _: callback(self.get(job_id)))
+        return True
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
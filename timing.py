@@ -0,0 +1,243 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    from pyinstrument import Profiler
+except ImportError:  # cProfile is used instead
+    Profiler = None
+
+# Upper bounds in seconds of the histogram buckets, from in-memory lookups up to Earth Engine requests
+DEFAULT_BUCKETS_S = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class StageHistogram:
+    """
+    Distribution of the durations of one stage, in fixed buckets.
+
+    Attributes:
+        buckets: Upper bounds of the buckets in seconds; durations above the last one are counted in an overflow bucket.
+        counts: Number of durations in each bucket, not cumulative.
+        count: Number of durations observed.
+        total_s: Sum of the durations observed.
+        errors: Number of spans that ended with an exception.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS_S):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total_s = 0.0
+        self.min_s = None
+        self.max_s = None
+        self.errors = 0
+
+    def observe(self, seconds, error=False):
+        index = next((i for i, bound in enumerate(self.buckets) if seconds <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.count += 1
+        self.total_s += seconds
+        self.min_s = seconds if self.min_s is None else min(self.min_s, seconds)
+        self.max_s = seconds if self.max_s is None else max(self.max_s, seconds)
+        self.errors += error
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the quantile, or the largest duration seen for the overflow bucket
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max_s)
+        return self.max_s
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "total_s": self.total_s,
+            "mean_s": self.total_s / self.count if self.count else None,
+            "min_s": self.min_s,
+            "max_s": self.max_s,
+            "p50_s": self.quantile(0.5),
+            "p90_s": self.quantile(0.9),
+            "p99_s": self.quantile(0.99),
+            "buckets": {str(bound): count for bound, count in zip(self.buckets, self.counts)} | {"+Inf": self.counts[-1]},
+        }
+
+
+class Timings:
+    """
+    Per-stage timing histograms of the prediction pipeline.
+
+    Code is timed with `span(stage)`, which records how long its block took into the histogram of
+    `stage`, whether the block returns or raises. Spans also go to the trace of the calling thread
+    when one is open with `trace()`, which gives the breakdown of a single prediction. The histograms
+    can be dumped as JSON with `to_dict` or `dump`, or scraped in the Prometheus text format with
+    `to_prometheus`.
+
+    Attributes:
+        histograms: StageHistogram of each stage seen so far.
+        started_at: Time the histograms were created or last reset.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS_S):
+        self.buckets = tuple(buckets)
+        self.histograms = {}
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def observe(self, stage, seconds, error=False, trace=None):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = StageHistogram(self.buckets)
+            histogram.observe(seconds, error)
+        trace = trace if trace is not None else self.current_trace()
+        if trace is not None:
+            trace.append((stage, seconds))
+
+    @contextmanager
+    def span(self, stage, trace=None):
+        """
+        Time the block into the histogram of `stage`.
+
+        Args:
+            stage (str): Name of the stage, e.g. "neighbor_search".
+            trace (list): Trace to add the span to instead of the one of the calling thread, for work
+                done on another thread on behalf of the caller.
+        """
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start, error, trace)
+
+    def current_trace(self):
+        traces = getattr(self._local, 'traces', None)
+        return traces[-1] if traces else None
+
+    @contextmanager
+    def trace(self):
+        """
+        Collect the (stage, seconds) of the spans of the calling thread into the yielded list.
+        """
+        traces = getattr(self._local, 'traces', None)
+        if traces is None:
+            traces = self._local.traces = []
+        spans = []
+        traces.append(spans)
+        try:
+            yield spans
+        finally:
+            traces.pop()
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.started_at = time.time()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "started_at": self.started_at,
+                "stages": {stage: histogram.to_dict() for stage, histogram in sorted(self.histograms.items())},
+            }
+
+    def dump(self, filepath):
+        directory = os.path.dirname(filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(filepath, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def to_prometheus(self, prefix='aabar'):
+        lines = [
+            f"# HELP {prefix}_stage_duration_seconds Time spent in each stage of the prediction pipeline.",
+            f"# TYPE {prefix}_stage_duration_seconds histogram",
+        ]
+        errors = [
+            f"# HELP {prefix}_stage_errors_total Spans of each stage that ended with an exception.",
+            f"# TYPE {prefix}_stage_errors_total counter",
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{prefix}_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{prefix}_stage_duration_seconds_sum{{stage="{stage}"}} {histogram.total_s}')
+                lines.append(f'{prefix}_stage_duration_seconds_count{{stage="{stage}"}} {histogram.count}')
+                errors.append(f'{prefix}_stage_errors_total{{stage="{stage}"}} {histogram.errors}')
+        return '\n'.join(lines + errors) + '\n'
+
+
+# Shared by every module of the pipeline, so a single dump covers all stages
+TIMINGS = Timings()
+
+
+def span(stage, trace=None):
+    return TIMINGS.span(stage, trace)
+
+
+def format_trace(spans):
+    return ', '.join(f"{stage} {seconds * 1000:.1f} ms" for stage, seconds in spans)
+
+
+@contextmanager
+def profiled(engine=None, output_filepath=None):
+    """
+    Profile the block with pyinstrument or cProfile and write the report to `output_filepath`.
+
+    Args:
+        engine (str): "pyinstrument" or "cProfile"; pyinstrument when it is installed if None.
+        output_filepath (str): Text file the report is written to; it is only logged if None.
+
+    Yields:
+        dict: Filled with the `engine` used and the `report` text once the block exits.
+    """
+    engine = engine or ("pyinstrument" if Profiler is not None else "cProfile")
+    if engine == "pyinstrument" and Profiler is None:
+        logging.warning("pyinstrument is not installed, profiling with cProfile")
+        engine = "cProfile"
+    result = {"engine": engine, "report": None}
+    if engine == "pyinstrument":
+        profiler = Profiler()
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield result
+    finally:
+        if engine == "pyinstrument":
+            profiler.stop()
+            result["report"] = profiler.output_text()
+        else:
+            profiler.disable()
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(40)
+            result["report"] = stream.getvalue()
+        if output_filepath:
+            directory = os.path.dirname(output_filepath)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(output_filepath, 'w') as f:
+                f.write(result["report"])
+            logging.info(f"{engine} profile written to {output_filepath}")
+        else:
+            logging.info(f"{engine} profile:\n{result['report']}")
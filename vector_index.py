@@ -0,0 +1,211 @@
+import contextlib
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+try:
+    import pinecone
+except ImportError:  # Only the local backend is available
+    pinecone = None
+
+try:
+    import fcntl
+except ImportError:  # Windows, where only threads of the same process are kept from writing at once
+    fcntl = None
+
+
+class PineconeIndex:
+    """
+    Hosted Pinecone index, created with the cosine metric if it does not exist yet.
+
+    Attributes:
+        name: Name of the index, also used to track which vectors it holds.
+        index: The Pinecone index client.
+    """
+
+    def __init__(self, index_name, dimension, api_key):
+        if pinecone is None:
+            raise ImportError("The pinecone package is required for the Pinecone backend, install it or use the local backend")
+        self.name = index_name
+        self.pc = pinecone.Pinecone(api_key=api_key)
+        try:
+            self.pc.create_index(
+                name=index_name,
+                dimension=dimension,
+                metric='cosine'
+            )
+            logging.info(f"Index {index_name} created successfully")
+        except Exception as e:
+            logging.warning(f"Index may already exist: {e}")
+
+        self.index = self.pc.Index(index_name)
+        logging.info(f"Connected to index {index_name}")
+
+    def upsert(self, vectors):
+        return self.index.upsert(vectors)
+
+    def delete(self, ids):
+        return self.index.delete(ids=ids)
+
+    def list(self, prefix=None):
+        return self.index.list(prefix=prefix)
+
+    def query(self, vector, top_k, include_metadata=True):
+        return self.index.query(vector=vector, top_k=top_k, include_metadata=include_metadata)
+
+
+class LocalVectorIndex:
+    """
+    In-process vector index over a normalized embedding matrix kept in a memory-mapped `.npy` file.
+
+    Queries score every vector with one matrix product and pick the top k with `argpartition`, which
+    for a corpus of a few thousand documents takes well under a millisecond and needs no network.
+    Upserts and deletes rewrite the matrix and the ids and metadata next to it, and swap them in
+    atomically, so concurrent queries see either the old or the new index. Writers hold a lock file
+    shared by every process using the directory and apply their changes to the latest version on
+    disk, and queries reload the index when another process has published a newer version. Results
+    have the same shape as Pinecone's (`matches` with `id`, `score` and `metadata`).
+
+    Attributes:
+        name: Name used to track which vectors the index holds.
+        directory: Directory holding the `vectors.<version>.npy` matrix and the `vectors.json` ids and metadata.
+        dimension: Length of the vectors.
+    """
+
+    def __init__(self, directory='bins/vector_index', dimension=384):
+        self.name = f"local:{os.path.abspath(directory)}"
+        self.directory = directory
+        self.dimension = dimension
+        self.manifest_filepath = os.path.join(directory, 'vectors.json')
+        self.lock_filepath = os.path.join(directory, '.vectors.lock')
+        self._lock = threading.Lock()
+        self._state = self._load()
+        logging.info(f"Opened local vector index in {directory} with {len(self._state[1])} vectors")
+
+    def __len__(self):
+        self._refresh()
+        return len(self._state[1])
+
+    def _manifest_stat(self):
+        try:
+            stat = os.stat(self.manifest_filepath)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _refresh(self):
+        # Another process may have published a newer version since it was loaded
+        if self._manifest_stat() != self._loaded_stat:
+            self._state = self._load()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, open(self.lock_filepath, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Changes are applied to the latest version, so no writer overwrites another's
+                self._refresh()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        # Taken before reading, so a version published while reading is picked up by the next refresh
+        self._loaded_stat = self._manifest_stat()
+        if self._loaded_stat is None:
+            self._version = 0
+            return np.empty((0, self.dimension), dtype=np.float32), [], []
+        with open(self.manifest_filepath, encoding='utf-8') as f:
+            manifest = json.load(f)
+        self._version = manifest["version"]
+        matrix = np.load(os.path.join(self.directory, manifest["vectors_file"]), mmap_mode='r')
+        if matrix.shape != (len(manifest["ids"]), self.dimension):
+            raise ValueError(f"{self.directory} holds vectors of shape {matrix.shape}, expected ({len(manifest['ids'])}, {self.dimension})")
+        return matrix, manifest["ids"], manifest["metadata"]
+
+    def _save(self, matrix, ids, metadata):
+        # Each version gets its own file, so a query still mapping the previous one is not disturbed
+        version = self._version + 1
+        vectors_file = f"vectors.{version}.npy"
+        np.save(os.path.join(self.directory, vectors_file), np.ascontiguousarray(matrix, dtype=np.float32))
+        tmp_filepath = f"{self.manifest_filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_filepath, 'w', encoding='utf-8') as f:
+            json.dump({"vectors_file": vectors_file, "version": version, "ids": ids, "metadata": metadata}, f, ensure_ascii=False)
+        os.replace(tmp_filepath, self.manifest_filepath)
+        self._state = self._load()
+        for filename in os.listdir(self.directory):
+            if filename.startswith("vectors.") and filename.endswith(".npy") and filename != vectors_file:
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError:
+                    # Still mapped by a reader on platforms that do not allow removing open files
+                    pass
+
+    def upsert(self, vectors):
+        """
+        Add or replace (id, values, metadata) vectors; values are normalized before they are stored.
+        """
+        with self._locked():
+            matrix, ids, metadata = self._state
+            rows = {vector_id: i for i, vector_id in enumerate(ids)}
+            matrix = np.array(matrix, dtype=np.float32)
+            ids = list(ids)
+            metadata = list(metadata)
+            new_rows = []
+            for vector_id, values, vector_metadata in vectors:
+                values = np.asarray(values, dtype=np.float32)
+                if values.shape != (self.dimension,):
+                    raise ValueError(f"Vector {vector_id} has {values.size} dimensions, expected {self.dimension}")
+                norm = np.linalg.norm(values)
+                values = values / norm if norm > 0 else values
+                if vector_id in rows:
+                    matrix[rows[vector_id]] = values
+                    metadata[rows[vector_id]] = vector_metadata or {}
+                else:
+                    rows[vector_id] = len(ids) + len(new_rows)
+                    new_rows.append(values)
+                    ids.append(vector_id)
+                    metadata.append(vector_metadata or {})
+            if new_rows:
+                matrix = np.vstack([matrix, np.asarray(new_rows, dtype=np.float32)])
+            self._save(matrix, ids, metadata)
+        return {"upserted_count": len(vectors)}
+
+    def delete(self, ids):
+        with self._locked():
+            matrix, current_ids, metadata = self._state
+            deleted = set(ids)
+            keep = [i for i, vector_id in enumerate(current_ids) if vector_id not in deleted]
+            if len(keep) == len(current_ids):
+                return
+            self._save(np.asarray(matrix)[keep], [current_ids[i] for i in keep], [metadata[i] for i in keep])
+
+    def list(self, prefix=None):
+        # One page of ids, like the pages yielded by Pinecone's list
+        self._refresh()
+        ids = self._state[1]
+        yield [vector_id for vector_id in ids if prefix is None or vector_id.startswith(prefix)]
+
+    def query(self, vector, top_k, include_metadata=True):
+        self._refresh()
+        matrix, ids, metadata = self._state
+        if not ids:
+            return {"matches": []}
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        scores = matrix @ (vector / norm if norm > 0 else vector)
+        top_k = min(top_k, len(ids))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return {
+            "matches": [
+                {"id": ids[i], "score": float(scores[i]), **({"metadata": metadata[i]} if include_metadata else {})}
+                for i in top
+            ]
+        }
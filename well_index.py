@@ -0,0 +1,175 @@
+import numpy as np
+from geopy.distance import geodesic
+from sklearn.neighbors import BallTree
+
+from geo import EARTH_RADIUS_KM
+from well_store import WELL_DTYPE
+
+# Haversine and WGS84 geodesic distances differ by less than 0.6%, so candidates are
+# gathered over a slightly larger radius and then refined with the exact geodesic distance
+CANDIDATE_SLACK = 1.01
+
+
+class WellIndex:
+    """
+    Spatial index over the wells of the network used to answer radius queries.
+
+    The ball tree covers the first `n_indexed` wells. Wells added or updated since it was built are
+    appended after them and scanned directly, and replaced or removed wells are flagged in `retired`
+    rather than deleted, so `with_updates` can share the tree and keeps positions stable.
+
+    Attributes:
+        node_ids: Node identifiers of the wells in the well network.
+        lats: Latitudes of the wells.
+        lons: Longitudes of the wells.
+        depths: Measured depth to water of the wells, in meters.
+        n_indexed: Number of leading wells covered by the ball tree.
+        retired: Flags the positions of wells that were replaced or removed.
+    """
+
+    def __init__(self, node_ids, lats, lons, depths, tree=None, n_indexed=None, retired=None):
+        self.node_ids = np.asarray(node_ids)
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.depths = np.asarray(depths, dtype=np.float64)
+        self.n_indexed = len(self.lats) if n_indexed is None else n_indexed
+        if tree is None:
+            indexed = np.column_stack([self.lats[:self.n_indexed], self.lons[:self.n_indexed]])
+            tree = BallTree(np.radians(indexed), metric='haversine')
+        self.tree = tree
+        self.retired = np.zeros(len(self.lats), dtype=bool) if retired is None else retired
+        self.n_retired = int(self.retired.sum())
+
+    @classmethod
+    def from_graph(cls, well_net):
+        node_ids = list(well_net.nodes)
+        lats = [well_net.nodes[i]['Lat'] for i in node_ids]
+        lons = [well_net.nodes[i]['Lon'] for i in node_ids]
+        depths = [well_net.nodes[i]['DepthToWater_m'] for i in node_ids]
+        return cls(node_ids, lats, lons, depths)
+
+    @classmethod
+    def from_store(cls, well_store):
+        return cls(well_store.node_ids, well_store.lats, well_store.lons, well_store.depths)
+
+    def __len__(self):
+        return len(self.node_ids) - self.n_retired
+
+    @property
+    def n_pending(self):
+        return len(self.node_ids) - self.n_indexed
+
+    def with_updates(self, wells=(), retired_node_ids=()):
+        """
+        Copy of the index with `wells` added or replaced and the wells of `retired_node_ids` removed.
+
+        Args:
+            wells (list): (node_id, lat, lon, depth) of the wells to add, replacing live wells with the same node id.
+            retired_node_ids (iterable): Node ids of the wells to remove.
+        """
+        # Only the last update of a node id in the batch is kept
+        latest = {int(node_id): (node_id, lat, lon, depth) for node_id, lat, lon, depth in wells}
+        wells = list(latest.values())
+        replaced = np.isin(self.node_ids, list(latest) + [int(node_id) for node_id in retired_node_ids])
+        retired = np.concatenate([self.retired | replaced, np.zeros(len(wells), dtype=bool)])
+        node_ids, lats, lons, depths = zip(*wells) if wells else ((), (), (), ())
+        return WellIndex(
+            np.concatenate([self.node_ids, np.asarray(node_ids, dtype=self.node_ids.dtype)]),
+            np.concatenate([self.lats, lats]),
+            np.concatenate([self.lons, lons]),
+            np.concatenate([self.depths, depths]),
+            tree=self.tree,
+            n_indexed=self.n_indexed,
+            retired=retired,
+        )
+
+    def live_positions(self):
+        return np.flatnonzero(~self.retired)
+
+    def live_records(self):
+        live = self.live_positions()
+        records = np.empty(len(live), dtype=WELL_DTYPE)
+        records['node_id'] = self.node_ids[live]
+        records['Lat'] = self.lats[live]
+        records['Lon'] = self.lons[live]
+        records['DepthToWater_m'] = self.depths[live]
+        return records
+
+    def depths_at(self, positions):
+        return self.depths[positions]
+
+    def next_node_id(self):
+        return int(self.node_ids.max()) + 1 if len(self.node_ids) else 0
+
+    def memory_bytes(self):
+        arrays = (self.node_ids, self.lats, self.lons, self.depths, self.retired) + tuple(self.tree.get_arrays())
+        return sum(array.nbytes for array in arrays)
+
+    def query_radius(self, coords, threshold_km):
+        """
+        Find the wells strictly closer than `threshold_km` to `coords`.
+
+        Returns:
+            tuple: Positions of the matching wells in the index and their geodesic distances in km.
+        """
+        lat, lon = coords
+        radius = threshold_km * CANDIDATE_SLACK / EARTH_RADIUS_KM
+        candidates = self.tree.query_radius(np.radians([[lat, lon]]), r=radius)[0]
+        return self._refine(lat, lon, self._with_pending(lat, lon, candidates, radius), threshold_km)
+
+    def query_radius_many(self, coords, threshold_km):
+        """
+        Find the wells strictly closer than `threshold_km` to each of `coords` with a single tree query.
+
+        Returns:
+            list: One (positions, distances) tuple per location, as returned by `query_radius`.
+        """
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        radius = threshold_km * CANDIDATE_SLACK / EARTH_RADIUS_KM
+        candidates = self.tree.query_radius(np.radians(coords), r=radius)
+        return [
+            self._refine(lat, lon, self._with_pending(lat, lon, c, radius), threshold_km)
+            for (lat, lon), c in zip(coords, candidates)
+        ]
+
+    def query_nearest(self, coords, k, start_km, max_km):
+        """
+        Find the `k` wells nearest to `coords`, doubling the search radius from `start_km` until `k` wells
+        are found or `max_km` is reached.
+
+        Returns:
+            tuple: Positions of up to `k` wells sorted by geodesic distance, their distances in km and
+                the radius in km the search stopped at.
+        """
+        radius_km = start_km
+        while True:
+            positions, distances = self.query_radius(coords, radius_km)
+            if len(positions) >= k or radius_km >= max_km:
+                break
+            radius_km = min(radius_km * 2, max_km)
+        nearest = np.argsort(distances, kind='stable')[:k]
+        return positions[nearest], distances[nearest], radius_km
+
+    def _with_pending(self, lat, lon, candidates, radius):
+        if self.n_pending:
+            # Wells appended since the tree was built are few, so they are scanned with the haversine distance
+            pending_lats = np.radians(self.lats[self.n_indexed:])
+            pending_lons = np.radians(self.lons[self.n_indexed:])
+            lat, lon = np.radians(lat), np.radians(lon)
+            a = np.sin((pending_lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(pending_lats) * np.sin((pending_lons - lon) / 2) ** 2
+            within = np.flatnonzero(2 * np.arcsin(np.sqrt(np.minimum(a, 1))) <= radius)
+            candidates = np.concatenate([candidates, within + self.n_indexed])
+        if self.n_retired:
+            candidates = candidates[~self.retired[candidates]]
+        return candidates
+
+    def _refine(self, lat, lon, candidates, threshold_km):
+        positions = []
+        distances = []
+        # Sorted so that neighbors come back in the same order as the nodes of the network
+        for pos in np.sort(candidates):
+            distance = geodesic((lat, lon), (self.lats[pos], self.lons[pos])).kilometers
+            if distance < threshold_km:
+                positions.append(pos)
+                distances.append(distance)
+        return np.asarray(positions, dtype=np.intp), np.asarray(distances, dtype=np.float64)
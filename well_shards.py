@@ -0,0 +1,334 @@
+import argparse
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+from geo import KM_PER_DEGREE
+from well_index import CANDIDATE_SLACK, WellIndex
+from well_store import WellStore
+
+
+def shard_cells(lats, lons, cell_deg):
+    # Columns wrap around the antimeridian, rows run from the south pole
+    n_cols = round(360 / cell_deg)
+    rows = np.floor((np.asarray(lats) + 90) / cell_deg).astype(np.int64)
+    cols = np.floor((np.asarray(lons) + 180) / cell_deg).astype(np.int64) % n_cols
+    return rows, cols
+
+
+def shard_keys_within(lat, lon, radius_km, cell_deg):
+    """
+    Keys of the grid cells that may hold points within `radius_km` of `lat`, `lon`.
+    """
+    radius_deg = radius_km * CANDIDATE_SLACK / KM_PER_DEGREE
+    min_lat, max_lat = max(lat - radius_deg, -90.0), min(lat + radius_deg, 90.0)
+    cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    n_cols = round(360 / cell_deg)
+    rows = range(math.floor((min_lat + 90) / cell_deg), math.floor((max_lat + 90) / cell_deg) + 1)
+    if cos_lat <= radius_deg / 180:
+        # Near the poles the radius spans every longitude
+        cols = range(n_cols)
+    else:
+        lon_radius_deg = radius_deg / cos_lat
+        first, last = math.floor((lon - lon_radius_deg + 180) / cell_deg), math.floor((lon + lon_radius_deg + 180) / cell_deg)
+        cols = range(n_cols) if last - first + 1 >= n_cols else [col % n_cols for col in range(first, last + 1)]
+    return [f"{row}:{col}" for row in rows for col in cols]
+
+
+def write_shards(records, directory, cell_deg=0.5):
+    """
+    Write well records as a grid-sharded store: `wells.<version>.npy` holds the records sorted by grid
+    cell and `manifest.json` names it, with the cell size and the [start, end) range of the records of each cell.
+
+    The records go to a new file and only the manifest is replaced, so a reader opening the directory
+    sees either the previous records and manifest or the new ones, and an interrupted write leaves the
+    previous store untouched. Records superseded by the new manifest are deleted afterwards.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rows, cols = shard_cells(records['Lat'], records['Lon'], cell_deg)
+    cells = rows * round(360 / cell_deg) + cols
+    order = np.argsort(cells, kind='stable')
+    wells_file = f"wells.{time.time_ns()}.npy"
+    WellStore(np.asarray(records)[order]).save(os.path.join(directory, wells_file))
+    _, starts, counts = np.unique(cells[order], return_index=True, return_counts=True)
+    shards = {
+        f"{rows[order[start]]}:{cols[order[start]]}": [int(start), int(start + count)]
+        for start, count in zip(starts, counts)
+    }
+    manifest = {
+        "cell_deg": cell_deg,
+        "n_wells": len(records),
+        "max_node_id": int(records['node_id'].max()) if len(records) else -1,
+        "shards": shards,
+        "wells_file": wells_file,
+    }
+    tmp_filepath = os.path.join(directory, f"manifest.json.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_filepath, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_filepath, os.path.join(directory, 'manifest.json'))
+    # Processes that have the previous records memory-mapped keep reading them after the file is removed
+    for other in os.listdir(directory):
+        if other != wells_file and other.startswith('wells.') and other.endswith('.npy'):
+            try:
+                os.remove(os.path.join(directory, other))
+            except OSError:
+                pass
+    return manifest
+
+
+class WellShards:
+    """
+    Grid-sharded well store whose shards are loaded on demand and kept in an LRU cache.
+
+    The records of the store are memory-mapped, and a shard only turns into a WellIndex (with its
+    ball tree) the first time a query touches its grid cell. Shards are evicted least recently used
+    first once their combined size exceeds `memory_budget_bytes`. Neighbouring shards of the ones a
+    query used are loaded in the background while the budget has room, since the next query of a
+    user is usually close to the last one.
+
+    Attributes:
+        directory: Directory holding `manifest.json` and the `wells.<version>.npy` records it names.
+        records: Memory-mapped well records, sorted by shard.
+        cell_deg: Size of the grid cells in degrees.
+        shards: [start, end) range of the records of each shard, by shard key.
+        memory_budget_bytes: Combined size of the loaded shards above which the least recently used are evicted.
+    """
+
+    def __init__(self, directory, memory_budget_bytes=256 * 1024 * 1024, prefetch=True):
+        self.directory = directory
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            manifest = json.load(f)
+        # Stores written before the records were versioned name no file
+        self.records = WellStore.load(os.path.join(directory, manifest.get("wells_file", 'wells.npy'))).records
+        self.cell_deg = manifest["cell_deg"]
+        self.shards = manifest["shards"]
+        self.max_node_id = manifest["max_node_id"]
+        self.memory_budget_bytes = memory_budget_bytes
+        self.loaded = OrderedDict()
+        self.loaded_bytes = 0
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "prefetched": 0}
+        self._loading = {}
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='well-shard-prefetch') if prefetch else None
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, key, prefetched=False):
+        """
+        WellIndex of the shard `key`, loading it if needed. Threads asking for a shard being loaded wait for it.
+        """
+        with self._lock:
+            shard = self.loaded.get(key)
+            if shard is not None:
+                self.loaded.move_to_end(key)
+                self.counters["hits"] += 1
+                return shard
+            future = self._loading.get(key)
+            owner = future is None
+            if owner:
+                future = self._loading[key] = Future()
+                self.counters["prefetched" if prefetched else "misses"] += 1
+        if not owner:
+            return future.result()
+
+        try:
+            start, end = self.shards[key]
+            shard = WellIndex.from_store(WellStore(np.array(self.records[start:end])))
+        except Exception as e:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self.loaded[key] = shard
+            self.loaded_bytes += shard.memory_bytes()
+            del self._loading[key]
+            self._evict()
+        future.set_result(shard)
+        return shard
+
+    def close(self):
+        # Prefetches asked for afterwards are skipped
+        prefetcher, self._prefetcher = self._prefetcher, None
+        if prefetcher is not None:
+            prefetcher.shutdown(wait=False)
+
+    def prefetch(self, keys):
+        if self._prefetcher is None:
+            return
+        with self._lock:
+            # Prefetching only fills free room, it never evicts shards in use
+            if self.loaded_bytes >= self.memory_budget_bytes:
+                return
+            keys = [key for key in keys if key in self.shards and key not in self.loaded
+                    and key not in self._loading and key not in self._queued]
+            self._queued.update(keys)
+        for key in keys:
+            self._prefetcher.submit(self._prefetch, key)
+
+    def _prefetch(self, key):
+        try:
+            with self._lock:
+                self._queued.discard(key)
+                if self.loaded_bytes >= self.memory_budget_bytes or key in self.loaded:
+                    return
+            self.get(key, prefetched=True)
+        except Exception as e:
+            logging.error(f"Error prefetching well shard {key}: {e}")
+
+    def _evict(self):
+        # The most recently used shard is kept even if it alone exceeds the budget
+        while self.loaded_bytes > self.memory_budget_bytes and len(self.loaded) > 1:
+            _, shard = self.loaded.popitem(last=False)
+            self.loaded_bytes -= shard.memory_bytes()
+            self.counters["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, shards=len(self.shards), loaded=len(self.loaded), loaded_bytes=self.loaded_bytes)
+
+
+class ShardedWellIndex:
+    """
+    Spatial index over a grid-sharded well store, answering the same queries as WellIndex.
+
+    Positions are offsets in the sharded store, so `depths_at` reads the depths of neighbors from the
+    memory-mapped records without loading their shards. Wells added or updated since the store was
+    written are kept in a small WellIndex appended after the store (positions from `len(store)` on),
+    and replaced or removed wells of the store are filtered out by node id, so `with_updates` shares
+    the loaded shards like WellIndex shares its ball tree.
+
+    Attributes:
+        store: The WellShards the shards are loaded from.
+        pending: WellIndex of the wells added or updated since the store was written, or None.
+        retired_node_ids: Sorted node ids of the wells of the store that were replaced or removed.
+    """
+
+    def __init__(self, store, pending=None, retired_node_ids=None):
+        self.store = store
+        self.pending = pending
+        self.retired_node_ids = np.asarray([] if retired_node_ids is None else retired_node_ids, dtype=np.int64)
+        self._n_retired = None
+
+    @classmethod
+    def open(cls, directory, memory_budget_bytes=256 * 1024 * 1024, prefetch=True):
+        return cls(WellShards(directory, memory_budget_bytes, prefetch))
+
+    def close(self):
+        self.store.close()
+
+    def __len__(self):
+        if self._n_retired is None:
+            # A single pass over the node id column, only needed for the well count
+            self._n_retired = int(np.isin(self.store.records['node_id'], self.retired_node_ids).sum()) if len(self.retired_node_ids) else 0
+        return len(self.store) - self._n_retired + (len(self.pending) if self.pending is not None else 0)
+
+    @property
+    def n_pending(self):
+        return len(self.pending.node_ids) if self.pending is not None else 0
+
+    def with_updates(self, wells=(), retired_node_ids=()):
+        """
+        Copy of the index with `wells` added or replaced and the wells of `retired_node_ids` removed.
+
+        Args:
+            wells (list): (node_id, lat, lon, depth) of the wells to add, replacing live wells with the same node id.
+            retired_node_ids (iterable): Node ids of the wells to remove.
+        """
+        latest = {int(node_id): (node_id, lat, lon, depth) for node_id, lat, lon, depth in wells}
+        retired_node_ids = [int(node_id) for node_id in retired_node_ids]
+        retired = np.union1d(self.retired_node_ids, np.asarray(list(latest) + retired_node_ids, dtype=np.int64))
+        pending = self.pending
+        if pending is not None:
+            pending = pending.with_updates(latest.values(), retired_node_ids)
+        elif latest:
+            pending = WellIndex(*zip(*latest.values()))
+        return ShardedWellIndex(self.store, pending, retired)
+
+    def live_records(self):
+        records = np.asarray(self.store.records)
+        if len(self.retired_node_ids):
+            records = records[~np.isin(records['node_id'], self.retired_node_ids)]
+        if self.pending is not None:
+            records = np.concatenate([records, self.pending.live_records()])
+        return records
+
+    def depths_at(self, positions):
+        positions = np.asarray(positions, dtype=np.intp)
+        n_store = len(self.store)
+        depths = np.empty(len(positions), dtype=np.float64)
+        in_store = positions < n_store
+        depths[in_store] = self.store.records['DepthToWater_m'][positions[in_store]]
+        if not in_store.all():
+            depths[~in_store] = self.pending.depths[positions[~in_store] - n_store]
+        return depths
+
+    def next_node_id(self):
+        next_node_id = self.store.max_node_id + 1
+        if self.pending is not None:
+            next_node_id = max(next_node_id, self.pending.next_node_id())
+        return next_node_id
+
+    def query_radius(self, coords, threshold_km):
+        """
+        Find the wells strictly closer than `threshold_km` to `coords`, loading the shards the radius overlaps.
+
+        Returns:
+            tuple: Positions of the matching wells in the index and their geodesic distances in km.
+        """
+        lat, lon = coords
+        keys = [key for key in shard_keys_within(lat, lon, threshold_km, self.store.cell_deg) if key in self.store.shards]
+        all_positions = []
+        all_distances = []
+        for key in keys:
+            positions, distances = self.store.get(key).query_radius(coords, threshold_km)
+            if len(positions) and len(self.retired_node_ids):
+                live = ~np.isin(self.store.records['node_id'][positions + self.store.shards[key][0]], self.retired_node_ids)
+                positions, distances = positions[live], distances[live]
+            all_positions.append(positions + self.store.shards[key][0])
+            all_distances.append(distances)
+        if self.pending is not None:
+            positions, distances = self.pending.query_radius(coords, threshold_km)
+            all_positions.append(positions + len(self.store))
+            all_distances.append(distances)
+        self.store.prefetch(shard_keys_within(lat, lon, threshold_km + self.store.cell_deg * KM_PER_DEGREE, self.store.cell_deg))
+
+        if not all_positions:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float64)
+        positions = np.concatenate(all_positions).astype(np.intp)
+        distances = np.concatenate(all_distances)
+        order = np.argsort(positions, kind='stable')
+        return positions[order], distances[order]
+
+    def query_radius_many(self, coords, threshold_km):
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        return [self.query_radius((lat, lon), threshold_km) for lat, lon in coords]
+
+    query_nearest = WellIndex.query_nearest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Partition a well store into grid shards loaded on demand by the predictor')
+    parser.add_argument("store", help="Path to the .npy well store")
+    parser.add_argument("output", nargs='?', default='bins/well_shards', help="Directory the shards are written to")
+    parser.add_argument("--cell-deg", type=float, default=0.5, help="Size of the grid cells in degrees")
+    args = parser.parse_args()
+
+    records = WellStore.load(args.store).records
+    manifest = write_shards(records, args.output, args.cell_deg)
+    print(f"Wrote {manifest['n_wells']} wells in {len(manifest['shards'])} shards of {args.cell_deg} degrees to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
+
+# python well_shards.py bins/well_network.npy bins/well_shards --cell-deg 0.5
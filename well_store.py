@@ -0,0 +1,110 @@
+import argparse
+import os
+import pickle
+import threading
+
+import numpy as np
+
+WELL_DTYPE = np.dtype([
+    ('node_id', '<i8'),
+    ('Lat', '<f8'),
+    ('Lon', '<f8'),
+    ('DepthToWater_m', '<f8'),
+])
+NODE_ID_RANGE = (int(np.iinfo(np.int64).min), int(np.iinfo(np.int64).max))
+
+
+def check_node_id(node_id):
+    """
+    Return `node_id` as an int, raising ValueError if it is not an integer the store can hold.
+    """
+    if isinstance(node_id, bool) or not isinstance(node_id, (int, np.integer)):
+        raise ValueError(f"Well node ids must be integers, got {node_id!r}")
+    if not NODE_ID_RANGE[0] <= node_id <= NODE_ID_RANGE[1]:
+        raise ValueError(f"Well node id {node_id} does not fit in a 64-bit integer")
+    return int(node_id)
+
+
+class WellStore:
+    """
+    Compact array-backed store of the well fields the predictor reads.
+
+    Each well is one record of a structured NumPy array holding its node id in the original well
+    network graph, its `Lat`, `Lon` and `DepthToWater_m`. The array is saved as a plain `.npy` file
+    so it can be memory-mapped at load instead of unpickled.
+
+    Attributes:
+        records: Structured array of WELL_DTYPE records, one per well.
+    """
+
+    def __init__(self, records):
+        self.records = records
+
+    @classmethod
+    def from_graph(cls, well_net):
+        records = np.empty(well_net.number_of_nodes(), dtype=WELL_DTYPE)
+        for i, (node_id, attributes) in enumerate(well_net.nodes(data=True)):
+            try:
+                node_id = check_node_id(node_id)
+            except ValueError as e:
+                raise ValueError(f"{e}; relabel the well network with networkx.convert_node_labels_to_integers") from None
+            records[i] = (node_id, attributes['Lat'], attributes['Lon'], attributes['DepthToWater_m'])
+        return cls(records)
+
+    @classmethod
+    def load(cls, filepath, mmap=True):
+        records = np.load(filepath, mmap_mode='r' if mmap else None)
+        if records.dtype != WELL_DTYPE:
+            raise ValueError(f"{filepath} does not hold well records (dtype {records.dtype})")
+        return cls(records)
+
+    def save(self, filepath):
+        # Written to a temporary file of this writer first so readers never map a partially written store
+        tmp_filepath = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_filepath, 'wb') as f:
+            np.save(f, np.ascontiguousarray(self.records, dtype=WELL_DTYPE))
+        os.replace(tmp_filepath, filepath)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def node_ids(self):
+        return self.records['node_id']
+
+    @property
+    def lats(self):
+        return self.records['Lat']
+
+    @property
+    def lons(self):
+        return self.records['Lon']
+
+    @property
+    def depths(self):
+        return self.records['DepthToWater_m']
+
+
+def convert_gpickle(gpickle_filepath, store_filepath):
+    with open(gpickle_filepath, 'rb') as f:
+        well_net = pickle.load(f)
+    well_store = WellStore.from_graph(well_net)
+    well_store.save(store_filepath)
+    return well_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert a networkx well network pickle to a well store')
+    parser.add_argument("gpickle", help="Path to the networkx well network pickle")
+    parser.add_argument("output", nargs='?', help="Path of the .npy well store (defaults to the pickle path with .npy)")
+    args = parser.parse_args()
+
+    output = args.output or os.path.splitext(args.gpickle)[0] + '.npy'
+    well_store = convert_gpickle(args.gpickle, output)
+    print(f"Wrote {len(well_store)} wells to {output}")
+
+
+if __name__ == '__main__':
+    main()
+
+# python well_store.py bins/well_network.gpickle bins/well_network.npy
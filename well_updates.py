@@ -0,0 +1,70 @@
+import json
+import logging
+import os
+import threading
+import time
+
+
+class WellDeltaLog:
+    """
+    Append-only log of the changes made to the well network since its store was last compacted.
+
+    Each line is a JSON record, either `{"op": "upsert", "node_id", "Lat", "Lon", "DepthToWater_m"}`
+    for an added or re-measured well or `{"op": "retire", "node_id"}` for a removed one, with the `base`
+    fingerprint of the well network the change was made to. The log is
+    replayed over the well store at load, and applying it twice gives the same network, so a crash
+    between compacting the store and truncating the log loses nothing.
+
+    Attributes:
+        filepath: Path to the JSON lines file.
+    """
+
+    def __init__(self, filepath='bins/well_network.delta.jsonl'):
+        self.filepath = filepath
+        self._lock = threading.Lock()
+
+    def append(self, ops):
+        now = time.time()
+        lines = ''.join(json.dumps(dict(op, at=now)) + '\n' for op in ops)
+        with self._lock, open(self.filepath, 'a') as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read(self):
+        if not os.path.exists(self.filepath):
+            return []
+        ops = []
+        with self._lock, open(self.filepath) as f:
+            for line_number, line in enumerate(f, 1):
+                try:
+                    ops.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Only the last line can be cut short, by a crash while appending
+                    logging.warning(f"Skipping unreadable line {line_number} of {self.filepath}")
+        return ops
+
+    def truncate(self):
+        with self._lock, open(self.filepath, 'w'):
+            pass
+
+
+def squash_ops(ops):
+    """
+    Reduce a sequence of delta log records to the final state of each well they touch.
+
+    Returns:
+        tuple: (node_id, lat, lon, depth) of the wells added or updated, and the node ids of the retired wells.
+    """
+    final = {}
+    for op in ops:
+        node_id = int(op['node_id'])
+        if op['op'] == 'upsert':
+            final[node_id] = (node_id, float(op['Lat']), float(op['Lon']), float(op['DepthToWater_m']))
+        elif op['op'] == 'retire':
+            final[node_id] = None
+        else:
+            raise ValueError(f"Unknown well network operation: {op['op']}")
+    wells = [well for well in final.values() if well is not None]
+    retired_node_ids = [node_id for node_id, well in final.items() if well is None]
+    return wells, retired_node_ids